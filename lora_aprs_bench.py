@@ -0,0 +1,413 @@
+"""
+Benchmarks for the message pipeline and the table renderers.
+
+Runs entirely in-process: synthetic log, beacon and decoded-station payloads are fed
+through handle_message, process_unique_callsigns and the table controls, and through
+mqtt_handler via a local stand-in for the MQTT broker, so no network is needed.
+
+    python3 lora_aprs_bench.py [--stations 10 1000 10000 100000] [--json results.json]
+"""
+import sys
+import argparse  # For command-line options
+import asyncio
+import json
+import random
+import re
+import time
+import tracemalloc  # For peak memory
+from datetime import datetime, timedelta, timezone
+
+import lora_aprs_core
+from lora_aprs_core import (
+    DEFAULT_LOG_CAPACITY, DEFAULT_MAX_ROWS, positive_int,
+    IGateState, IngestQueue, new_connection_status, mqtt_handler, to_float, to_text,
+    parse_timestamp, _parse_timestamp, local_time_text, route_topic, _route_cache, validate_callsign,
+    JSON_BACKEND, DECODED_FIELDS, decode_decoded,
+)
+from lora_aprs_terminal import (
+    BEACON_COLUMNS, DECODED_COLUMNS, UNIQUE_DIRECT_COLUMNS, UNIQUE_DIGIPEATED_COLUMNS,
+    RenderScheduler, TableControl, UniqueCallsignTable, handle_message, process_messages,
+    process_unique_callsigns, format_beacon_row, format_decoded_row,
+    unique_direct_row_prefix, unique_digipeated_row_prefix,
+)
+
+BENCH_IGATE = 'BENCH1'
+DEFAULT_STATIONS = [10, 1000, 10000, 100000]
+DEFAULT_MIN_MESSAGES = 20000  # Per scenario; at least two messages per station are always sent
+DEFAULT_RENDERS = 20
+RENDER_WIDTH, RENDER_HEIGHT = 200, 40  # Viewport of one table, in characters
+TIMESTAMP_COUNT = 100000
+TIMESTAMP_RATES = [1, 10, 100, 1000]  # Messages sharing each timestamp
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the message pipeline and table renderers')
+    parser.add_argument('--stations', type=positive_int, nargs='+', default=DEFAULT_STATIONS,
+                        help='station counts to benchmark (default: %(default)s)')
+    parser.add_argument('--messages', type=positive_int, default=None,
+                        help=f'messages per scenario (default: max({DEFAULT_MIN_MESSAGES}, 2 x stations))')
+    parser.add_argument('--renders', type=positive_int, default=DEFAULT_RENDERS,
+                        help='renders per table (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default: %(default)s)')
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory pass')
+    parser.add_argument('--json', metavar='FILE', help='also write the results as JSON')
+    return parser.parse_args(argv)
+
+
+def generate_messages(station_count, message_count, seed=1):
+    """
+    Build (topic, payload) pairs for one iGate: 10% logs, 10% beacons and the rest
+    decoded-station messages spread over station_count callsigns, 30% of them digipeated.
+    """
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    digipeaters = [f"DIGI{n}" for n in range(min(20, station_count))]
+    messages = []
+    for i in range(message_count):
+        timestamp = (start + timedelta(seconds=i // 10)).isoformat()  # About ten messages a second
+        kind = i % 10
+        if kind == 0:
+            topic = f"lora_aprs/{BENCH_IGATE}/logs"
+            payload = {'timestamp': timestamp, 'raw_message': f"{BENCH_IGATE}>APLRG1,WIDE1-1:!5555.55N/00300.00W# log {i}"}
+        elif kind == 1:
+            topic = f"lora_aprs/{BENCH_IGATE}/{BENCH_IGATE}/json_message"
+            payload = {
+                'timestamp': timestamp, 'destination': 'APLRG1', 'path': 'WIDE1-1',
+                'latitude': 55.9, 'longitude': -3.1, 'elevation': 120, 'battery': '4.1V',
+                'comment': 'LoRa APRS iGate benchmark beacon', 'digipeated_via': None, 'country_code': 'GB',
+            }
+        else:
+            callsign = f"S{rng.randrange(station_count)}"
+            topic = f"lora_aprs/{BENCH_IGATE}/{callsign}/json_message"
+            payload = {
+                'timestamp': timestamp, 'destination': 'APLRT1', 'path': 'WIDE1-1',
+                'signal_quality': round(rng.uniform(-15, 12), 2), 'signal_strength': rng.randint(-125, -60),
+                'latitude': round(55 + rng.random(), 5), 'longitude': round(-3 + rng.random(), 5),
+                'elevation': rng.randint(0, 900), 'distance': round(rng.uniform(0.5, 80), 1),
+                'battery': f"{rng.uniform(3.3, 4.2):.2f}V" if rng.random() < 0.2 else None,
+                'comment': 'LoRa APRS tracker', 'country_code': 'GB',
+                'digipeated_via': rng.choice(digipeaters) if digipeaters and rng.random() < 0.3 else None,
+            }
+        messages.append((topic, json.dumps(payload).encode()))
+    return messages
+
+
+def legacy_format_timestamp(timestamp):
+    # What every append function did per message before timestamps were memoized
+    try:
+        return datetime.fromisoformat(timestamp).astimezone().strftime('%Y-%m-%d %H:%M:%S')
+    except Exception:
+        return 'Invalid Timestamp'
+
+
+def bench_timestamps(count=TIMESTAMP_COUNT, rates=TIMESTAMP_RATES):
+    """Timestamps per second parsed with and without memoization, at several message rates."""
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    results = []
+    for rate in rates:
+        timestamps = [(start + timedelta(seconds=i // rate)).isoformat() for i in range(count)]
+        t0 = time.perf_counter()
+        for timestamp in timestamps:
+            legacy_format_timestamp(timestamp)
+        legacy = time.perf_counter() - t0
+        _parse_timestamp.cache_clear()
+        local_time_text.cache_clear()
+        t0 = time.perf_counter()
+        for timestamp in timestamps:
+            parse_timestamp(timestamp)
+        memoized = time.perf_counter() - t0
+        results.append({'msgs_per_timestamp': rate, 'legacy_per_s': count / legacy, 'memoized_per_s': count / memoized})
+    return results
+
+
+def legacy_route_topic(topic):
+    # Per-message routing as handle_message used to do it, for comparison
+    parts = topic.split('/')
+    if len(parts) == 3:
+        if parts[2].lower() == 'logs':
+            return 'log', parts[1].upper(), None
+        return None
+    elif len(parts) >= 4:
+        igate = parts[1].upper()
+        message_type = parts[3].lower()
+        if message_type == 'logs':
+            return 'log', igate, None
+        elif message_type == 'json_message':
+            if parts[2].upper() == igate:
+                return 'beacon', igate, None
+            return 'decoded', igate, parts[2]
+    return None
+
+
+def legacy_validate_callsign(callsign):
+    # The validator compiled its pattern on every call
+    pattern = re.compile(r"^(?=[^-]*\d)(?=(?:[^-]*[A-Za-z]){2,})[A-Za-z0-9]{1,7}(?:-[A-Za-z0-9]{1,2})?$")
+    return bool(pattern.match(callsign))
+
+
+def bench_routing(messages):
+    """Nanoseconds per message for topic routing and callsign validation, before and after caching."""
+    topics = [topic for topic, payload in messages]
+    callsigns = [topic.split('/')[2] for topic in topics if topic.count('/') >= 3]
+    results = {}
+    _route_cache.clear()
+    validate_callsign.cache_clear()
+    for name, function, values in (
+        ('route_legacy_ns', legacy_route_topic, topics),
+        ('route_cached_ns', route_topic, topics),
+        ('validate_legacy_ns', legacy_validate_callsign, callsigns),
+        ('validate_cached_ns', validate_callsign, callsigns),
+    ):
+        t0 = time.perf_counter()
+        for value in values:
+            function(value)
+        results[name] = (time.perf_counter() - t0) / len(values) * 1e9
+    return results
+
+
+def legacy_decode(payload):
+    # The decode path before the decoder layer: text, then a generic dict, then one get per field
+    decoded = json.loads(payload.decode())
+    return tuple(decoded.get(field) for field in DECODED_FIELDS)
+
+
+def bench_decoding(messages):
+    """Nanoseconds per decoded-station payload with the stdlib path and the selected backend."""
+    payloads = [payload for topic, payload in messages if topic.endswith('/json_message')]
+    results = {'backend': JSON_BACKEND}
+    for name, function in (('legacy_ns', legacy_decode), ('decoder_ns', decode_decoded)):
+        t0 = time.perf_counter()
+        for payload in payloads:
+            function(payload)
+        results[name] = (time.perf_counter() - t0) / len(payloads) * 1e9
+    return results
+
+
+def local_broker(messages, chunk=64):
+    """
+    Return a drop-in replacement for aiomqtt.Client that delivers messages to the
+    matching subscriptions, yielding to the event loop every chunk messages like a
+    socket read would, and then stays connected without traffic.
+    """
+
+    class LocalMessage:
+        def __init__(self, topic, payload):
+            self.topic = topic
+            self.payload = payload
+
+    class LocalClient:
+        def __init__(self, *args, **kwargs):
+            self.prefixes = []
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            return False
+
+        async def subscribe(self, topic, *args, **kwargs):
+            self.prefixes.append(topic.rstrip('#'))
+
+        @property
+        def messages(self):
+            return self._deliver()
+
+        async def _deliver(self):
+            prefixes = tuple(self.prefixes)
+            for index, (topic, payload) in enumerate(messages):
+                if topic.startswith(prefixes):
+                    yield LocalMessage(topic, payload)
+                if index % chunk == 0:
+                    await asyncio.sleep(0)
+            await asyncio.Event().wait()
+
+    return LocalClient
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def new_pipeline():
+    # Same wiring as run_application, without an Application behind the scheduler
+    state = IGateState(BENCH_IGATE, DEFAULT_LOG_CAPACITY)
+    routes = {BENCH_IGATE: [state]}
+    retention = {'max_rows': DEFAULT_MAX_ROWS, 'max_age': None}
+    scheduler = RenderScheduler(None, {})
+    return state, routes, retention, scheduler
+
+
+async def bench_pipeline(messages):
+    """handle_message throughput and per-message latency."""
+    state, routes, retention, scheduler = new_pipeline()
+    latencies = []
+    clock = time.perf_counter
+    started = clock()
+    for topic, payload in messages:
+        t0 = clock()
+        await handle_message(topic, payload, routes, retention, scheduler)
+        latencies.append(clock() - t0)
+    elapsed = clock() - started
+    latencies.sort()
+    return state, {
+        'msgs_per_s': len(messages) / elapsed,
+        'p50_us': percentile(latencies, 0.50) * 1e6,
+        'p90_us': percentile(latencies, 0.90) * 1e6,
+        'p99_us': percentile(latencies, 0.99) * 1e6,
+        'max_us': latencies[-1] * 1e6,
+    }
+
+
+def bench_unique_callsigns(messages):
+    """process_unique_callsigns alone, on payloads parsed up front."""
+    state, routes, retention, scheduler = new_pipeline()
+    updates = []
+    for topic, payload in messages:
+        parts = topic.split('/')
+        if len(parts) >= 4 and parts[2] != BENCH_IGATE:
+            data = json.loads(payload)
+            updates.append((
+                parts[2], to_text(data.get('digipeated_via'), shared=True),
+                to_float(data.get('signal_quality')), to_float(data.get('signal_strength')),
+                to_text(data.get('country_code'), shared=True), to_float(data.get('distance')),
+                to_float(data.get('elevation')), to_text(data.get('battery')),
+                to_float(data.get('latitude')), to_float(data.get('longitude')),
+            ))
+    started = time.perf_counter()
+    for update in updates:
+        process_unique_callsigns(*update, state.decoded_stations_dict, state.unique_direct_dict,
+                                 state.unique_digipeated_dict, scheduler)
+    elapsed = time.perf_counter() - started
+    return {'msgs_per_s': len(updates) / elapsed, 'direct': len(state.unique_direct_dict),
+            'digipeated': len(state.unique_digipeated_dict)}
+
+
+def bench_render(state, renders):
+    """First and repeated render time of every table, in milliseconds."""
+    tables = {
+        'logs': TableControl(lambda: state.logs_buffer.lines),
+        'beacons': TableControl(lambda: state.beacons_dict.values(), format_beacon_row, BEACON_COLUMNS),
+        'decoded': TableControl(lambda: state.decoded_stations_dict.values(), format_decoded_row, DECODED_COLUMNS),
+        'unique_direct': UniqueCallsignTable(lambda: state.unique_direct_dict.items(), unique_direct_row_prefix, UNIQUE_DIRECT_COLUMNS),
+        'unique_digipeated': UniqueCallsignTable(lambda: state.unique_digipeated_dict.items(), unique_digipeated_row_prefix, UNIQUE_DIGIPEATED_COLUMNS),
+    }
+    results = {}
+    for pane, table in tables.items():
+        timings = []
+        for _ in range(renders + 1):
+            t0 = time.perf_counter()
+            table.refresh()
+            content = table.create_content(RENDER_WIDTH, RENDER_HEIGHT)
+            for i in range(content.line_count):
+                content.get_line(i)
+            timings.append(time.perf_counter() - t0)
+        results[pane] = {'first_ms': timings[0] * 1e3, 'repeat_ms': sum(timings[1:]) / renders * 1e3}
+    return results
+
+
+async def bench_end_to_end(messages):
+    """Broker stand-in -> mqtt_handler -> ingest queue -> process_messages."""
+    state, routes, retention, scheduler = new_pipeline()
+    ingest = IngestQueue(len(messages), 'block')
+    connection_status = new_connection_status()
+    client = lora_aprs_core.Client
+    lora_aprs_core.Client = local_broker(messages)
+    started = time.perf_counter()
+    tasks = [
+        asyncio.create_task(mqtt_handler([BENCH_IGATE], ingest, connection_status, lambda: None)),
+        asyncio.create_task(process_messages(ingest, routes, retention, scheduler)),
+    ]
+    try:
+        while ingest.processed < len(messages):
+            await asyncio.sleep(0.001)
+        elapsed = time.perf_counter() - started
+    finally:
+        lora_aprs_core.Client = client
+        for task in tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    return {'msgs_per_s': len(messages) / elapsed, 'latency_avg_ms': ingest.latency_avg * 1e3,
+            'latency_max_ms': ingest.latency_max * 1e3}
+
+
+async def bench_memory(messages, renders):
+    """Peak traced allocation while ingesting and rendering, in MB."""
+    tracemalloc.start()
+    try:
+        state, _ = await bench_pipeline(messages)
+        bench_render(state, renders)
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+async def run_scenario(station_count, args):
+    message_count = args.messages or max(DEFAULT_MIN_MESSAGES, 2 * station_count)
+    messages = generate_messages(station_count, message_count, args.seed)
+    state, pipeline = await bench_pipeline(messages)
+    result = {
+        'stations': station_count,
+        'messages': message_count,
+        'pipeline': pipeline,
+        'unique_callsigns': bench_unique_callsigns(messages),
+        'routing': bench_routing(messages),
+        'decoding': bench_decoding(messages),
+        'render': bench_render(state, args.renders),
+        'end_to_end': await bench_end_to_end(messages),
+    }
+    if not args.no_memory:
+        result['peak_memory_mb'] = await bench_memory(messages, args.renders)
+    return result
+
+
+def print_result(result):
+    pipeline = result['pipeline']
+    unique = result['unique_callsigns']
+    end_to_end = result['end_to_end']
+    print(f"== {result['stations']} stations, {result['messages']} messages")
+    print(f"  handle_message      {pipeline['msgs_per_s']:>10.0f} msg/s   p50 {pipeline['p50_us']:.1f}us  "
+          f"p90 {pipeline['p90_us']:.1f}us  p99 {pipeline['p99_us']:.1f}us  max {pipeline['max_us']:.0f}us")
+    print(f"  unique callsigns    {unique['msgs_per_s']:>10.0f} msg/s   "
+          f"({unique['direct']} direct, {unique['digipeated']} digipeated)")
+    routing = result['routing']
+    print(f"  topic routing       legacy {routing['route_legacy_ns']:.0f}ns  cached {routing['route_cached_ns']:.0f}ns per message")
+    print(f"  callsign validation legacy {routing['validate_legacy_ns']:.0f}ns  cached {routing['validate_cached_ns']:.0f}ns per call")
+    decoding = result['decoding']
+    print(f"  payload decoding    legacy {decoding['legacy_ns']:.0f}ns  {decoding['backend']} {decoding['decoder_ns']:.0f}ns per payload")
+    print(f"  end to end          {end_to_end['msgs_per_s']:>10.0f} msg/s   "
+          f"queue latency avg {end_to_end['latency_avg_ms']:.2f}ms  max {end_to_end['latency_max_ms']:.1f}ms")
+    for pane, timing in result['render'].items():
+        print(f"  render {pane:<18} first {timing['first_ms']:.2f}ms  repeat {timing['repeat_ms']:.2f}ms")
+    if 'peak_memory_mb' in result:
+        print(f"  peak memory         {result['peak_memory_mb']:.1f} MB")
+
+
+def print_timestamps(results):
+    print("== timestamp parsing")
+    for result in results:
+        print(f"  {result['msgs_per_timestamp']:>5} msg/timestamp  legacy {result['legacy_per_s']:>10.0f}/s  "
+              f"memoized {result['memoized_per_s']:>10.0f}/s  "
+              f"({result['memoized_per_s'] / result['legacy_per_s']:.1f}x)")
+
+
+async def main(argv=None):
+    args = parse_args(argv)
+    timestamps = bench_timestamps()
+    print_timestamps(timestamps)
+    results = []
+    for station_count in args.stations:
+        result = await run_scenario(station_count, args)
+        print_result(result)
+        results.append(result)
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'python': sys.version.split()[0], 'json_backend': JSON_BACKEND, 'timestamps': timestamps, 'results': results},
+                      output, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,1899 @@
+"""
+Connection, parsing and record handling shared by the terminal UI and headless mode.
+Nothing in here imports prompt_toolkit.
+"""
+import sys
+import os  # For the iGate cache location
+import argparse  # For command-line option types
+import asyncio
+import ssl
+import json
+import random  # For reconnect backoff jitter
+import time  # For monotonic "last seen" timestamps
+import math  # For rate decay and standard deviations
+import re  # For callsign validation
+import struct  # For capture file records
+import sqlite3  # For the station history database
+import threading  # For the history writer thread
+import queue
+from bisect import bisect_left, insort  # For the sorted callsign index
+from datetime import datetime  # Import datetime
+from dataclasses import dataclass  # For compact record types
+from typing import Union  # For the payload field type
+from functools import lru_cache, partial  # For memoized timestamp parsing and the MQTT client queue
+from collections import OrderedDict, deque  # For maintaining order of callsigns and the log ring buffer
+from aiomqtt import Client
+
+# Optional faster JSON decoders, preferred in this order when installed
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Default number of lines kept in the Messages pane
+DEFAULT_LOG_CAPACITY = 1000
+
+# Default number of rows kept in the Beacons and Decoded Messages tables
+DEFAULT_MAX_ROWS = 1000
+
+# Default capacity and overflow policy of the queue between MQTT and message processing
+DEFAULT_QUEUE_SIZE = 10000
+OVERFLOW_POLICIES = ('drop-oldest', 'drop-newest', 'block')
+
+# Maximum number of queued messages processed before yielding to the event loop
+INGEST_BATCH_SIZE = 256
+
+# Reconnect backoff bounds in seconds
+RECONNECT_BASE_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+
+# iGate discovery stops after this many seconds without traffic, and after the deadline at the latest
+DISCOVERY_IDLE_TIMEOUT = 1.0
+DISCOVERY_DEADLINE = 5.0
+
+# Known iGates are cached on disk; entries not heard within the TTL are dropped,
+# and discovery only runs again once the cache is older than the refresh interval
+IGATE_CACHE_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.environ.get('LOCALAPPDATA') or os.path.expanduser('~/.cache'),
+    'lora_aprs', 'igates.json')
+IGATE_CACHE_TTL = 7 * 24 * 3600
+IGATE_REFRESH_INTERVAL = 300
+
+# Capture files start with this marker, followed by records of
+# (receive time, topic length, payload length), topic and payload
+CAPTURE_MAGIC = b'LORACAP1'
+CAPTURE_RECORD = struct.Struct('<dHI')
+
+# History rows are written in one transaction per batch of this many rows,
+# or after this many seconds at the latest
+HISTORY_BATCH_ROWS = 500
+HISTORY_FLUSH_INTERVAL = 0.25
+
+# Stations heard within this many seconds are restored into the unique-callsign tables
+HISTORY_RESTORE_AGE = 24 * 3600
+
+# Seconds between event-loop lag samples (and message rate updates)
+LOOP_LAG_INTERVAL = 0.5
+
+# Weight of the newest value in the per-station signal EWMA
+SIGNAL_EWMA_ALPHA = 0.2
+
+# Time constant in seconds of the per-station packet rate, so the rate reads as packets per minute
+PACKET_RATE_WINDOW = 60.0
+
+# Mean Earth radius in km, for locally computed distances
+EARTH_RADIUS_KM = 6371.0088
+
+# Size in degrees of the spatial index cells (about 55 km north-south)
+GRID_CELL_DEGREES = 0.5
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be a positive integer: {value}")
+    return number
+
+
+def non_negative_float(value):
+    number = float(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f"must not be negative: {value}")
+    return number
+
+
+def build_retention(args):
+    return {
+        'max_rows': args.max_rows,
+        'max_age': args.max_age,  # Seconds, or None for no age limit
+    }
+
+
+def enforce_retention(records, retention, current_time=None, index=None):
+    """
+    Evict the oldest entries from an insertion-ordered dict of records.
+    Entries are kept oldest-first, so each eviction is an O(1) popitem from the front.
+    Evicted keys are also dropped from index (a TableIndex over records), if given.
+    Returns the number of evicted entries.
+    """
+    evicted = 0
+    while len(records) > retention['max_rows']:
+        key, record = records.popitem(last=False)
+        if index is not None:
+            index.remove(key)
+        evicted += 1
+
+    max_age = retention['max_age']
+    if max_age is not None:
+        cutoff = (current_time or time.monotonic()) - max_age
+        while records and next(iter(records.values())).last_seen < cutoff:
+            key, record = records.popitem(last=False)
+            if index is not None:
+                index.remove(key)
+            evicted += 1
+    return evicted
+
+
+class Missing:
+    """Shared sentinel for values absent from a payload, rendered as 'N/A'."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'MISSING'
+
+    def __bool__(self):
+        return False
+
+
+MISSING = Missing()
+
+
+def to_float(value):
+    # Numeric payload fields are stored as floats, anything unparseable (or inf/nan) counts as missing
+    if value is None or value == '':
+        return MISSING
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return MISSING
+    return number if math.isfinite(number) else MISSING
+
+
+def to_text(value, shared=False):
+    # Repetitive fields (countries, destinations, digipeaters) share one interned string
+    if not value:
+        return MISSING
+    value = str(value)  # Ensure the value is a string
+    return sys.intern(value) if shared else value
+
+
+def fmt(value):
+    # 'N/A' and number formatting only happen at render time
+    if value is MISSING:
+        return 'N/A'
+    if type(value) is float and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+@dataclass(slots=True)
+class Beacon:
+    time: str
+    destination: object
+    path: object
+    latitude: object   # float or MISSING
+    longitude: object  # float or MISSING
+    elevation: object  # float or MISSING
+    battery: object
+    comment: object
+    digipeated_via: object
+    country: object
+    last_seen: float   # time.monotonic() when received
+    epoch: object = None  # Parsed timestamp in epoch seconds, None if invalid
+
+
+@dataclass(slots=True)
+class DecodedPacket:
+    time: str
+    callsign: str
+    destination: object
+    path: object
+    snr: object        # float or MISSING
+    rssi: object       # float or MISSING
+    latitude: object   # float or MISSING
+    longitude: object  # float or MISSING
+    elevation: object  # float or MISSING
+    distance: object   # float or MISSING
+    battery: object
+    comment: object
+    country: object
+    digipeated_via: object
+    last_seen: float   # time.monotonic() when received
+    epoch: object = None  # Parsed timestamp in epoch seconds, None if invalid
+
+
+@dataclass(slots=True)
+class SignalStats:
+    """Streaming min/max/mean, standard deviation (Welford) and EWMA of one signal value."""
+    count: int = 0
+    mean: float = 0.0
+    m2: float = 0.0  # Sum of squared differences from the mean
+    minimum: float = math.inf
+    maximum: float = -math.inf
+    ewma: float = 0.0
+
+    def add(self, value):
+        # O(1) per value, nothing from the history is kept
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.minimum:
+            self.minimum = value
+        if value > self.maximum:
+            self.maximum = value
+        self.ewma = value if self.count == 1 else self.ewma + SIGNAL_EWMA_ALPHA * (value - self.ewma)
+
+    def deviation(self):
+        # Sample standard deviation, MISSING until there are two values
+        if self.count < 2:
+            return MISSING
+        return math.sqrt(self.m2 / (self.count - 1))
+
+
+@dataclass(slots=True)
+class Station:
+    """Aggregate for one callsign in the unique-callsign tables."""
+    last_seen: float
+    snr: object = MISSING
+    rssi: object = MISSING
+    country: object = MISSING
+    distance: object = MISSING
+    elevation: object = MISSING
+    battery: object = MISSING
+    digipeated_via: object = MISSING
+    latitude: object = MISSING   # Last reported position, float or MISSING
+    longitude: object = MISSING
+    count: int = 1
+    # Rolling statistics, see record_heard()
+    snr_stats: object = None   # SignalStats, None until a value was heard
+    rssi_stats: object = None  # SignalStats, None until a value was heard
+    rate: float = 0.0          # Exponentially decayed packet count, roughly packets in the last minute
+    rate_time: float = 0.0     # Monotonic time rate was last updated
+    # Render cache, see unique_row()
+    row_prefix: object = None
+    row: object = None
+    seen_due: float = 0.0      # Monotonic time at which the "Seen" or rate suffix next changes
+
+
+def rate_at(station, current_time):
+    """Packet rate decayed to current_time."""
+    return station.rate * math.exp((station.rate_time - current_time) / PACKET_RATE_WINDOW)
+
+
+def rate_due(rate, current_time):
+    """Monotonic time at which a rate shown with one decimal next changes."""
+    boundary = round(rate, 1) - 0.05  # The displayed value drops once the rate falls below this
+    if boundary <= 0:
+        return float('inf')
+    # Never sooner than a second from now, which is as often as the UI refreshes anyway
+    return current_time + max(1.0, PACKET_RATE_WINDOW * math.log(rate / boundary))
+
+
+def record_heard(station, current_time, snr=MISSING, rssi=MISSING):
+    """Fold one packet into the station's rolling statistics."""
+    station.rate = rate_at(station, current_time) + 1.0
+    station.rate_time = current_time
+    if snr is not MISSING:
+        if station.snr_stats is None:
+            station.snr_stats = SignalStats()
+        station.snr_stats.add(snr)
+    if rssi is not MISSING:
+        if station.rssi_stats is None:
+            station.rssi_stats = SignalStats()
+        station.rssi_stats.add(rssi)
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """Great-circle distance in km."""
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def valid_position(latitude, longitude):
+    # Out-of-range coordinates are kept for display but never used for distances or the grid
+    return (latitude is not MISSING and longitude is not MISSING
+            and -90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0)
+
+
+def fill_distance(packet, igate_position):
+    # Payloads without a distance get one computed from the position of the iGate that heard them
+    if (packet.distance is MISSING and igate_position is not None
+            and valid_position(packet.latitude, packet.longitude)):
+        packet.distance = round(haversine(packet.latitude, packet.longitude, *igate_position), 1)
+
+
+def in_box(latitude, longitude, box):
+    # box is (south, west, north, east); west > east crosses the antimeridian
+    south, west, north, east = box
+    if not south <= latitude <= north:
+        return False
+    if west <= east:
+        return west <= longitude <= east
+    return longitude >= west or longitude <= east
+
+
+class SpatialGrid:
+    """
+    Fixed-size latitude/longitude grid of keys.
+    Box and radius lookups only visit the cells they overlap (or the occupied cells,
+    whichever are fewer) and return a superset of the matching keys.
+    """
+
+    def __init__(self, cell_degrees=GRID_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.cells = {}      # (row, column) -> set of keys
+        self.key_cells = {}  # Key -> (row, column)
+
+    def cell(self, latitude, longitude):
+        return int((latitude + 90.0) // self.cell_degrees), int((longitude + 180.0) // self.cell_degrees)
+
+    def add(self, key, latitude, longitude):
+        cell = self.cell(latitude, longitude)
+        old_cell = self.key_cells.get(key)
+        if cell == old_cell:
+            return
+        if old_cell is not None:
+            self.remove(key)
+        self.key_cells[key] = cell
+        self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        cell = self.key_cells.pop(key, None)
+        if cell is not None:
+            keys = self.cells[cell]
+            keys.discard(key)
+            if not keys:
+                del self.cells[cell]
+
+    def clear(self):
+        self.cells.clear()
+        self.key_cells.clear()
+
+    def box(self, south, west, north, east):
+        """Keys in the cells overlapping the box."""
+        if west > east:
+            # Crosses the antimeridian
+            return self.box(south, west, north, 180.0) | self.box(south, -180.0, north, east)
+        first_row, first_column = self.cell(south, west)
+        last_row, last_column = self.cell(north, east)
+        keys = set()
+        if (last_row - first_row + 1) * (last_column - first_column + 1) > len(self.cells):
+            # The box spans more cells than are occupied, so walk the occupied ones
+            for (row, column), cell_keys in self.cells.items():
+                if first_row <= row <= last_row and first_column <= column <= last_column:
+                    keys.update(cell_keys)
+        else:
+            cells = self.cells
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, last_column + 1):
+                    cell_keys = cells.get((row, column))
+                    if cell_keys:
+                        keys.update(cell_keys)
+        return keys
+
+    def radius(self, latitude, longitude, km):
+        """Keys in the cells overlapping the circle of km around a position."""
+        spread = math.degrees(km / EARTH_RADIUS_KM)
+        south = max(-90.0, latitude - spread)
+        north = min(90.0, latitude + spread)
+        # The circle is widest at the band edge closest to a pole
+        narrowest = min(math.cos(math.radians(south)), math.cos(math.radians(north)))
+        if narrowest <= 0 or spread / narrowest >= 180.0:
+            return self.box(south, -180.0, north, 180.0)
+        spread /= narrowest
+        west = longitude - spread
+        east = longitude + spread
+        if west < -180.0:
+            west += 360.0
+        if east > 180.0:
+            east -= 360.0
+        return self.box(south, west, north, east)
+
+
+@dataclass(slots=True)
+class StationFilter:
+    """Row filter entered in the UI, see parse_filter()."""
+    text: str = ''
+    prefix: str = ''        # Callsign starts with this
+    substring: str = ''     # Callsign contains this
+    countries: frozenset = frozenset()
+    min_distance: object = None  # Kilometres, None for no limit
+    max_distance: object = None
+    battery: bool = False   # Only rows with a battery value
+    radius: object = None   # Kilometres around center, None for no limit
+    center: object = None   # (latitude, longitude), None to measure from the iGates
+    box: object = None      # (south, west, north, east), None for no limit
+
+    def matches(self, callsign, record, has_distance=True, centers=()):
+        if self.prefix and not callsign.startswith(self.prefix):
+            return False
+        if self.substring and self.substring not in callsign:
+            return False
+        if self.countries and (not record.country or record.country.upper() not in self.countries):
+            return False
+        if self.battery and record.battery is MISSING:
+            return False
+        if has_distance and (self.min_distance is not None or self.max_distance is not None):
+            distance = record.distance
+            if distance is MISSING:
+                return False
+            if self.min_distance is not None and distance < self.min_distance:
+                return False
+            if self.max_distance is not None and distance > self.max_distance:
+                return False
+        if self.box is not None or self.radius is not None:
+            latitude = record.latitude
+            longitude = record.longitude
+            if not valid_position(latitude, longitude):
+                return False
+            if self.box is not None and not in_box(latitude, longitude, self.box):
+                return False
+            if self.radius is not None:
+                if self.center is not None:
+                    centers = (self.center,)
+                if not any(haversine(latitude, longitude, *center) <= self.radius for center in centers):
+                    return False
+        return True
+
+
+def parse_position(text, term):
+    # "LAT,LON" into a (latitude, longitude) tuple
+    try:
+        latitude, longitude = (float(value) for value in text.split(','))
+    except ValueError:
+        raise ValueError(f"position must be LAT,LON in {term}") from None
+    if not (-90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0):
+        raise ValueError(f"position out of range in {term}")
+    return latitude, longitude
+
+
+def parse_filter(text):
+    """
+    Parse filter text into a StationFilter, or None when it is empty.
+    Terms: CALL (callsign prefix), *CALL (callsign contains), country:GB[,FR],
+    min:KM and max:KM (distance), battery, radius:KM (around the iGates) or
+    radius:KM@LAT,LON, and box:SOUTH,WEST,NORTH,EAST. Raises ValueError on a bad term.
+    """
+    station_filter = StationFilter(text=' '.join(text.split()))
+    if not station_filter.text:
+        return None
+    for term in station_filter.text.split():
+        name, colon, value = term.partition(':')
+        name = name.lower()
+        if colon and name == 'country':
+            countries = frozenset(code.upper() for code in value.split(',') if code)
+            if not countries:
+                raise ValueError(f"no country given in {term}")
+            station_filter.countries = countries
+        elif colon and name in ('min', 'max'):
+            distance = to_float(value)  # MISSING for text, inf and nan
+            if distance is MISSING:
+                raise ValueError(f"distance is not a number in {term}")
+            if name == 'min':
+                station_filter.min_distance = distance
+            else:
+                station_filter.max_distance = distance
+        elif colon and name == 'radius':
+            value, at, position = value.partition('@')
+            station_filter.radius = to_float(value)
+            if station_filter.radius is MISSING:
+                raise ValueError(f"radius is not a number in {term}")
+            if station_filter.radius < 0:
+                raise ValueError(f"radius must not be negative in {term}")
+            station_filter.center = parse_position(position, term) if at else None
+        elif colon and name == 'box':
+            corners = value.split(',')
+            if len(corners) != 4:
+                raise ValueError(f"box must be SOUTH,WEST,NORTH,EAST in {term}")
+            south, west = parse_position(','.join(corners[:2]), term)
+            north, east = parse_position(','.join(corners[2:]), term)
+            if south > north:
+                raise ValueError(f"south is above north in {term}")
+            station_filter.box = (south, west, north, east)
+        elif colon:
+            raise ValueError(f"unknown filter term {term}")
+        elif name == 'battery':
+            station_filter.battery = True
+        elif station_filter.prefix or station_filter.substring:
+            raise ValueError(f"only one callsign term allowed: {term}")
+        elif term.startswith('*'):
+            station_filter.substring = term.strip('*').upper()
+        else:
+            station_filter.prefix = term.rstrip('*').upper()
+    return station_filter
+
+
+# How each table's rows map to the callsign the filter matches on
+def beacon_callsign(key, beacon):
+    return key.partition('_')[0]  # Beacon ids start with the iGate that sent them
+
+
+def packet_callsign(key, packet):
+    return packet.callsign.upper()
+
+
+def station_callsign(key, station):
+    return key
+
+
+class TableIndex:
+    """
+    Search index over one table's insertion-ordered dict of records.
+    Callsigns are kept sorted for prefix lookups, keys are bucketed by country and
+    by battery presence, and positions go into a SpatialGrid. While a filter is
+    active, the matching rows are kept in rows, in the same recency order as the
+    table, and updated one row at a time. The index is built when the first filter
+    is set, so unfiltered use costs nothing.
+    """
+
+    def __init__(self, records, callsign_of, has_distance=True):
+        self.records = records
+        self.callsign_of = callsign_of
+        self.has_distance = has_distance  # Whether distance terms apply to this table
+        self.entries = {}          # Key -> (callsign, country, battery present) as indexed
+        self.callsigns = {}        # Callsign -> set of keys
+        self.sorted_callsigns = []
+        self.countries = {}        # Upper-case country -> set of keys
+        self.battery = set()       # Keys with a battery value
+        self.grid = SpatialGrid()  # Keys with a position
+        self.centers = ()          # iGate positions that radius terms are measured from
+        self.indexed = False       # Whether the structures above are built and kept current
+        self.filter = None         # StationFilter, or None to show every row
+        self.rows = None           # Matching rows while filtering
+        self.appended = 0          # Rows that became the newest of visible(), for scrolled tables
+
+    def visible(self):
+        # What the table shows: the matching rows, or every row without a filter
+        return self.records if self.rows is None else self.rows
+
+    def update(self, key):
+        """Index a row that was just added or changed, and move it to the front of the matches."""
+        if not self.indexed:
+            self.appended += 1
+            return
+        record = self.records[key]
+        callsign = self.callsign_of(key, record)
+        country = record.country.upper() if record.country else MISSING
+        entry = (callsign, country, record.battery is not MISSING, record.latitude, record.longitude)
+        old_entry = self.entries.get(key)
+        if entry != old_entry:
+            if old_entry is not None:
+                self.unindex(key, old_entry)
+            self.entries[key] = entry
+            keys = self.callsigns.get(callsign)
+            if keys is None:
+                keys = self.callsigns[callsign] = set()
+                insort(self.sorted_callsigns, callsign)
+            keys.add(key)
+            self.countries.setdefault(country, set()).add(key)
+            if entry[2]:
+                self.battery.add(key)
+            if valid_position(record.latitude, record.longitude):
+                self.grid.add(key, record.latitude, record.longitude)
+
+        if self.filter is not None:
+            if self.filter.matches(callsign, record, self.has_distance, self.centers):
+                self.rows[key] = record
+                self.rows.move_to_end(key)
+                self.appended += 1
+            else:
+                self.rows.pop(key, None)
+        else:
+            self.appended += 1
+
+    def unindex(self, key, entry):
+        callsign, country, battery, latitude, longitude = entry
+        keys = self.callsigns[callsign]
+        keys.discard(key)
+        if not keys:
+            del self.callsigns[callsign]
+            del self.sorted_callsigns[bisect_left(self.sorted_callsigns, callsign)]
+        keys = self.countries[country]
+        keys.discard(key)
+        if not keys:
+            del self.countries[country]
+        self.battery.discard(key)
+        self.grid.remove(key)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.unindex(key, entry)
+        if self.rows is not None:
+            self.rows.pop(key, None)
+
+    def rebuild(self):
+        # After the records were filled without going through update()
+        self.clear()
+        self.indexed = True
+        for key in self.records:
+            self.update(key)
+
+    def clear(self):
+        self.entries.clear()
+        self.callsigns.clear()
+        self.sorted_callsigns.clear()
+        self.countries.clear()
+        self.battery.clear()
+        self.grid.clear()
+        if self.rows is not None:
+            self.rows.clear()
+
+    def candidates(self, station_filter):
+        """Keys that can match station_filter, narrowed down by the indexes."""
+        key_sets = []
+        if station_filter.prefix:
+            prefix = station_filter.prefix
+            sorted_callsigns = self.sorted_callsigns
+            keys = set()
+            i = bisect_left(sorted_callsigns, prefix)
+            while i < len(sorted_callsigns) and sorted_callsigns[i].startswith(prefix):
+                keys.update(self.callsigns[sorted_callsigns[i]])
+                i += 1
+            key_sets.append(keys)
+        if station_filter.substring:
+            # Scans distinct callsigns only, not rows
+            key_sets.append(set().union(*(keys for callsign, keys in self.callsigns.items()
+                                          if station_filter.substring in callsign)))
+        if station_filter.countries:
+            key_sets.append(set().union(*(self.countries.get(country, ()) for country in station_filter.countries)))
+        if station_filter.battery:
+            key_sets.append(self.battery)
+        if station_filter.box is not None:
+            key_sets.append(self.grid.box(*station_filter.box))
+        if station_filter.radius is not None:
+            centers = (station_filter.center,) if station_filter.center is not None else self.centers
+            key_sets.append(set().union(*(self.grid.radius(latitude, longitude, station_filter.radius)
+                                          for latitude, longitude in centers)))
+        if not key_sets:
+            return set(self.entries)  # Distance terms only
+        key_sets.sort(key=len)
+        return key_sets[0].intersection(*key_sets[1:])
+
+    def set_filter(self, station_filter):
+        if station_filter is None:
+            self.filter = self.rows = None
+            return
+        if not self.indexed:
+            self.rebuild()  # Once; from here on update() keeps it current
+        self.filter = station_filter
+        records = self.records
+        self.rows = OrderedDict()
+        # Rows are added and moved to the end on every update, so last_seen gives the table order
+        for key in sorted(self.candidates(station_filter), key=lambda key: records[key].last_seen):
+            record = records[key]
+            if station_filter.matches(self.entries[key][0], record, self.has_distance, self.centers):
+                self.rows[key] = record
+
+
+class LogBuffer:
+    """
+    Fixed-capacity ring buffer backing the Messages pane.
+    Appends and evictions are O(1); the pane text is only built when the UI redraws.
+    """
+
+    def __init__(self, capacity=DEFAULT_LOG_CAPACITY):
+        self.lines = deque(maxlen=capacity)
+        self.appended = 0  # Lines appended so far, for a scrolled pane
+
+    def append(self, line):
+        # One entry per displayed row; the oldest line is dropped once capacity is reached
+        self.lines.append(line.replace('\n', ' '))
+        self.appended += 1
+
+    def clear(self):
+        self.lines.clear()
+
+
+class IGateState:
+    """
+    Everything shown for one view: a single iGate, or the merged view of all of them.
+    Records parsed once are shared between the iGate's own state and the merged state.
+    """
+
+    def __init__(self, name, log_capacity=DEFAULT_LOG_CAPACITY, merged=False):
+        self.name = name
+        self.merged = merged  # Merged views prefix log lines with the originating iGate
+        self.logs_buffer = LogBuffer(log_capacity)
+        self.unique_direct_dict = OrderedDict()
+        self.unique_digipeated_dict = OrderedDict()
+        self.beacons_dict = OrderedDict()
+        self.decoded_stations_dict = OrderedDict()
+        # Search indexes for the filter, by pane name
+        self.indexes = {
+            'beacons': TableIndex(self.beacons_dict, beacon_callsign, has_distance=False),
+            'decoded': TableIndex(self.decoded_stations_dict, packet_callsign),
+            'unique_direct': TableIndex(self.unique_direct_dict, station_callsign),
+            'unique_digipeated': TableIndex(self.unique_digipeated_dict, station_callsign),
+        }
+        self.filter = None
+        self.igate_positions = {}  # iGate -> (latitude, longitude), from its own beacons
+
+    def append_log(self, igate, line):
+        self.logs_buffer.append(f"[{igate}] {line}" if self.merged else line)
+
+    def set_filter(self, station_filter):
+        self.filter = station_filter
+        centers = tuple(self.igate_positions.values())
+        for index in self.indexes.values():
+            index.centers = centers
+            index.set_filter(station_filter)
+
+    def set_igate_position(self, igate, latitude, longitude):
+        position = (latitude, longitude)
+        if self.igate_positions.get(igate) != position:
+            self.igate_positions[igate] = position
+            station_filter = self.filter
+            if station_filter is not None and station_filter.radius is not None and station_filter.center is None:
+                # The radius is measured from the iGates, so the matches move with them
+                self.set_filter(station_filter)
+
+    def clear(self):
+        self.logs_buffer.clear()
+        self.unique_direct_dict.clear()
+        self.unique_digipeated_dict.clear()
+        self.beacons_dict.clear()
+        self.decoded_stations_dict.clear()
+        for index in self.indexes.values():
+            index.clear()  # The filter itself and the iGate positions stay
+
+
+class IngestQueue:
+    """
+    Bounded hand-off between the MQTT reader and message processing.
+    The reader only enqueues (topic, payload, receive time); when the queue is full the
+    overflow policy drops the oldest or the newest message, or blocks the reader.
+    """
+
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE, policy=OVERFLOW_POLICIES[0]):
+        self.queue = asyncio.Queue(maxsize)
+        self.policy = policy
+        self.received = 0
+        self.dropped = 0
+        self.processed = 0
+        self.rejected = 0       # Malformed payloads skipped by processing
+        self.latency_avg = 0.0  # Exponentially weighted end-to-end latency in seconds
+        self.latency_max = 0.0
+
+    def depth(self):
+        return self.queue.qsize()
+
+    async def put(self, topic, payload):
+        item = (topic, payload, time.monotonic())
+        self.received += 1
+        if self.policy == 'block':
+            await self.queue.put(item)  # Backpressure: stop reading until there is room
+            return
+        if self.queue.full():
+            self.dropped += 1
+            if self.policy == 'drop-newest':
+                return
+            self.queue.get_nowait()  # drop-oldest
+        self.queue.put_nowait(item)
+
+    async def get_batch(self, max_items=INGEST_BATCH_SIZE):
+        # Wait for one message, then take whatever else is already queued
+        batch = [await self.queue.get()]
+        while len(batch) < max_items and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    def record_processed(self, received_at):
+        latency = time.monotonic() - received_at
+        self.processed += 1
+        self.latency_avg += (latency - self.latency_avg) * 0.05
+        self.latency_max = max(self.latency_max, latency)
+
+    def clear(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def status_text(self):
+        return [
+            ('class:queue_stats',
+             f"Queue {self.depth()}/{self.queue.maxsize}  Dropped {self.dropped}  Rejected {self.rejected}  "
+             f"Latency {self.latency_avg * 1000:.1f}ms (max {self.latency_max * 1000:.0f}ms)")
+        ]
+
+
+class Metrics:
+    """
+    Pipeline counters and timings for the status bar and the Prometheus endpoint.
+    Counters only go up; gauges such as table sizes are read when the metrics are exported.
+    """
+
+    def __init__(self):
+        self.messages = dict.fromkeys(('log', 'beacon', 'decoded', 'unrouted', 'ignored'), 0)
+        self.rejected = dict.fromkeys(('log', 'beacon', 'decoded'), 0)
+        self.handle_seconds = 0.0  # Total time spent handling messages
+        self.handled = 0
+        self.loop_lag = 0.0        # Latest event-loop lag sample in seconds
+        self.loop_lag_max = 0.0
+        self.message_rate = 0.0    # Messages per second over the last sample interval
+        # Exceptions caught while handling messages or rendering tables. They are counted
+        # rather than printed, since printing would write over the full-screen UI.
+        self.errors = dict.fromkeys(('handle', 'render'), 0)
+        self.last_error = None     # The latest of them, for the status bar
+
+    def record_error(self, stage, error):
+        self.errors[stage] += 1
+        self.last_error = f"{stage}: {error}"
+
+    def status_text(self):
+        handle_us = self.handle_seconds / self.handled * 1e6 if self.handled else 0.0
+        text = f"{self.message_rate:.0f} msg/s  Handle {handle_us:.0f}us  Lag {self.loop_lag * 1000:.0f}ms"
+        errors = sum(self.errors.values())
+        if errors:
+            text += f"  Errors {errors} ({truncate_text(self.last_error, 40)})"
+        return [('class:queue_stats', text)]
+
+
+async def measure_loop_lag(metrics, interval=LOOP_LAG_INTERVAL):
+    """Sample how late the event loop wakes up a sleeping task, and the message rate."""
+    try:
+        last_total = sum(metrics.messages.values())
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            elapsed = time.monotonic() - start
+            metrics.loop_lag = max(elapsed - interval, 0.0)
+            metrics.loop_lag_max = max(metrics.loop_lag_max, metrics.loop_lag)
+            total = sum(metrics.messages.values())
+            metrics.message_rate = (total - last_total) / elapsed
+            last_total = total
+    except asyncio.CancelledError:
+        # Task was cancelled
+        pass
+
+
+def prometheus_text(metrics, ingest, connection_status, views=(), tables=None, history=None):
+    """
+    Render the metrics in the Prometheus text exposition format.
+    views are the IGateState objects whose table sizes are exported; tables maps pane
+    names to TableControls whose render times are exported. history is the optional
+    HistoryStore, whose failed writes are exported.
+    """
+    lines = []
+
+    def add(name, kind, help_text, samples):
+        # samples are (name suffix, labels, value)
+        lines.append(f"# HELP lora_aprs_{name} {help_text}")
+        lines.append(f"# TYPE lora_aprs_{name} {kind}")
+        for suffix, labels, value in samples:
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+            lines.append(f"lora_aprs_{name}{suffix}{{{label_text}}} {value}" if labels
+                         else f"lora_aprs_{name}{suffix} {value}")
+
+    connected_since = connection_status['connected_since']
+    uptime = time.monotonic() - connected_since if connected_since is not None else 0.0
+
+    add('messages_total', 'counter', 'Messages handled, by topic type',
+        [('', (('type', kind),), count) for kind, count in metrics.messages.items()])
+    add('parse_failures_total', 'counter', 'Malformed payloads, by topic type',
+        [('', (('type', kind),), count) for kind, count in metrics.rejected.items()])
+    add('errors_total', 'counter', 'Exceptions caught while handling messages or rendering, by stage',
+        [('', (('stage', stage),), count) for stage, count in metrics.errors.items()])
+    add('handle_seconds', 'summary', 'Time spent handling messages',
+        [('_sum', (), f'{metrics.handle_seconds:.6f}'), ('_count', (), metrics.handled)])
+    add('received_total', 'counter', 'Messages received from the broker', [('', (), ingest.received)])
+    add('dropped_total', 'counter', 'Messages dropped by the ingest queue', [('', (), ingest.dropped)])
+    add('queue_depth', 'gauge', 'Messages waiting to be processed', [('', (), ingest.depth())])
+    add('queue_latency_seconds', 'gauge', 'Average time from receipt to processed',
+        [('', (), f'{ingest.latency_avg:.6f}')])
+    add('loop_lag_seconds', 'gauge', 'Latest event-loop lag sample', [('', (), f'{metrics.loop_lag:.6f}')])
+    add('loop_lag_max_seconds', 'gauge', 'Largest event-loop lag sample', [('', (), f'{metrics.loop_lag_max:.6f}')])
+    add('connected', 'gauge', '1 while connected to the broker', [('', (), int(connection_status['status']))])
+    add('connection_uptime_seconds', 'gauge', 'Time since the current connection was made', [('', (), f'{uptime:.3f}')])
+    add('reconnects_total', 'counter', 'Successful reconnects after an outage', [('', (), connection_status['reconnects'])])
+    add('mqtt_discarded_total', 'counter', 'Messages dropped because the MQTT client queue was full',
+        [('', (), connection_status['discarded'])])
+    if history is not None:
+        add('history_write_errors_total', 'counter', 'History batches that failed to write', [('', (), history.errors)])
+    if tables:
+        samples = []
+        for pane, table in tables.items():
+            samples.append(('_sum', (('table', pane),), f'{table.render_seconds:.6f}'))
+            samples.append(('_count', (('table', pane),), table.renders))
+        add('render_seconds', 'summary', 'Time spent rendering each table', samples)
+    if views:
+        samples = []
+        for state in views:
+            for table, size in (('logs', len(state.logs_buffer.lines)), ('beacons', len(state.beacons_dict)),
+                                ('decoded', len(state.decoded_stations_dict)),
+                                ('unique_direct', len(state.unique_direct_dict)),
+                                ('unique_digipeated', len(state.unique_digipeated_dict))):
+                samples.append(('', (('view', state.name), ('table', table)), size))
+        add('table_rows', 'gauge', 'Rows held per view and table', samples)
+    return '\n'.join(lines) + '\n'
+
+
+async def serve_metrics(port, get_text, host='127.0.0.1'):
+    """Serve get_text() on http://host:port/metrics until cancelled."""
+    from aiohttp import web  # Only loaded when metrics are served, headless mode starts faster without it
+
+    async def handle(request):
+        return web.Response(body=get_text().encode(),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        try:
+            await web.TCPSite(runner, host, port).start()
+        except OSError as e:
+            # e.g. the port is taken; everything else keeps running
+            print(f"Cannot serve metrics on port {port}: {e}", file=sys.stderr)
+            return
+        await asyncio.Event().wait()  # Serve until cancelled
+    finally:
+        await runner.cleanup()
+
+
+def new_connection_status():
+    return {
+        'status': False,       # True while connected
+        'attempts': 0,         # Failed connection attempts since the last successful connect
+        'reconnects': 0,       # Successful reconnects after an outage
+        'down_since': None,    # time.monotonic() when the current outage started
+        'last_outage': None,   # Seconds the last outage took to recover
+        'retry_at': None,      # time.monotonic() of the next attempt
+        'error': None,         # Why the last connection attempt failed
+        'connected_since': None,  # time.monotonic() when the current connection was made
+        'discarded': 0,        # Messages the MQTT client dropped because its own queue was full
+    }
+
+
+def reconnect_delay(attempt):
+    # Exponential backoff with jitter, so many clients don't reconnect in lockstep
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class IncomingQueue(asyncio.Queue):
+    """
+    Message queue inside the aiomqtt Client.
+    MQTT has no way to pause the broker, so once this queue is full too (only possible
+    with the 'block' overflow policy) further messages are dropped here. They are counted
+    in connection_status instead of going to aiomqtt's warning log, which would write over the UI.
+    """
+
+    def __init__(self, connection_status, maxsize=0):
+        super().__init__(maxsize)
+        self.connection_status = connection_status
+
+    def put_nowait(self, item):
+        if self.full():
+            self.connection_status['discarded'] += 1
+            return
+        super().put_nowait(item)
+
+
+class MqttSession:
+    """
+    One broker connection for the whole process.
+    Owners (the monitored iGates, discovery) each declare the topics they need and the
+    session keeps the union subscribed, swapping subscriptions on the live connection.
+    Changing iGates therefore costs an unsubscribe/subscribe round trip instead of a new
+    TLS and websocket handshake. Lost connections are re-established with backoff.
+    max_queued bounds the client's own message queue (0 for unbounded), so a blocked
+    ingest queue cannot make it grow without limit.
+    """
+
+    def __init__(self, connection_status=None, max_queued=0):
+        self.connection_status = new_connection_status() if connection_status is None else connection_status
+        self.max_queued = max_queued
+        self.subscriptions = {}     # Owner -> set of topics
+        self.subscribed = set()     # Topics subscribed on the current connection
+        self.subscribe_lock = asyncio.Lock()
+        self.listeners = ()         # Async functions called with (topic, payload) for every message
+        self.status_listeners = ()  # Functions called whenever connection_status changes
+        self.client = None          # aiomqtt Client while connected
+        self.connected = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def reconnect(self):
+        # Drop the connection and connect again straight away; not counted as an outage
+        await self.close()
+        self.connection_status['status'] = False
+        self.connection_status['connected_since'] = None
+        self.start()
+
+    def add_listener(self, listener):
+        self.listeners += (listener,)
+
+    def remove_listener(self, listener):
+        self.listeners = tuple(other for other in self.listeners if other is not listener)
+
+    def add_status_listener(self, listener):
+        self.status_listeners += (listener,)
+
+    def remove_status_listener(self, listener):
+        self.status_listeners = tuple(other for other in self.status_listeners if other is not listener)
+
+    def status_changed(self):
+        for listener in self.status_listeners:
+            listener()
+
+    async def set_topics(self, owner, topics):
+        """Replace the topics subscribed on behalf of owner."""
+        self.subscriptions[owner] = set(topics)
+        client = self.client
+        if client is None:
+            return  # Subscribed once the connection is up
+        try:
+            await self.sync_subscriptions(client)
+        except Exception:
+            pass  # The connection is going down; run() subscribes everything again
+
+    async def sync_subscriptions(self, client):
+        async with self.subscribe_lock:
+            wanted = set().union(*self.subscriptions.values())
+            for topic in sorted(self.subscribed - wanted):
+                await client.unsubscribe(topic)
+                self.subscribed.discard(topic)
+            for topic in sorted(wanted - self.subscribed):
+                await client.subscribe(topic)
+                self.subscribed.add(topic)
+
+    def set_disconnected(self):
+        connection_status = self.connection_status
+        if connection_status['down_since'] is None:
+            connection_status['down_since'] = time.monotonic()
+        connection_status['status'] = False
+        connection_status['connected_since'] = None
+
+    async def run(self):
+        connection_status = self.connection_status
+        tls_context = ssl.create_default_context()
+
+        # Supervise the connection: reconnect with backoff and keep all accumulated state
+        while True:
+            try:
+                async with Client(
+                    hostname='hydros.link9.net',
+                    port=8183,
+                    transport='websockets',
+                    tls_context=tls_context,
+                    queue_type=partial(IncomingQueue, connection_status),
+                    max_queued_incoming_messages=self.max_queued,
+                ) as client:
+                    # Subscribe (again, after a reconnect) to every wanted topic
+                    self.subscribed = set()
+                    self.client = client
+                    await self.sync_subscriptions(client)
+
+                    # Update connection status to Connected, recording how long the outage took to recover
+                    if connection_status['down_since'] is not None:
+                        connection_status['last_outage'] = time.monotonic() - connection_status['down_since']
+                        connection_status['reconnects'] += 1
+                    connection_status['status'] = True
+                    connection_status['connected_since'] = time.monotonic()
+                    connection_status['attempts'] = 0
+                    connection_status['down_since'] = None
+                    connection_status['error'] = None
+                    self.connected.set()
+                    self.status_changed()
+
+                    async for message in client.messages:
+                        topic = str(message.topic)
+                        for listener in self.listeners:
+                            await listener(topic, message.payload)
+                error = 'connection closed'
+            except Exception as e:
+                error = e
+            finally:
+                self.client = None
+                self.connected.clear()
+
+            # Update connection status to Disconnected and wait before the next attempt
+            # The error goes into the status line; printing it would write over the UI
+            self.set_disconnected()
+            retry_in = reconnect_delay(connection_status['attempts'])
+            connection_status['retry_at'] = time.monotonic() + retry_in
+            connection_status['attempts'] += 1
+            connection_status['error'] = str(error)
+            self.status_changed()
+            await asyncio.sleep(retry_in)
+
+
+async def session_feed(session, selected_igates, ingest, on_status_change, recorder=None, reconnect=False):
+    """
+    Enqueue every message of the selected iGates from a shared MqttSession until cancelled.
+    The session stays subscribed afterwards, so picking the same iGates again costs nothing.
+    """
+    async def enqueue(topic, payload):
+        if recorder is not None:
+            recorder.write(time.time(), topic, payload)
+        # Only enqueue here, so parsing and rendering never stall network reads
+        await ingest.put(topic, payload)
+
+    session.add_listener(enqueue)
+    session.add_status_listener(on_status_change)
+    try:
+        if reconnect:
+            await session.reconnect()
+        # One connection carries every iGate; messages are routed by topic afterwards
+        await session.set_topics('igates', [f'lora_aprs/{igate}/#' for igate in selected_igates])
+        on_status_change()  # Show the state of the already running connection
+        await asyncio.Event().wait()  # Run until cancelled
+    finally:
+        session.remove_listener(enqueue)
+        session.remove_status_listener(on_status_change)
+
+
+async def mqtt_handler(
+    selected_igates,
+    ingest,
+    connection_status,
+    on_status_change,
+    recorder=None
+):
+    """
+    Keep one connection subscribed to every iGate and enqueue all received messages.
+    on_status_change is called whenever connection_status changes; a CaptureWriter
+    passed as recorder gets a copy of every message.
+    """
+    # The client buffers at most as much as the ingest queue behind it
+    session = MqttSession(connection_status, ingest.queue.maxsize)
+    session.start()
+    try:
+        await session_feed(session, selected_igates, ingest, on_status_change, recorder)
+    finally:
+        await session.close()
+
+
+async def fetch_igates(session, last_heard, on_found=None, deadline=DISCOVERY_DEADLINE, idle_timeout=DISCOVERY_IDLE_TIMEOUT):
+    """
+    Listen to all iGate traffic on the session and record in last_heard when each iGate
+    was heard (epoch seconds). Stops after idle_timeout without traffic, or after deadline
+    seconds on a busy broker. on_found is called for every iGate that was not in last_heard yet.
+    Returns False if the broker could not be reached before the deadline.
+    """
+    loop = asyncio.get_running_loop()
+    stop_at = loop.time() + deadline
+    heard = asyncio.Event()
+
+    async def record(topic, payload):
+        heard.set()
+        topic_parts = topic.split('/')
+        if len(topic_parts) >= 2:
+            igate = topic_parts[1]
+            if igate in last_heard:
+                last_heard[igate] = time.time()
+            elif validate_callsign(igate):
+                last_heard[igate] = time.time()
+                if on_found is not None:
+                    on_found(igate)
+
+    session.add_listener(record)
+    try:
+        try:
+            await asyncio.wait_for(session.connected.wait(), timeout=deadline)
+        except asyncio.TimeoutError:
+            return False  # Reported by the caller; printing would write over the selector
+        await session.set_topics('discovery', ['lora_aprs/#'])
+
+        while True:
+            remaining = stop_at - loop.time()
+            if remaining <= 0:
+                break
+            heard.clear()
+            try:
+                await asyncio.wait_for(heard.wait(), timeout=min(idle_timeout, remaining))
+            except asyncio.TimeoutError:
+                # No more messages
+                break
+    finally:
+        session.remove_listener(record)
+        await session.set_topics('discovery', ())
+    return True
+
+
+def load_igate_cache(path=IGATE_CACHE_PATH):
+    """Return the cached {'refreshed': time, 'igates': {igate: last heard}}, without expired entries."""
+    try:
+        with open(path) as cache_file:
+            cached = json.load(cache_file)
+        cutoff = time.time() - IGATE_CACHE_TTL
+        return {
+            'refreshed': float(cached.get('refreshed', 0)),
+            'igates': {igate: float(heard) for igate, heard in cached.get('igates', {}).items()
+                       if float(heard) >= cutoff and validate_callsign(igate)},
+        }
+    except (OSError, ValueError, TypeError, AttributeError):
+        # Missing or unreadable cache; start empty
+        return {'refreshed': 0.0, 'igates': {}}
+
+
+def save_json(data, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temporary file first so a crash never leaves a truncated file
+    with open(path + '.tmp', 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(path + '.tmp', path)
+
+
+def save_igate_cache(cache, path=IGATE_CACHE_PATH):
+    # Returns why the cache could not be saved, or None
+    try:
+        save_json(cache, path)
+    except OSError as e:
+        return f"cannot save the iGate cache: {e}"
+    return None
+
+
+def igate_cache_stale(cache):
+    return not cache['igates'] or time.time() - cache['refreshed'] > IGATE_REFRESH_INTERVAL
+
+
+async def refresh_igate_cache(session, cache, on_found=None, path=IGATE_CACHE_PATH):
+    """
+    Run discovery on the session into the cache and save it, including what was heard before a cancellation.
+    Returns None, or why discovery or saving the cache failed.
+    """
+    completed = False
+    try:
+        completed = await fetch_igates(session, cache['igates'], on_found)
+    finally:
+        if completed:
+            cache['refreshed'] = time.time()
+        error = save_igate_cache(cache, path)
+    return error if completed else 'search failed: broker not reachable'
+
+
+class CaptureWriter:
+    """
+    Appends raw messages to a capture file for later replay.
+    Writes are buffered; a record cut short by a crash is cut off before appending,
+    so new records always follow the last complete one.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'ab+')
+        try:
+            end = capture_end(self.file, path)
+        except ValueError:
+            self.file.close()
+            raise
+        if end == 0:
+            self.file.truncate(0)
+            self.file.write(CAPTURE_MAGIC)
+        elif end < self.file.seek(0, 2):
+            self.file.truncate(end)
+        self.recorded = 0
+
+    def write(self, received_at, topic, payload):
+        topic = topic.encode()
+        self.file.write(CAPTURE_RECORD.pack(received_at, len(topic), len(payload)) + topic + payload)
+        self.recorded += 1
+
+    def close(self):
+        self.file.close()
+
+
+def capture_end(capture, path):
+    """
+    Offset just past the last complete record of an open capture file, 0 if the file
+    holds no more than (part of) the header. Raises ValueError for any other file.
+    """
+    size = capture.seek(0, 2)
+    capture.seek(0)
+    magic = capture.read(len(CAPTURE_MAGIC))
+    if magic != CAPTURE_MAGIC:
+        if CAPTURE_MAGIC.startswith(magic):
+            return 0  # Empty, or cut short while writing the header
+        raise ValueError(f"Not a capture file: {path}")
+    end = capture.tell()
+    while True:
+        header = capture.read(CAPTURE_RECORD.size)
+        if len(header) < CAPTURE_RECORD.size:
+            return end
+        _, topic_length, payload_length = CAPTURE_RECORD.unpack(header)
+        record_end = end + CAPTURE_RECORD.size + topic_length + payload_length
+        if record_end > size:
+            return end
+        end = capture.seek(record_end)
+
+
+def read_capture(path):
+    """Yield (receive time, topic, payload) for every message in a capture file."""
+    with open(path, 'rb') as capture:
+        if capture.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"Not a capture file: {path}")
+        while True:
+            header = capture.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                return
+            received_at, topic_length, payload_length = CAPTURE_RECORD.unpack(header)
+            topic = capture.read(topic_length)
+            payload = capture.read(payload_length)
+            if len(payload) < payload_length:
+                # Recording was interrupted mid-record
+                return
+            yield received_at, topic.decode(), payload
+
+
+def capture_igates(path):
+    # iGates present in a capture, for replays started without any callsigns
+    igates = set()
+    for _, topic, _ in read_capture(path):
+        route = route_topic(topic)
+        if route is not None:
+            igates.add(route[1])
+    return sorted(igates)
+
+
+async def replay_capture(path, ingest, connection_status, on_status_change, speed=1.0):
+    """
+    Feed a capture into the ingest queue as if it came from the broker.
+    speed scales the recorded gaps between messages; 0 replays as fast as possible.
+    Returns the number of replayed messages.
+    """
+    connection_status['status'] = True
+    connection_status['connected_since'] = time.monotonic()
+    on_status_change()
+    replayed = 0
+    start = None  # (first receive time, monotonic time the replay started)
+    try:
+        for received_at, topic, payload in read_capture(path):
+            if speed:
+                if start is None:
+                    start = (received_at, time.monotonic())
+                delay = start[1] + (received_at - start[0]) / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            elif replayed % INGEST_BATCH_SIZE == 0:
+                # Let processing keep up between batches
+                await asyncio.sleep(0)
+            await ingest.put(topic, payload)
+            replayed += 1
+    finally:
+        connection_status['status'] = False
+        connection_status['connected_since'] = None
+        on_status_change()
+    return replayed
+
+
+HISTORY_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS packets (
+    id INTEGER PRIMARY KEY,
+    igate TEXT NOT NULL,
+    callsign TEXT NOT NULL,
+    received REAL NOT NULL,
+    time TEXT,
+    epoch REAL,
+    destination TEXT,
+    path TEXT,
+    snr REAL,
+    rssi REAL,
+    latitude REAL,
+    longitude REAL,
+    elevation REAL,
+    distance REAL,
+    battery TEXT,
+    comment TEXT,
+    country TEXT,
+    digipeated_via TEXT
+);
+CREATE INDEX IF NOT EXISTS packets_callsign ON packets (callsign, received);
+CREATE INDEX IF NOT EXISTS packets_received ON packets (received);
+CREATE TABLE IF NOT EXISTS stations (
+    igate TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    callsign TEXT NOT NULL,
+    first_heard REAL NOT NULL,
+    last_heard REAL NOT NULL,
+    count INTEGER NOT NULL,
+    snr REAL,
+    rssi REAL,
+    country TEXT,
+    distance REAL,
+    elevation REAL,
+    battery TEXT,
+    digipeated_via TEXT,
+    PRIMARY KEY (igate, kind, callsign)
+);
+CREATE INDEX IF NOT EXISTS stations_last_heard ON stations (last_heard);
+'''
+
+# Columns of a packet row after id and igate, in DecodedPacket order where they overlap
+PACKET_COLUMNS = (
+    'callsign', 'received', 'time', 'epoch', 'destination', 'path', 'snr', 'rssi', 'latitude',
+    'longitude', 'elevation', 'distance', 'battery', 'comment', 'country', 'digipeated_via',
+)
+STATION_COLUMNS = (
+    'callsign', 'last_heard', 'count', 'snr', 'rssi', 'country', 'distance', 'elevation',
+    'battery', 'digipeated_via',
+)
+
+INSERT_PACKET = (f"INSERT INTO packets (igate, {', '.join(PACKET_COLUMNS)}) "
+                 f"VALUES ({', '.join('?' * (len(PACKET_COLUMNS) + 1))})")
+
+# The aggregates follow process_unique_callsigns: a direct packet updates the sender,
+# a digipeated one updates the sender's digipeated entry and the digipeater's signal
+UPSERT_DIRECT = '''
+INSERT INTO stations (igate, kind, callsign, first_heard, last_heard, count, snr, rssi, country, distance, elevation, battery)
+VALUES (?, 'direct', ?, ?, ?, 1, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (igate, kind, callsign) DO UPDATE SET
+    last_heard = excluded.last_heard, count = count + 1, snr = excluded.snr, rssi = excluded.rssi,
+    country = excluded.country, distance = excluded.distance, elevation = excluded.elevation,
+    battery = coalesce(excluded.battery, battery)
+'''
+UPSERT_DIGIPEATED = '''
+INSERT INTO stations (igate, kind, callsign, first_heard, last_heard, count, country, distance, elevation, battery, digipeated_via)
+VALUES (?, 'digipeated', ?, ?, ?, 1, ?, ?, ?, ?, ?)
+ON CONFLICT (igate, kind, callsign) DO UPDATE SET
+    last_heard = excluded.last_heard, count = count + 1, country = excluded.country,
+    distance = excluded.distance, elevation = excluded.elevation,
+    battery = coalesce(excluded.battery, battery), digipeated_via = excluded.digipeated_via
+'''
+UPSERT_VIA = '''
+INSERT INTO stations (igate, kind, callsign, first_heard, last_heard, count, snr, rssi)
+VALUES (?, 'direct', ?, ?, ?, 1, ?, ?)
+ON CONFLICT (igate, kind, callsign) DO UPDATE SET
+    last_heard = excluded.last_heard, count = count + 1, snr = excluded.snr, rssi = excluded.rssi
+'''
+
+
+def is_digipeated(digipeated_via):
+    return not (digipeated_via is MISSING or digipeated_via.strip() == '' or digipeated_via.upper() == 'N/A')
+
+
+def sql_value(value):
+    return None if value is MISSING else value
+
+
+def record_value(value):
+    return MISSING if value is None else value
+
+
+class HistoryStore:
+    """
+    Optional SQLite store of decoded packets and unique-callsign aggregates.
+    Rows are queued from the event loop and written by a background thread,
+    one transaction per batch, so a slow disk never stalls message processing.
+    """
+
+    def __init__(self, path, batch_rows=HISTORY_BATCH_ROWS, flush_interval=HISTORY_FLUSH_INTERVAL):
+        self.path = path
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.pending = queue.SimpleQueue()
+        self.written = 0
+        self.errors = 0            # Batches that failed to write
+        self.last_error = None     # Why the latest of them failed; never printed from this thread
+        # Create the schema up front so a bad path is reported before the UI starts
+        connection = sqlite3.connect(path)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')  # Readers don't block the writer
+            connection.executescript(HISTORY_SCHEMA)
+        finally:
+            connection.close()
+        self.thread = threading.Thread(target=self._write_behind, name='history-writer', daemon=True)
+        self.thread.start()
+
+    def add_packet(self, igate, packet, received=None):
+        """Queue a decoded packet and its aggregate updates. Cheap enough to call per message."""
+        received = time.time() if received is None else received
+        self.pending.put((igate, packet, received))
+
+    def flush(self, timeout=5.0):
+        # Wait until everything queued so far is committed
+        done = threading.Event()
+        self.pending.put(done)
+        return done.wait(timeout)
+
+    def close(self):
+        self.pending.put(None)
+        self.thread.join()
+
+    def status_text(self):
+        if not self.errors:
+            return []
+        return [('class:status_disconnected_text', f"History errors {self.errors} ({truncate_text(self.last_error, 40)})")]
+
+    def _write_behind(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        try:
+            stop = False
+            while not stop:
+                item = self.pending.get()
+                batch = []
+                waiting = []
+                deadline = time.monotonic() + self.flush_interval
+                # Collect a batch until it is full, the interval is up or someone waits for it
+                while True:
+                    if item is None:
+                        stop = True
+                        break
+                    if isinstance(item, threading.Event):
+                        waiting.append(item)
+                        break
+                    batch.append(item)
+                    if len(batch) >= self.batch_rows:
+                        break
+                    try:
+                        item = self.pending.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                if batch:
+                    self._write_batch(connection, batch)
+                for done in waiting:
+                    done.set()
+        finally:
+            connection.close()
+
+    def _write_batch(self, connection, batch):
+        packets = []
+        direct = []
+        digipeated = []
+        via = []
+        for igate, packet, received in batch:
+            callsign = packet.callsign.upper()
+            packets.append((
+                igate, callsign, received, packet.time, packet.epoch, sql_value(packet.destination),
+                sql_value(packet.path), sql_value(packet.snr), sql_value(packet.rssi),
+                sql_value(packet.latitude), sql_value(packet.longitude), sql_value(packet.elevation),
+                sql_value(packet.distance), sql_value(packet.battery), sql_value(packet.comment),
+                sql_value(packet.country), sql_value(packet.digipeated_via),
+            ))
+            if is_digipeated(packet.digipeated_via):
+                digipeated.append((
+                    igate, callsign, received, received, sql_value(packet.country), sql_value(packet.distance),
+                    sql_value(packet.elevation), sql_value(packet.battery), packet.digipeated_via,
+                ))
+                via.append((igate, packet.digipeated_via.upper(), received, received,
+                            sql_value(packet.snr), sql_value(packet.rssi)))
+            else:
+                direct.append((
+                    igate, callsign, received, received, sql_value(packet.snr), sql_value(packet.rssi),
+                    sql_value(packet.country), sql_value(packet.distance), sql_value(packet.elevation),
+                    sql_value(packet.battery),
+                ))
+        try:
+            with connection:  # One transaction per batch
+                connection.executemany(INSERT_PACKET, packets)
+                connection.executemany(UPSERT_DIRECT, direct)
+                connection.executemany(UPSERT_DIGIPEATED, digipeated)
+                connection.executemany(UPSERT_VIA, via)
+            self.written += len(packets)
+        except sqlite3.Error as e:
+            self.last_error = str(e)
+            self.errors += 1
+
+    def _query(self, sql, params):
+        connection = sqlite3.connect(self.path)
+        try:
+            return connection.execute(sql, params).fetchall()
+        finally:
+            connection.close()
+
+    def packets(self, callsign, since):
+        """(igate, *PACKET_COLUMNS) rows for one callsign received since the given epoch, oldest first."""
+        return self._query(
+            f"SELECT igate, {', '.join(PACKET_COLUMNS)} FROM packets "
+            f"WHERE callsign = ? AND received >= ? ORDER BY received",
+            (callsign.upper(), since))
+
+    def recent_packets(self, igates, limit):
+        """The latest (igate, *PACKET_COLUMNS) rows of the given iGates, oldest first."""
+        rows = self._query(
+            f"SELECT igate, {', '.join(PACKET_COLUMNS)} FROM packets "
+            f"WHERE igate IN ({', '.join('?' * len(igates))}) ORDER BY received DESC LIMIT ?",
+            (*igates, limit))
+        rows.reverse()
+        return rows
+
+    def stations(self, igates, since):
+        """(igate, kind, *STATION_COLUMNS) rows of the given iGates heard since the given epoch, oldest first."""
+        return self._query(
+            f"SELECT igate, kind, {', '.join(STATION_COLUMNS)} FROM stations "
+            f"WHERE igate IN ({', '.join('?' * len(igates))}) AND last_heard >= ? ORDER BY last_heard",
+            (*igates, since))
+
+
+def packet_from_row(row, now=None):
+    """Turn a (igate, *PACKET_COLUMNS) history row back into (igate, received, DecodedPacket)."""
+    (igate, callsign, received, timestamp_str, epoch, destination, path, snr, rssi, latitude,
+     longitude, elevation, distance, battery, comment, country, digipeated_via) = row
+    now = time.time() if now is None else now
+    packet = DecodedPacket(
+        time=timestamp_str,
+        callsign=callsign,
+        destination=record_value(destination),
+        path=record_value(path),
+        snr=record_value(snr),
+        rssi=record_value(rssi),
+        latitude=record_value(latitude),
+        longitude=record_value(longitude),
+        elevation=record_value(elevation),
+        distance=record_value(distance),
+        battery=record_value(battery),
+        comment=record_value(comment),
+        country=record_value(country),
+        digipeated_via=record_value(digipeated_via),
+        last_seen=time.monotonic() - (now - received),  # Same age on the monotonic clock
+        epoch=epoch
+    )
+    return igate, received, packet
+
+
+INVALID_TIMESTAMP = (None, 'Invalid Timestamp')
+
+
+@lru_cache(maxsize=4096)
+def local_time_text(second):
+    # One strftime per distinct second, however many messages share it
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(second))
+
+
+@lru_cache(maxsize=4096)
+def _parse_timestamp(timestamp):
+    try:
+        epoch = datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError, OverflowError, OSError):
+        return INVALID_TIMESTAMP
+    return epoch, local_time_text(int(epoch // 1))
+
+
+def parse_timestamp(timestamp):
+    """
+    Return (epoch seconds, local time text without timezone) for an ISO 8601 timestamp,
+    or (None, 'Invalid Timestamp'). Memoized, as bursts of messages share timestamps.
+    """
+    if type(timestamp) is not str:
+        return INVALID_TIMESTAMP
+    return _parse_timestamp(timestamp)
+
+
+# Topic -> route_topic() result; cleared when full, which is cheaper than LRU bookkeeping on every hit
+_route_cache = {}
+ROUTE_CACHE_SIZE = 65536
+
+
+def route_topic(topic):
+    """
+    Classify a message topic.
+    Returns ('log', igate, None), ('beacon', igate, None), ('decoded', igate, callsign)
+    or None for topics that carry nothing we show. The iGate is upper-cased.
+    Memoized, as every station keeps publishing on the same topic; cached results also
+    hand every record of a station the same iGate and callsign string objects.
+    """
+    route = _route_cache.get(topic, MISSING)
+    if route is MISSING:
+        if len(_route_cache) >= ROUTE_CACHE_SIZE:
+            _route_cache.clear()
+        route = _route_cache[topic] = classify_topic(topic)
+    return route
+
+
+def classify_topic(topic):
+    parts = topic.split('/')
+    if len(parts) == 3:
+        # Handle logs messages
+        if parts[2].lower() == 'logs':
+            return 'log', parts[1].upper(), None
+        # Unknown message type with three parts
+        return None
+    elif len(parts) >= 4:
+        igate = parts[1].upper()
+        subtopic = parts[2]
+        message_type = parts[3].lower()
+        if message_type == 'logs':
+            # Logs messages (in case they come with four parts)
+            return 'log', igate, None
+        elif message_type == 'json_message':
+            if subtopic.upper() == igate:
+                return 'beacon', igate, None
+            # Decoded station message; the callsign is the subtopic
+            return 'decoded', igate, subtopic
+    # Unknown message format
+    return None
+
+
+# Payload fields read for each message kind, in the order the decoders return them
+LOG_FIELDS = ('timestamp', 'raw_message')
+BEACON_FIELDS = (
+    'timestamp', 'destination', 'path', 'latitude', 'longitude', 'elevation', 'battery',
+    'comment', 'digipeated_via', 'country_code',
+)
+DECODED_FIELDS = (
+    'timestamp', 'destination', 'path', 'signal_quality', 'signal_strength', 'latitude',
+    'longitude', 'elevation', 'distance', 'battery', 'comment', 'country_code', 'digipeated_via',
+)
+
+JSON_BACKEND = 'msgspec' if msgspec is not None else 'orjson' if orjson is not None else 'json'
+
+# Every payload field must be a JSON scalar. Numbers and text are accepted in any field,
+# since feeds differ (battery is a number in some, text in others) and to_float/to_text
+# normalise both; objects, arrays and booleans make the payload malformed. Integers stay
+# integers, so every backend shows "battery": 4 as 4 rather than 4.0.
+PAYLOAD_FIELD_TYPE = Union[str, int, float, None]
+PAYLOAD_SCALARS = (str, float, int, type(None))  # The same check for the json/orjson backends
+
+# Some feeds send the path as a list of hops; to_text stringifies it like any other value
+LIST_FIELDS = frozenset(('path', 'digipeated_via'))
+LIST_FIELD_TYPE = Union[str, int, float, list, None]
+LIST_FIELD_VALUES = PAYLOAD_SCALARS + (list,)
+
+
+def make_decoder(name, fields):
+    """
+    Return a function that decodes a JSON payload (bytes or str) into a tuple of the
+    given fields, None for absent ones. Malformed payloads, payloads that are not JSON
+    objects and fields that are not PAYLOAD_FIELD_TYPE (LIST_FIELD_TYPE for LIST_FIELDS)
+    return None instead of raising.
+    """
+    if msgspec is not None:
+        # Decode straight into a typed struct with just these fields; anything else is skipped
+        schema = msgspec.defstruct(name, [
+            (field, LIST_FIELD_TYPE if field in LIST_FIELDS else PAYLOAD_FIELD_TYPE, None) for field in fields
+        ])
+        decode_struct = msgspec.json.Decoder(schema).decode
+        astuple = msgspec.structs.astuple
+
+        def decode(message):
+            try:
+                return astuple(decode_struct(message))
+            except msgspec.DecodeError:  # Also raised for non-object payloads
+                return None
+        return decode
+
+    loads = orjson.loads if orjson is not None else json.loads
+    allowed = [LIST_FIELD_VALUES if field in LIST_FIELDS else PAYLOAD_SCALARS for field in fields]
+
+    def decode(message):
+        try:
+            payload = loads(message)
+        except ValueError:  # JSON and UTF-8 decoding errors
+            return None
+        if type(payload) is not dict:
+            return None
+        values = tuple(map(payload.get, fields))
+        for value, types in zip(values, allowed):
+            if type(value) not in types:
+                return None
+        return values
+    return decode
+
+
+decode_log = make_decoder('LogPayload', LOG_FIELDS)
+decode_beacon = make_decoder('BeaconPayload', BEACON_FIELDS)
+decode_decoded = make_decoder('DecodedPayload', DECODED_FIELDS)
+
+
+def parse_log_message(message):
+    """Return (time, raw message) of a log payload, or None if it is malformed."""
+    log = decode_log(message)
+    if log is None:
+        return None
+    timestamp, raw_message = log
+    return parse_timestamp(timestamp)[1], raw_message or 'No Message'
+
+
+def parse_beacon_message(message, comment_length=None):
+    """Build a Beacon from a beacon payload, optionally truncating the comment. None if malformed."""
+    beacon = decode_beacon(message)
+    if beacon is None:
+        return None
+    (timestamp, destination, path, latitude, longitude, elevation, battery,
+     comment, digipeated_via, country_code) = beacon
+    comment = to_text(comment)
+    epoch, timestamp_str = parse_timestamp(timestamp)
+    return Beacon(
+        time=timestamp_str,
+        destination=to_text(destination, shared=True),
+        path=to_text(path),
+        latitude=to_float(latitude),
+        longitude=to_float(longitude),
+        elevation=to_float(elevation),
+        battery=to_text(battery),
+        comment=truncate_text(comment, comment_length) if comment_length else comment,
+        digipeated_via=to_text(digipeated_via, shared=True),
+        country=to_text(country_code, shared=True),  # Assuming country_code is part of beacon
+        last_seen=time.monotonic(),
+        epoch=epoch
+    )
+
+
+def parse_decoded_message(message, callsign, comment_length=None):
+    """Build a DecodedPacket from a decoded station payload, optionally truncating the comment. None if malformed."""
+    decoded = decode_decoded(message)
+    if decoded is None:
+        return None
+    (timestamp, destination, path, signal_quality, signal_strength, latitude,
+     longitude, elevation, distance, battery, comment, country_code, digipeated_via) = decoded
+    comment = to_text(comment)
+    epoch, timestamp_str = parse_timestamp(timestamp)
+    return DecodedPacket(
+        time=timestamp_str,
+        callsign=callsign,
+        destination=to_text(destination, shared=True),
+        path=to_text(path),
+        snr=to_float(signal_quality),
+        rssi=to_float(signal_strength),
+        latitude=to_float(latitude),
+        longitude=to_float(longitude),
+        elevation=to_float(elevation),
+        distance=to_float(distance),
+        battery=to_text(battery),
+        comment=truncate_text(comment, comment_length) if comment_length else comment,
+        country=to_text(country_code, shared=True),
+        digipeated_via=to_text(digipeated_via, shared=True),
+        last_seen=time.monotonic(),
+        epoch=epoch
+    )
+
+
+def truncate_text(text, max_length=20):
+    if text is MISSING:
+        return text
+    if len(text) > max_length:
+        return text[:max_length-3] + '...'
+    return text
+
+
+def format_seen(elapsed):
+    """
+    Format an elapsed number of seconds for the "Seen" column.
+    Returns the text and the elapsed time at which the text next changes.
+    """
+    total_seconds = int(elapsed)
+    hours, remainder = divmod(total_seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours > 0:
+        # Past an hour only minutes are shown, so the value changes once a minute
+        return f"{hours}h {minutes}m", (total_seconds // 60 + 1) * 60
+    if minutes > 0:
+        return f"{minutes}m {seconds}s", total_seconds + 1
+    return f"{seconds}s", total_seconds + 1
+
+
+# Callsign format, see validate_callsign
+CALLSIGN_PATTERN = re.compile(r"^(?=[^-]*\d)(?=(?:[^-]*[A-Za-z]){2,})[A-Za-z0-9]{1,7}(?:-[A-Za-z0-9]{1,2})?$")
+
+
+@lru_cache(maxsize=4096)
+def validate_callsign(callsign):
+    """
+    Validate the callsign format using the provided regex.
+    This regex ensures:
+    - At least two letters.
+    - At least one digit.
+    - 1 to 7 alphanumeric characters, optionally followed by a hyphen and 1 to 2 alphanumeric characters.
+    """
+    return bool(CALLSIGN_PATTERN.match(callsign))
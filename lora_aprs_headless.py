@@ -0,0 +1,309 @@
+"""
+Headless mode: stream iGate traffic as newline-delimited JSON (one record per line).
+Uses the same topic routing and payload parsing as the terminal UI but never imports
+prompt_toolkit, so it starts fast and stays small.
+
+    python3 lora_aprs_terminal.py --headless <iGate callsign> [...] [--output FILE]
+"""
+import sys
+import argparse  # For command-line options
+import asyncio
+import json
+import time
+import sqlite3  # For history database errors
+
+from lora_aprs_core import (
+    DEFAULT_QUEUE_SIZE, OVERFLOW_POLICIES, MISSING,
+    positive_int, non_negative_float, IngestQueue, new_connection_status, mqtt_handler, route_topic,
+    Metrics, measure_loop_lag, prometheus_text, serve_metrics,
+    CaptureWriter, capture_igates, replay_capture, HistoryStore, packet_from_row, fill_distance, valid_position,
+    parse_log_message, parse_beacon_message, parse_decoded_message, validate_callsign,
+)
+
+# Default number of records buffered before they are written out
+DEFAULT_BATCH_LINES = 1000
+
+# Default maximum number of seconds a record waits in the buffer
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Default time span of --query, in seconds
+DEFAULT_QUERY_SINCE = 24 * 3600
+
+
+def positive_float(value):
+    number = float(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"must be a positive number: {value}")
+    return number
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Stream iGate traffic from https://lora-aprs.live as NDJSON')
+    parser.add_argument('igates', nargs='*', metavar='IGATE',
+                        help='iGate callsign(s) to stream (default with --replay: every iGate in the capture)')
+    parser.add_argument('--headless', action='store_true', help=argparse.SUPPRESS)  # Selects this mode
+    parser.add_argument('--output', '-o', default='-',
+                        help='file to append records to, - for stdout (default: %(default)s)')
+    parser.add_argument('--batch-lines', type=positive_int, default=DEFAULT_BATCH_LINES,
+                        help='number of records buffered before writing (default: %(default)s)')
+    parser.add_argument('--flush-interval', type=positive_float, default=DEFAULT_FLUSH_INTERVAL, metavar='SECONDS',
+                        help='maximum time a record stays buffered (default: %(default)s)')
+    parser.add_argument('--queue-size', type=positive_int, default=DEFAULT_QUEUE_SIZE,
+                        help='number of received messages buffered for processing (default: %(default)s)')
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default=OVERFLOW_POLICIES[0],
+                        help='what to do when the buffer is full (default: %(default)s)')
+    parser.add_argument('--record', metavar='FILE',
+                        help='append every received message to a capture file')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='replay a capture file instead of connecting to the broker')
+    parser.add_argument('--replay-speed', type=non_negative_float, default=1.0, metavar='N',
+                        help='replay at N times the recorded speed, 0 for as fast as possible (default: %(default)s)')
+    parser.add_argument('--metrics-port', type=positive_int, metavar='PORT',
+                        help='serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--history', metavar='FILE',
+                        help='also keep decoded packets and station totals in an SQLite database')
+    parser.add_argument('--query', metavar='CALLSIGN',
+                        help='write the packets of CALLSIGN stored in --history and exit')
+    parser.add_argument('--since', type=positive_float, default=DEFAULT_QUERY_SINCE, metavar='SECONDS',
+                        help='how far back --query looks (default: %(default)s)')
+    args = parser.parse_args(argv)
+    if args.query and not args.history:
+        parser.error('--query needs --history')
+    if not args.igates and not args.replay and not args.query:
+        parser.error('at least one iGate callsign is required')
+    return args
+
+
+class NdjsonWriter:
+    """
+    Buffers serialized records and writes them out in batches.
+    A batch goes out once it holds batch_lines records, or after flush_interval at the latest.
+    """
+
+    def __init__(self, stream, batch_lines=DEFAULT_BATCH_LINES, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.stream = stream
+        self.batch_lines = batch_lines
+        self.flush_interval = flush_interval
+        self.pending = []
+        self.written = 0
+
+    def write(self, record):
+        self.pending.append(json.dumps(record, separators=(',', ':')))
+        if len(self.pending) >= self.batch_lines:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            # One write call per batch
+            self.stream.write('\n'.join(self.pending) + '\n')
+            self.written += len(self.pending)
+            self.pending = []
+        self.stream.flush()
+
+    async def run(self):
+        try:
+            while True:
+                # Flush partial batches so a quiet feed still shows up promptly
+                await asyncio.sleep(self.flush_interval)
+                self.flush()
+        except asyncio.CancelledError:
+            # Task was cancelled
+            pass
+
+
+def record_fields(record):
+    # last_seen is a monotonic time that means nothing outside this process
+    return {
+        name: None if getattr(record, name) is MISSING else getattr(record, name)
+        for name in record.__slots__ if name != 'last_seen'
+    }
+
+
+def build_record(kind, igate, callsign, message, history=None, igate_positions=None):
+    """
+    Parse one payload into a normalized, JSON-serializable record, or None if it is malformed.
+    igate_positions (iGate -> (latitude, longitude)) is updated from beacons and used to
+    compute missing distances.
+    """
+    if kind == 'log':
+        log = parse_log_message(message)
+        if log is None:
+            return None
+        record = {'type': kind, 'igate': igate, 'time': log[0], 'message': log[1]}
+    else:
+        # Comments are kept whole; truncation is only for the UI columns
+        if kind == 'beacon':
+            parsed = parse_beacon_message(message)
+        else:
+            parsed = parse_decoded_message(message, callsign)
+        if parsed is None:
+            return None
+        if igate_positions is not None:
+            if kind == 'beacon':
+                if valid_position(parsed.latitude, parsed.longitude):
+                    igate_positions[igate] = (parsed.latitude, parsed.longitude)
+            else:
+                fill_distance(parsed, igate_positions.get(igate))
+        if history is not None and kind == 'decoded':
+            history.add_packet(igate, parsed)
+        record = {'type': kind, 'igate': igate}
+        record.update(record_fields(parsed))
+    record['received'] = round(time.time(), 3)
+    return record
+
+
+async def stream_records(ingest, igates, writer, history=None, metrics=None):
+    metrics = Metrics() if metrics is None else metrics
+    igate_positions = {}  # Learned from the iGates' own beacons
+    try:
+        while True:
+            for topic, payload, received_at in await ingest.get_batch():
+                start = time.perf_counter()
+                route = route_topic(topic)
+                if route is None:
+                    metrics.messages['unrouted'] += 1
+                elif route[1] not in igates:
+                    metrics.messages['ignored'] += 1
+                else:
+                    kind, igate, callsign = route
+                    metrics.messages[kind] += 1
+                    record = build_record(kind, igate, callsign, payload, history, igate_positions)
+                    if record is None:
+                        # Malformed payloads are passed on as-is for the consumer to inspect
+                        ingest.rejected += 1
+                        metrics.rejected[kind] += 1
+                        record = {'type': 'invalid', 'igate': igate, 'topic': topic,
+                                  'payload': payload.decode(errors='replace'), 'received': round(time.time(), 3)}
+                    writer.write(record)
+                metrics.handle_seconds += time.perf_counter() - start
+                metrics.handled += 1
+                ingest.record_processed(received_at)
+            # Let the MQTT reader run between batches
+            await asyncio.sleep(0)
+    except asyncio.CancelledError:
+        # Task was cancelled
+        pass
+
+
+def query_records(history, callsign, since, writer):
+    # Stored packets come out in the same shape as live 'decoded' records
+    for row in history.packets(callsign, time.time() - since):
+        igate, received, packet = packet_from_row(row)
+        record = {'type': 'decoded', 'igate': igate}
+        record.update(record_fields(packet))
+        record['received'] = round(received, 3)
+        writer.write(record)
+    writer.flush()
+
+
+async def run(igates, writer, args, history=None):
+    ingest = IngestQueue(args.queue_size, args.overflow)
+    connection_status = new_connection_status()
+    metrics = Metrics()
+
+    def show_status():
+        # Status goes to stderr so stdout only ever carries records
+        if connection_status['status']:
+            print(f"Connected, streaming {', '.join(igates)}", file=sys.stderr)
+        elif connection_status['error'] is not None:
+            print(f"Error in MQTT handler: {connection_status['error']}", file=sys.stderr)
+
+    # Writing and parsing only stop early when they fail, e.g. because the output was closed
+    workers = [
+        asyncio.create_task(writer.run()),
+        asyncio.create_task(stream_records(ingest, set(igates), writer, history, metrics)),
+    ]
+    tasks = workers + [asyncio.create_task(measure_loop_lag(metrics))]
+    if args.metrics_port:
+        tasks.append(asyncio.create_task(serve_metrics(
+            args.metrics_port,
+            lambda: prometheus_text(metrics, ingest, connection_status, history=history)
+        )))
+    recorder = CaptureWriter(args.record) if args.record else None
+
+    async def feed():
+        if args.replay:
+            # Replay and stop; queued messages are drained before the tasks are cancelled
+            await replay_capture(args.replay, ingest, connection_status, show_status, args.replay_speed)
+            while ingest.processed < ingest.received - ingest.dropped:
+                await asyncio.sleep(0.01)
+        else:
+            await mqtt_handler(igates, ingest, connection_status, show_status, recorder)
+
+    source = asyncio.create_task(feed())
+    tasks.append(source)
+    try:
+        # Whichever ends first ends the run; a failed worker re-raises here instead of leaving the feed waiting
+        done, _ = await asyncio.wait([source] + workers, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                pass  # Already raised above, or irrelevant now that the run is over
+        if recorder is not None:
+            recorder.close()  # Only once the feed can no longer write to it
+        writer.flush()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    igates = [igate.upper() for igate in args.igates]
+    if args.replay:
+        try:
+            igates = igates or capture_igates(args.replay)  # Also checks the capture is readable
+        except (OSError, ValueError) as e:
+            print(f"Cannot replay capture: {e}", file=sys.stderr)
+            return 2
+    if args.record:
+        try:
+            CaptureWriter(args.record).close()  # Repairs an interrupted recording, refuses other files
+        except (OSError, ValueError) as e:
+            print(f"Cannot record capture: {e}", file=sys.stderr)
+            return 2
+    invalid = [igate for igate in igates if not validate_callsign(igate)]
+    if invalid:
+        print(f"Invalid iGate callsign provided via command-line: {', '.join(invalid)}", file=sys.stderr)
+        return 2
+
+    if sys.platform.startswith('win'):
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+
+    history = None
+    if args.history:
+        try:
+            history = HistoryStore(args.history)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Cannot open history database: {e}", file=sys.stderr)
+            return 2
+
+    stream = sys.stdout if args.output == '-' else open(args.output, 'a', encoding='utf-8')
+    writer = NdjsonWriter(stream, args.batch_lines, args.flush_interval)
+    try:
+        if args.query:
+            query_records(history, args.query, args.since, writer)
+        else:
+            asyncio.run(run(igates, writer, args, history))
+    except KeyboardInterrupt:
+        pass
+    except BrokenPipeError:
+        # The reader went away (e.g. piped into head)
+        return 0
+    finally:
+        if history is not None:
+            history.close()  # Writes out whatever is still queued
+        if stream is not sys.stdout:
+            stream.close()
+    print(f"Wrote {writer.written} records", file=sys.stderr)
+    if history is not None and history.errors:
+        print(f"History write failed {history.errors} times: {history.last_error}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
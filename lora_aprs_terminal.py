@@ -1,115 +1,712 @@
 import sys  # Import sys to access command-line arguments
+
+if __name__ == '__main__' and '--headless' in sys.argv[1:]:
+    # Headless mode streams NDJSON and must not pay for importing the UI
+    from lora_aprs_headless import main as headless_main
+    sys.exit(headless_main(sys.argv[1:]))
+
+import argparse  # For command-line options
 import asyncio
-import ssl
-import json
-import aiohttp  # Import aiohttp for asynchronous HTTP requests
-from datetime import datetime, timedelta  # Import datetime and timedelta
-from collections import OrderedDict  # For maintaining order of callsigns
-from aiomqtt import Client
+import os  # For profile file paths
+import time  # For monotonic "last seen" timestamps
+import cProfile  # For the profiling key
+import pstats
+import logging  # For slow-callback warnings while profiling
+import sqlite3  # For history database errors
+import json  # For the update check cache
+from itertools import islice  # For capping the number of rendered rows
+from heapq import nsmallest  # For the distance sort
 from prompt_toolkit.application import Application
-from prompt_toolkit.layout import Layout, HSplit, VSplit, Window
-from prompt_toolkit.widgets import TextArea, Label, Frame, VerticalLine
-from prompt_toolkit.key_binding import KeyBindings
+from prompt_toolkit.application.current import get_app
+from prompt_toolkit.layout import Layout, HSplit, VSplit, Window, ConditionalContainer
+from prompt_toolkit.layout.controls import UIControl, UIContent  # For the virtualized tables
+from prompt_toolkit.layout.margins import Margin
+from prompt_toolkit.mouse_events import MouseEventType
+from prompt_toolkit.widgets import Label, Frame, VerticalLine, Dialog, Button, CheckboxList, TextArea
+from prompt_toolkit.key_binding import KeyBindings, merge_key_bindings
+from prompt_toolkit.key_binding.defaults import load_key_bindings
+from prompt_toolkit.key_binding.bindings.focus import focus_next, focus_previous
+from prompt_toolkit.filters import Condition, has_focus  # For the filter prompt
 from prompt_toolkit.styles import Style
 from prompt_toolkit.layout.dimension import Dimension  # For dynamic sizing
 from prompt_toolkit.formatted_text import HTML  # For coloured status indicators
-from prompt_toolkit.shortcuts import radiolist_dialog, input_dialog  # Import for dialogs
-
-import re  # For callsign validation
+from prompt_toolkit.shortcuts import input_dialog  # Import for dialogs
+
+from lora_aprs_core import (
+    DEFAULT_LOG_CAPACITY, DEFAULT_MAX_ROWS, DEFAULT_QUEUE_SIZE, OVERFLOW_POLICIES,
+    positive_int, non_negative_float, build_retention, enforce_retention,
+    MISSING, fmt, Station, record_heard, rate_at, rate_due, IGateState, IngestQueue,
+    parse_filter, fill_distance, valid_position,
+    new_connection_status, MqttSession, session_feed, route_topic,
+    Metrics, measure_loop_lag, prometheus_text, serve_metrics,
+    CaptureWriter, capture_igates, replay_capture,
+    IGATE_CACHE_PATH, load_igate_cache, igate_cache_stale, refresh_igate_cache, save_json,
+    parse_log_message, parse_beacon_message, parse_decoded_message,
+    HistoryStore, HISTORY_RESTORE_AGE, packet_from_row, record_value, is_digipeated,
+    truncate_text, format_seen, validate_callsign,
+)
 
 # Version of the application
 version = '1.6'
 
+# The latest published version is cached next to the iGate cache and fetched at most once per TTL
+UPDATE_URL = 'https://raw.githubusercontent.com/madpsy/lora-aprs-python-client/refs/heads/main/VERSION'
+UPDATE_CACHE_PATH = os.path.join(os.path.dirname(IGATE_CACHE_PATH), 'update.json')
+UPDATE_CHECK_TTL = 24 * 3600
+UPDATE_CHECK_TIMEOUT = 5
+
+# Number of functions listed in each section of a profile report
+PROFILE_REPORT_LINES = 40
+
+# Default maximum number of UI frames rendered per second
+DEFAULT_FPS = 8
+
+# Table columns as (title, width)
+BEACON_COLUMNS = [
+    ('Time', 20), ('Destination', 20), ('Path', 15), ('Latitude', 10), ('Longitude', 10),
+    ('Elevation', 10), ('Battery', 7), ('Comment', 40), ('Digipeated Via', 14), ('Country', 7),
+]
+DECODED_COLUMNS = [
+    ('Time', 20), ('Callsign', 10), ('Destination', 20), ('Path', 15), ('SNR', 6), ('RSSI', 6),
+    ('Latitude', 10), ('Longitude', 10), ('Elevation', 10), ('Distance', 8), ('Battery', 7),
+    ('Comment', 20), ('Country', 7), ('Digipeated Via', 14),
+]
+UNIQUE_DIRECT_COLUMNS = [
+    ('Callsign', 10), ('SNR', 6), ('RSSI', 6), ('Country', 7), ('Distance', 8), ('Elevation', 9),
+    ('Battery', 7), ('Count', 5), ('Seen', 12),
+]
+UNIQUE_DIGIPEATED_COLUMNS = [
+    ('Callsign', 10), ('Digipeated Via', 14), ('Country', 7), ('Distance', 8), ('Elevation', 9),
+    ('Battery', 7), ('Count', 5), ('Seen', 12),
+]
+
+# Extra columns shown before "Seen" with --signal-stats
+RATE_COLUMN = ('Pkt/min', 7)  # Decays over time, so drawn with "Seen" rather than cached, see unique_row()
+DIRECT_STATS_COLUMNS = [
+    ('SNR Min', 7), ('SNR Avg', 7), ('SNR Max', 7), ('SNR Dev', 7), ('SNR EWMA', 8),
+    ('RSSI Avg', 8), ('RSSI Dev', 8), RATE_COLUMN,
+]
+DIGIPEATED_STATS_COLUMNS = [RATE_COLUMN]
+
 if sys.platform.startswith('win'):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='View iGate logs from https://lora-aprs.live')
+    parser.add_argument('igates', nargs='*', metavar='IGATE',
+                        help='iGate callsign(s) to monitor (select interactively if omitted)')
+    parser.add_argument('--merged', action='store_true',
+                        help='add an "All iGates" view combining every monitored iGate')
+    parser.add_argument('--log-lines', type=positive_int, default=DEFAULT_LOG_CAPACITY,
+                        help='number of lines kept in the Messages pane (default: %(default)s)')
+    parser.add_argument('--max-rows', type=positive_int, default=DEFAULT_MAX_ROWS,
+                        help='number of rows kept in the Beacons and Decoded Messages tables (default: %(default)s)')
+    parser.add_argument('--max-age', type=positive_int, default=None, metavar='SECONDS',
+                        help='drop Beacons and Decoded Messages rows older than this (default: no age limit)')
+    parser.add_argument('--fps', type=positive_int, default=DEFAULT_FPS,
+                        help='maximum number of table re-renders per second (default: %(default)s)')
+    parser.add_argument('--queue-size', type=positive_int, default=DEFAULT_QUEUE_SIZE,
+                        help='number of received messages buffered for processing (default: %(default)s)')
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default=OVERFLOW_POLICIES[0],
+                        help='what to do when the buffer is full (default: %(default)s)')
+    parser.add_argument('--record', metavar='FILE',
+                        help='append every received message to a capture file')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='replay a capture file instead of connecting to the broker')
+    parser.add_argument('--replay-speed', type=non_negative_float, default=1.0, metavar='N',
+                        help='replay at N times the recorded speed, 0 for as fast as possible (default: %(default)s)')
+    parser.add_argument('--signal-stats', action='store_true',
+                        help='show rolling SNR/RSSI statistics and packet rates in the unique-callsign tables')
+    parser.add_argument('--history', metavar='FILE',
+                        help='keep decoded packets and station totals in an SQLite database and restore them on start')
+    parser.add_argument('--metrics-port', type=positive_int, metavar='PORT',
+                        help='serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--profile-dir', default='.', metavar='DIR',
+                        help="directory the 'p' key writes profiles to (default: current directory)")
+    parser.add_argument('--slow-callback', type=positive_int, metavar='MS',
+                        help='while profiling, also log event-loop callbacks slower than this')
+    parser.add_argument('--headless', action='store_true',
+                        help='stream records as NDJSON instead of showing the UI (see --headless --help)')
+    return parser.parse_args(argv)
+
+
+class RenderScheduler:
+    """
+    Coalesces table refreshes into frames.
+    Message handlers only mark panes dirty; each dirty pane is re-rendered at most
+    once per frame and the application is invalidated once per frame.
+    """
+
+    def __init__(self, application, renderers, fps=DEFAULT_FPS, metrics=None):
+        self.application = application
+        self.renderers = renderers  # Pane name -> function that re-renders that pane
+        self.metrics = metrics      # Counts render errors, which would corrupt the screen if printed
+        self.frame_interval = 1.0 / fps
+        self.dirty = set()
+        self.wakeup = asyncio.Event()
+
+    def mark_dirty(self, *panes):
+        self.dirty.update(panes)
+        self.wakeup.set()
+
+    def render_frame(self):
+        dirty, self.dirty = self.dirty, set()
+        for pane, render in self.renderers.items():
+            if pane in dirty:
+                try:
+                    render()
+                except Exception as e:
+                    if self.metrics is not None:
+                        self.metrics.record_error('render', f"{pane}: {e}")
+        self.application.invalidate()
+
+    async def run(self):
+        try:
+            while True:
+                # Sleep until something changes, then render and hold off for the rest of the frame
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                self.render_frame()
+                await asyncio.sleep(self.frame_interval)
+        except asyncio.CancelledError:
+            # Task was cancelled
+            pass
+
+
+class ProfilerToggle:
+    """
+    Starts and stops cProfile over the running event loop.
+    Each run writes a .prof file (load it with pstats or snakeviz) and a text report
+    of the hottest functions; nothing is printed, so the full-screen UI is left alone.
+    """
+
+    def __init__(self, directory='.', slow_callback=None):
+        self.directory = directory
+        self.slow_callback = slow_callback  # Seconds, or None to leave asyncio debug mode off
+        self.profile = None
+        self.base_path = None
+        self.log_handler = None
+        self.runs = 0      # Numbers the files, so quick successive runs don't overwrite each other
+        self.message = ''  # Shown in the status bar
+
+    def toggle(self):
+        if self.profile is None:
+            self.start()
+        else:
+            self.stop()
+
+    def start(self):
+        self.runs += 1
+        self.base_path = os.path.join(self.directory, time.strftime('lora_aprs_profile_%Y%m%d_%H%M%S') + f'_{self.runs}')
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Another profiler is already attached to this thread
+            self.message = f"Cannot profile: {e}"
+            return
+        self.profile = profile
+        self.message = "Profiling ('p' to stop)"
+        if self.slow_callback is not None:
+            try:
+                self.log_handler = logging.FileHandler(self.base_path + '_slow.log')
+            except OSError as e:
+                self.message = f"Profiling ('p' to stop), no slow-callback log: {e}"
+                return
+            # asyncio reports callbacks slower than slow_callback_duration in debug mode
+            logger = logging.getLogger('asyncio')
+            logger.addHandler(self.log_handler)
+            logger.setLevel(logging.WARNING)
+            logger.propagate = False  # Keep the warnings off the terminal
+            loop = asyncio.get_running_loop()
+            loop.slow_callback_duration = self.slow_callback
+            loop.set_debug(True)
+
+    def close_slow_log(self, log_handler):
+        logger = logging.getLogger('asyncio')
+        logger.removeHandler(log_handler)
+        if not logger.handlers:
+            logger.propagate = True
+        log_handler.close()
+
+    def stop(self):
+        profile, self.profile = self.profile, None
+        profile.disable()
+        if self.log_handler is not None:
+            loop = asyncio.get_running_loop()
+            loop.set_debug(False)
+            # The callback running right now is still timed and may log, so detach on the next iteration
+            loop.call_soon(self.close_slow_log, self.log_handler)
+            self.log_handler = None
+        try:
+            profile.dump_stats(self.base_path + '.prof')
+            with open(self.base_path + '.txt', 'w', encoding='utf-8') as report:
+                stats = pstats.Stats(profile, stream=report)
+                stats.sort_stats('tottime').print_stats(PROFILE_REPORT_LINES)
+                stats.sort_stats('cumulative').print_stats(PROFILE_REPORT_LINES)
+            self.message = f"Profile saved to {self.base_path}.txt"
+        except OSError as e:
+            self.message = f"Cannot write profile: {e}"
+
+
+def format_cells(values, columns):
+    # Pad each cell to its column width
+    return ' '.join(f"{value:<{width}}" for value, (title, width) in zip(values, columns))
+
+
+class TableControl(UIControl):
+    """
+    Read-only, virtualized table.
+    Rows stay structured data in the source collection (newest last) and only the
+    rows inside the viewport are formatted. The scroll position is kept across updates:
+    while scrolled away from the newest row, the offset moves along with the rows that
+    the source's owner counts as appended.
+    """
+
+    def __init__(self, source, format_row=str, columns=None, owner=None):
+        self.source = source          # Function returning a sized, reversible collection of rows
+        self.format_row = format_row  # Turns one row of the source into a line of text
+        self.columns = columns        # List of (title, width), or None for a plain list without headers
+        self.owner = owner            # Function returning the object behind source, with an appended count
+        self.appended = (None, 0)     # (Owner, its appended count) as of the last render
+        self.offset = 0               # Index of the first visible row, counted from the newest
+        self.hoffset = 0              # Horizontal scroll in characters
+        self.page_size = 1            # Number of data rows that fit in the viewport
+        self.row_count = 0
+        self.version = 0              # Bumped whenever the underlying rows change
+        self.render_seconds = 0.0     # Total time spent building lines, for the metrics
+        self.renders = 0
+        self.sort_key = None          # Rows are shown smallest key first when set, newest first otherwise
+        self._cache_key = None
+        self._lines = []
+        self.key_bindings = self._create_key_bindings()
+
+        if columns:
+            self.header = [
+                format_cells([title for title, width in columns], columns),
+                format_cells(['-' * width for title, width in columns], columns),
+            ]
+        else:
+            self.header = []
+
+    def refresh(self):
+        # Called by the render scheduler, at most once per frame
+        self.version += 1
+
+    def scroll(self, rows):
+        self.offset = max(0, min(self.offset + rows, self.row_count - self.page_size))
+        self.refresh()
+
+    def format_rows(self, rows):
+        format_row = self.format_row
+        return [format_row(row) for row in rows]
+
+    def render_lines(self, height):
+        # Format the header plus only the rows that fit in the viewport
+        rows = self.source()
+        if self.owner is not None:
+            owner = self.owner()
+            last_owner, last_appended = self.appended
+            if self.offset > 0 and self.sort_key is None and owner is last_owner:
+                # Keep the same rows in view as newer ones arrive above them
+                self.offset += owner.appended - last_appended
+            self.appended = (owner, owner.appended)
+        self.row_count = len(rows)
+        self.page_size = max(height - len(self.header), 1)
+        self.offset = max(0, min(self.offset, self.row_count - self.page_size))
+        if self.sort_key is None:
+            visible = islice(reversed(rows), self.offset, self.offset + self.page_size)
+        else:
+            # Only as many rows as are on or above the page get ordered; ties stay newest first
+            visible = nsmallest(self.offset + self.page_size, reversed(rows), key=self.sort_key)[self.offset:]
+        return self.header + self.format_rows(visible)
+
+    def is_focusable(self):
+        return True
+
+    def create_content(self, width, height):
+        cache_key = (self.version, self.offset, self.hoffset, width, height)
+        if cache_key != self._cache_key:
+            render_start = time.perf_counter()
+            start = self.hoffset
+            self._lines = [line[start:start + width] for line in self.render_lines(height)]
+            self._cache_key = (self.version, self.offset, self.hoffset, width, height)  # Rendering may move the offset
+            self.render_seconds += time.perf_counter() - render_start
+            self.renders += 1
+        lines = self._lines
+
+        return UIContent(
+            get_line=lambda i: [('', lines[i])],
+            line_count=len(lines),
+            show_cursor=False,
+        )
+
+    def mouse_handler(self, mouse_event):
+        if mouse_event.event_type == MouseEventType.SCROLL_UP:
+            self.scroll(-3)
+        elif mouse_event.event_type == MouseEventType.SCROLL_DOWN:
+            self.scroll(3)
+        elif mouse_event.event_type == MouseEventType.MOUSE_UP:
+            get_app().layout.current_control = self  # Click to focus
+        else:
+            return NotImplemented
+        return None
+
+    def get_key_bindings(self):
+        return self.key_bindings
+
+    def _create_key_bindings(self):
+        kb = KeyBindings()
+
+        @kb.add('up')
+        def _(event):
+            self.scroll(-1)
+
+        @kb.add('down')
+        def _(event):
+            self.scroll(1)
+
+        @kb.add('pageup')
+        def _(event):
+            self.scroll(-self.page_size)
+
+        @kb.add('pagedown')
+        def _(event):
+            self.scroll(self.page_size)
+
+        @kb.add('home')
+        def _(event):
+            self.scroll(-self.row_count)
+
+        @kb.add('end')
+        def _(event):
+            self.scroll(self.row_count)
+
+        @kb.add('left')
+        def _(event):
+            self.hoffset = max(0, self.hoffset - 8)
+
+        @kb.add('right')
+        def _(event):
+            self.hoffset += 8
+
+        return kb
+
+
+class UniqueCallsignTable(TableControl):
+    """Unique-callsign table that tracks when its earliest visible "Seen" value changes."""
+
+    def __init__(self, source, build_prefix, columns, show_rate=False, owner=None):
+        super().__init__(source, columns=columns, owner=owner)
+        self.build_prefix = build_prefix
+        self.show_rate = show_rate  # Draw the decayed "Pkt/min" column before "Seen"
+        self.seen_due = float('inf')  # Monotonic time at which a visible "Seen" or rate value next changes
+
+    def format_rows(self, rows):
+        current_time = time.monotonic()
+        seen_due = float('inf')
+        lines = []
+        for callsign, station in rows:
+            lines.append(unique_row(callsign, station, current_time, self.build_prefix, self.show_rate))
+            seen_due = min(seen_due, station.seen_due)
+        self.seen_due = seen_due
+        return lines
+
+
+class TableScrollbar(Margin):
+    """Scrollbar for a TableControl, based on its virtual row count rather than the rendered lines."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def get_width(self, get_ui_content):
+        return 1
+
+    def create_margin(self, window_render_info, width, height):
+        table = self.table
+        header_height = len(table.header)
+        rows_height = height - header_height
+        fragments = [('', ' \n')] * min(header_height, height)
+        if rows_height <= 0:
+            return fragments
+
+        if table.row_count > rows_height:
+            thumb_size = max(1, rows_height * rows_height // table.row_count)
+            thumb_start = min(table.offset * rows_height // table.row_count, rows_height - thumb_size)
+        else:
+            thumb_size, thumb_start = rows_height, 0
+        for i in range(rows_height):
+            if thumb_start <= i < thumb_start + thumb_size:
+                fragments.append(('class:scrollbar.button', ' \n'))
+            else:
+                fragments.append(('class:scrollbar.background', ' \n'))
+        return fragments
+
+
+def table_window(table, style):
+    return Window(content=table, style=style, wrap_lines=False, right_margins=[TableScrollbar(table)])
+
+
 async def main():
-    current_igate = None  # Init current iGate as None
-    first_run = True       # Flag to indicate the first iteration
+    args = parse_args()
+
+    replay_igates = []
+    if args.replay:
+        try:
+            replay_igates = capture_igates(args.replay)  # Also checks the capture is readable
+        except (OSError, ValueError) as e:
+            print(f"Cannot replay capture: {e}")
+            return
+    if args.record:
+        try:
+            CaptureWriter(args.record).close()  # Repairs an interrupted recording, refuses other files
+        except (OSError, ValueError) as e:
+            print(f"Cannot record capture: {e}")
+            return
+
+    history = None
+    if args.history:
+        try:
+            history = HistoryStore(args.history)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Cannot open history database: {e}")
+            return
+
+    # One broker connection serves discovery and every iGate selection
+    session = None if args.replay else MqttSession(max_queued=args.queue_size)
+    if session is not None:
+        session.start()
+    try:
+        await select_and_run(args, replay_igates, history, session)
+    finally:
+        if session is not None:
+            await session.close()
+        if history is not None:
+            history.close()  # Writes out whatever is still queued
+
+
+async def select_and_run(args, replay_igates, history, session=None):
+    current_igates = []  # Init current iGates as empty
+    first_run = True     # Flag to indicate the first iteration
 
     while True:
-        if first_run and len(sys.argv) > 1:
-            selected_igate = sys.argv[1].upper()
-            if validate_callsign(selected_igate):
-                current_igate = selected_igate  # Set current iGate
-                first_run = False
-                print(f"Using iGate from command-line argument: {selected_igate}")  # Logging
-            else:
-                print(f"Invalid iGate callsign provided via command-line: {selected_igate}")
+        if first_run and (args.igates or replay_igates):
+            # Replays default to every iGate in the capture
+            selected_igates = [igate.upper() for igate in args.igates] or replay_igates
+            invalid = [igate for igate in selected_igates if not validate_callsign(igate)]
+            if invalid:
+                print(f"Invalid iGate callsign provided via command-line: {', '.join(invalid)}")
                 return
+            current_igates = selected_igates  # Set current iGates
+            first_run = False
+            print(f"Using iGates from command-line arguments: {', '.join(selected_igates)}")  # Logging
         else:
-            igates = await fetch_igates()
-            if not igates:
+            if args.replay:
+                cache = {'refreshed': 0.0, 'igates': dict.fromkeys(replay_igates)}
+                discover = False
+            else:
+                # Show cached iGates straight away; discovery only runs once the cache is stale
+                cache = load_igate_cache()
+                discover = igate_cache_stale(cache)
+            if not cache['igates'] and not discover:
                 print("No iGates found.")
                 return
 
-            # Pass current_igate as default for pre-selection
-            selected_igate = await select_igate(igates, default=current_igate)
-            if not selected_igate:
+            # Pass current_igates as default for pre-selection
+            selected_igates = await select_igates(cache, session, default=current_igates, discover=discover)
+            if not selected_igates:
                 print("No iGate selected.")
                 return
-            current_igate = selected_igate  # Update current iGate
-            print(f"Selected iGate: {selected_igate}")  # Logging
+            current_igates = selected_igates  # Update current iGates
+            print(f"Selected iGates: {', '.join(selected_igates)}")  # Logging
 
         # Run the main application
-        exit_to_select_igate = await run_application(selected_igate, current_igate)
+        exit_to_select_igate = await run_application(selected_igates, args, history, session)
         if not exit_to_select_igate:
             # User chose to exit the application completely
             break
-        # Else, loop back to re-select iGate
+        # Else, loop back to re-select iGates
 
 
-async def run_application(selected_igate, current_igate):
-    # Init connection status
-    connection_status = {'status': False}
+async def run_application(selected_igates, args, history=None, session=None):
+    # Connection status lives as long as the session, so reconnect counts survive iGate switches
+    connection_status = session.connection_status if session is not None else new_connection_status()
 
     # Init reset_in_progress flag
     reset_in_progress = {'value': False}
 
-    # Check for updates
-    new_version_available = await check_for_updates(version)
+    # The update check runs in the background; the label is filled in once it answers
+    new_version_label = Label(text='', style='class:new_version')
+    update_task = start_update_check()
 
-    # Create the 'new_version_label' based on 'new_version_available'
-    if new_version_available:
-        new_version_label = Label(text='New Version Available: https://github.com/madpsy/lora-aprs-python-client', style='class:new_version')
-    else:
-        new_version_label = Label(text='')
-
-    # Create UI components
-    logs_area = TextArea(style="class:logs", scrollbar=True, focusable=True, read_only=True)
-    beacons_area = TextArea(style="class:beacons", scrollbar=True, focusable=True, read_only=True)
-    decoded_stations_area = TextArea(style="class:decoded", scrollbar=True, focusable=True, read_only=True)
-    unique_direct_area = TextArea(style="class:unique_direct", scrollbar=True, focusable=True, read_only=True)
-    unique_digipeated_area = TextArea(style="class:unique_digipeated", scrollbar=True, focusable=True, read_only=True)
+    def show_new_version(task):
+        if not task.cancelled() and task.result():
+            new_version_label.text = 'New Version Available: https://github.com/madpsy/lora-aprs-python-client'
+            application.invalidate()
 
-    # Init data structures
-    unique_direct_dict = OrderedDict()
-    unique_digipeated_dict = OrderedDict()
-    beacons_dict = OrderedDict()            # New dictionary for beacons
-    decoded_stations_dict = OrderedDict()   # New dictionary for decoded stations
+    # Init data structures: one state per iGate, plus an optional merged view
+    states = [IGateState(igate, args.log_lines) for igate in selected_igates]
+    routes = {state.name: [state] for state in states}  # Topic iGate -> states fed by its messages
+    views = list(states)
+    if args.merged and len(states) > 1:
+        merged_state = IGateState('All iGates', args.log_lines, merged=True)
+        views.append(merged_state)
+        for targets in routes.values():
+            targets.append(merged_state)
+    view = {'index': 0}  # Index into views of the state shown in the tables
+
+    retention = build_retention(args)       # Row/age limits for beacons and decoded stations
+    ingest = IngestQueue(args.queue_size, args.overflow)  # Buffer between MQTT and processing
+    metrics = Metrics()                     # Pipeline counters for the status bar and --metrics-port
+    slow_callback = args.slow_callback / 1000 if args.slow_callback else None
+    profiler = ProfilerToggle(args.profile_dir, slow_callback)  # Toggled with 'p'
+
+    if history is not None:
+        # Pick up where the last run (or the last iGate selection) left off
+        await restore_history(history, routes, retention)
+
+    def current_state():
+        return views[view['index']]
+
+    # Create UI components; tables read straight from the state currently on view
+    logs_table = TableControl(lambda: current_state().logs_buffer.lines, owner=lambda: current_state().logs_buffer)
+    beacons_table = TableControl(lambda: current_state().indexes['beacons'].visible().values(), format_beacon_row, BEACON_COLUMNS,
+                                 lambda: current_state().indexes['beacons'])
+    decoded_stations_table = TableControl(lambda: current_state().indexes['decoded'].visible().values(), format_decoded_row, DECODED_COLUMNS,
+                                          lambda: current_state().indexes['decoded'])
+    if args.signal_stats:
+        direct_row_prefix, direct_columns = unique_direct_stats_row_prefix, with_stats_columns(UNIQUE_DIRECT_COLUMNS, DIRECT_STATS_COLUMNS)
+        digipeated_row_prefix, digipeated_columns = unique_digipeated_row_prefix, with_stats_columns(UNIQUE_DIGIPEATED_COLUMNS, DIGIPEATED_STATS_COLUMNS)
+    else:
+        direct_row_prefix, direct_columns = unique_direct_row_prefix, UNIQUE_DIRECT_COLUMNS
+        digipeated_row_prefix, digipeated_columns = unique_digipeated_row_prefix, UNIQUE_DIGIPEATED_COLUMNS
+    unique_direct_table = UniqueCallsignTable(lambda: current_state().indexes['unique_direct'].visible().items(), direct_row_prefix, direct_columns,
+                                              args.signal_stats, lambda: current_state().indexes['unique_direct'])
+    unique_digipeated_table = UniqueCallsignTable(lambda: current_state().indexes['unique_digipeated'].visible().items(), digipeated_row_prefix, digipeated_columns,
+                                                  args.signal_stats, lambda: current_state().indexes['unique_digipeated'])
+    tables = [logs_table, beacons_table, decoded_stations_table, unique_direct_table, unique_digipeated_table]
+
+    logs_area = table_window(logs_table, "class:logs")
+    beacons_area = table_window(beacons_table, "class:beacons")
+    decoded_stations_area = table_window(decoded_stations_table, "class:decoded")
+    unique_direct_area = table_window(unique_direct_table, "class:unique_direct")
+    unique_digipeated_area = table_window(unique_digipeated_table, "class:unique_digipeated")
+
+    # Row filter, entered with '/' and applied to the beacons, decoded and unique tables of every view
+    filter_state = {'filter': None, 'editing': False, 'error': '', 'return_to': None}
+
+    def apply_filter(buffer):
+        try:
+            station_filter = parse_filter(buffer.text)
+        except ValueError as e:
+            filter_state['error'] = str(e)
+            return True  # Keep the text so it can be corrected
+        for state in views:
+            state.set_filter(station_filter)
+        # Only recorded once every view took it, so Esc restores what is actually shown
+        filter_state['filter'] = station_filter
+        filter_state['error'] = ''
+        for table in tables:
+            table.offset = 0
+        scheduler.mark_dirty('beacons', 'decoded', 'unique_direct', 'unique_digipeated')
+        close_filter_prompt()
+        return True
+
+    def close_filter_prompt():
+        get_app().layout.focus(filter_state['return_to'])
+        filter_state['editing'] = False
+
+    filter_input = TextArea(multiline=False, accept_handler=apply_filter, style='class:filter')
+    typing = has_focus(filter_input)  # Single-key shortcuts are off while typing a filter
+
+    filter_kb = KeyBindings()
+
+    @filter_kb.add('escape')
+    def cancel_filter(event):
+        # Leave the active filter as it was
+        station_filter = filter_state['filter']
+        filter_input.text = station_filter.text if station_filter is not None else ''
+        filter_state['error'] = ''
+        close_filter_prompt()
+
+    filter_bar = ConditionalContainer(VSplit([
+        Label(text="Filter (CALL, *CALL, country:GB, min:KM, max:KM, battery, radius:KM[@LAT,LON], box:S,W,N,E; "
+                   "Enter to apply, Esc to cancel): ",
+              dont_extend_width=True),
+        filter_input,
+        Label(text=lambda: [('class:filter_error', filter_state['error'])], dont_extend_width=True),
+    ], key_bindings=filter_kb), filter=Condition(lambda: filter_state['editing']))
+
+    # Tables that can be sorted by distance with 'd', and their sort keys
+    distance_sorts = [
+        (decoded_stations_table, record_distance),
+        (unique_direct_table, station_distance),
+        (unique_digipeated_table, station_distance),
+    ]
+
+    def pane_title(title, pane, table=None):
+        # Frame titles show the sort order and how much of the table the filter lets through
+        def get_title():
+            text = title
+            if table is not None and table.sort_key is not None:
+                text += " (nearest first)"
+            index = current_state().indexes[pane]
+            if index.rows is not None:
+                text += f" ({len(index.rows)} of {len(index.records)}, filter: {index.filter.text})"
+            return text
+        return get_title
 
     # Create MQTT Status Indicator with formatted text
-    mqtt_status_indicator = Label(text=generate_status_text(connection_status['status']),
+    mqtt_status_indicator = Label(text=lambda: generate_status_text(connection_status),  # Evaluated on every redraw
                                   style="")  # Style is handled within the text
 
+    def show_status():
+        # Called by the MQTT handler whenever connection_status changes
+        application.invalidate()
+
     # Create frames with dynamic heights
     logs_frame = Frame(body=logs_area, title="Messages", height=Dimension(weight=1))
-    beacons_frame = Frame(body=beacons_area, title="Beacons", height=Dimension(weight=1))
-    decoded_stations_frame = Frame(body=decoded_stations_area, title="Decoded Messages", height=Dimension(weight=1))
-    unique_direct_frame = Frame(body=unique_direct_area, title="Unique Callsigns (Direct)", height=Dimension(weight=1))
-    unique_digipeated_frame = Frame(body=unique_digipeated_area, title="Unique Callsigns (Digipeated)", height=Dimension(weight=1))
+    beacons_frame = Frame(body=beacons_area, title=pane_title("Beacons", 'beacons'), height=Dimension(weight=1))
+    decoded_stations_frame = Frame(body=decoded_stations_area,
+                                   title=pane_title("Decoded Messages", 'decoded', decoded_stations_table),
+                                   height=Dimension(weight=1))
+    unique_direct_frame = Frame(body=unique_direct_area,
+                                title=pane_title("Unique Callsigns (Direct)", 'unique_direct', unique_direct_table),
+                                height=Dimension(weight=1))
+    unique_digipeated_frame = Frame(body=unique_digipeated_area,
+                                    title=pane_title("Unique Callsigns (Digipeated)", 'unique_digipeated',
+                                                     unique_digipeated_table),
+                                    height=Dimension(weight=1))
 
     # Modify Usage Info Line to Include MQTT Status Indicator
-    usage_info = VSplit([
-        Label(text="Use Tab/Shift+Tab to move focus between sections. Use arrow keys to scroll. 'r' to reset tables and reconnect. Esc to open iGate menu. Text size: Ctrl +/-",
-              style="class:instructions"),
-        mqtt_status_indicator
-    ], padding=1)
-
-    # Create header with Selected iGate and New Version Available message
+    usage_text = "Use Tab/Shift+Tab to move focus between sections. Use arrow keys to scroll. 'r' to reset tables and reconnect. 'p' to start/stop profiling. '/' to filter, 'd' to sort by distance. Esc to open iGate menu. Text size: Ctrl +/-"
+    if len(views) > 1:
+        usage_text += " [ / ] or 1-9 to switch iGate."
+    status_labels = [
+        Label(text=usage_text, style="class:instructions"),
+        Label(text=ingest.status_text, dont_extend_width=True),  # Evaluated on every redraw
+        Label(text=metrics.status_text, dont_extend_width=True),
+    ]
+    if history is not None:
+        status_labels.append(Label(text=history.status_text, dont_extend_width=True))  # Failed history writes
+    status_labels.append(Label(text=lambda: [('class:profiling', profiler.message)], dont_extend_width=True))
+    status_labels.append(mqtt_status_indicator)
+    usage_info = VSplit(status_labels, padding=1)
+
+    def igate_header():
+        if len(views) == 1:
+            return [('class:header', f"Selected iGate: {views[0].name}")]
+        fragments = [('class:header', "iGates:")]
+        for index, state in enumerate(views):
+            fragments.append(('', ' '))
+            fragments.append(('class:view_active' if index == view['index'] else 'class:view_inactive',
+                              f"[{index + 1}] {state.name}"))
+        return fragments
+
+    # Create header with Selected iGate(s) and New Version Available message
     header = VSplit([
-        Label(text=f"Selected iGate: {selected_igate}", style="class:header"),
+        Label(text=igate_header),  # Evaluated on every redraw
         Window(width=1, char=' '),  # Spacer
         new_version_label,
         ], padding=1)
@@ -124,6 +721,7 @@ async def run_application(selected_igate, current_igate):
     body = HSplit([
         header,
         usage_info,  # Replace previous instructions Label with the new usage_info containing status
+        filter_bar,
         logs_frame,
         beacons_frame,
         decoded_stations_frame,
@@ -142,35 +740,69 @@ async def run_application(selected_igate, current_igate):
         event.app.layout.focus_previous()
 
     @kb.add('c-c')
-    @kb.add('q')
+    @kb.add('q', filter=~typing)
     def exit_(event):
         print("Exit key pressed. Exiting application.")  # Logging
         event.app.exit(result=False)  # Return False to signal exit
 
-    @kb.add('escape')
+    @kb.add('escape', filter=~typing)
     def exit_to_select(event):
         print("Escape key pressed. Exiting to select iGate.")  # Logging
         event.app.exit(result=True)  # Return True to signal exit to select iGate
 
-    @kb.add('r')
+    def switch_view(index):
+        view['index'] = index % len(views)
+        for table in tables:
+            table.offset = 0
+        scheduler.mark_dirty('logs', 'beacons', 'decoded', 'unique_direct', 'unique_digipeated')
+
+    if len(views) > 1:
+        @kb.add(']', filter=~typing)
+        def next_view(event):
+            switch_view(view['index'] + 1)
+
+        @kb.add('[', filter=~typing)
+        def previous_view(event):
+            switch_view(view['index'] - 1)
+
+        for number in range(1, min(len(views), 9) + 1):
+            @kb.add(str(number), filter=~typing)
+            def select_view(event, index=number - 1):
+                switch_view(index)
+
+    @kb.add('p', filter=~typing)
+    def toggle_profiler(event):
+        profiler.toggle()
+        event.app.invalidate()
+
+    @kb.add('d', filter=~typing)
+    def toggle_distance_sort(event):
+        by_distance = decoded_stations_table.sort_key is None
+        for table, sort_key in distance_sorts:
+            table.sort_key = sort_key if by_distance else None
+            table.offset = 0
+        scheduler.mark_dirty('decoded', 'unique_direct', 'unique_digipeated')
+
+    @kb.add('/', filter=~typing)
+    def edit_filter(event):
+        filter_state['editing'] = True  # Makes the filter bar visible, so it can take the focus
+        filter_state['return_to'] = event.app.layout.current_window
+        event.app.layout.focus(filter_input)
+
+    @kb.add('r', filter=~typing)
     def reset_and_reconnect(event):
         if not reset_in_progress['value']:
             reset_in_progress['value'] = True
             asyncio.create_task(handle_reset_and_reconnect(
-                selected_igate,       # Pass the current iGate
-                unique_direct_dict,
-                unique_digipeated_dict,
-                unique_direct_area,
-                unique_digipeated_area,
-                beacons_dict,               # Pass beacons_dict
-                decoded_stations_dict,      # Pass decoded_stations_dict
+                start_source,         # Pass the message source factory
+                views,                # Pass every state, including the merged view
+                retention,                  # Pass retention limits
                 mqtt_task_container,
                 connection_status,
-                mqtt_status_indicator,
-                application,
-                logs_area,            # Pass logs_area
-                beacons_area,         # Pass beacons_area
-                decoded_stations_area, # Pass decoded_stations_area
+                show_status,          # Pass the status indicator update
+                ingest,               # Pass the ingestion queue
+                scheduler,            # Pass the render scheduler
+                unique_tables,        # Pass the unique-callsign tables
                 reset_in_progress,      # Pass the reset flag
                 update_seen_task_container  # Pass the task container
             ))
@@ -187,46 +819,87 @@ async def run_application(selected_igate, current_igate):
         mouse_support=True,  # Enable mouse support for clicking to focus
     )
 
+    # Tables whose "Seen" column has to be refreshed over time
+    unique_tables = {'unique_direct': unique_direct_table, 'unique_digipeated': unique_digipeated_table}
+
+    # Tables only re-render when the scheduler refreshes them, at most once per frame
+    scheduler = RenderScheduler(application, {
+        'logs': logs_table.refresh,
+        'beacons': beacons_table.refresh,
+        'decoded': decoded_stations_table.refresh,
+        'unique_direct': unique_direct_table.refresh,
+        'unique_digipeated': unique_digipeated_table.refresh,
+    }, fps=args.fps, metrics=metrics)
+    render_task = asyncio.create_task(scheduler.run())
+
     # Container to hold MQTT task for easy cancellation and reconnection
     mqtt_task_container = {'task': None}
 
     # Container to hold the update_seen_task for easy cancellation and reconnection
     update_seen_task_container = {'task': None}
 
-    # Start MQTT Handler Task and Store in Container
-    mqtt_task_container['task'] = asyncio.create_task(mqtt_handler(
-        selected_igate,
-        logs_area,
-        beacons_area,
-        decoded_stations_area,
-        unique_direct_area,
-        unique_digipeated_area,
-        unique_direct_dict,
-        unique_digipeated_dict,
-        beacons_dict,               # Pass beacons_dict
-        decoded_stations_dict,      # Pass decoded_stations_dict
-        application,
-        connection_status,
-        mqtt_status_indicator
+    # Start the task that processes queued messages
+    process_task = asyncio.create_task(process_messages(
+        ingest,
+        routes,                     # Pass the iGate -> states routing table
+        retention,                  # Pass retention limits
+        scheduler,                  # Pass the render scheduler
+        history,                    # Pass the optional history store
+        metrics                     # Pass the pipeline metrics
     ))
+    lag_task = asyncio.create_task(measure_loop_lag(metrics))
+
+    metrics_task = None
+    if args.metrics_port:
+        panes = {'logs': logs_table, 'beacons': beacons_table, 'decoded': decoded_stations_table,
+                 'unique_direct': unique_direct_table, 'unique_digipeated': unique_digipeated_table}
+        metrics_task = asyncio.create_task(serve_metrics(
+            args.metrics_port,
+            lambda: prometheus_text(metrics, ingest, connection_status, views, panes, history)
+        ))
+
+    # Messages come from the broker, or from a capture file when replaying
+    recorder = CaptureWriter(args.record) if args.record else None
+
+    def start_source(reconnect=False):
+        if args.replay:
+            return replay_capture(args.replay, ingest, connection_status, show_status, args.replay_speed)
+        # Swaps the subscriptions on the open connection; reconnect forces a fresh one
+        return session_feed(session, selected_igates, ingest, show_status, recorder, reconnect)
+
+    # Start MQTT Handler Task and Store in Container
+    mqtt_task_container['task'] = asyncio.create_task(start_source())
 
     # Start the background task for updating "Seen" times
     update_seen_task_container['task'] = asyncio.create_task(update_seen_times(
-        unique_direct_dict,
-        unique_digipeated_dict,
-        beacons_dict,
-        decoded_stations_dict,
-        unique_direct_area,
-        unique_digipeated_area,
-        beacons_area,
-        decoded_stations_area,
-        application
+        views,
+        retention,
+        scheduler,
+        unique_tables,
+        connection_status
     ))
 
+    update_task.add_done_callback(show_new_version)  # Runs straight away if the check already finished
+
     # Run the application and get the exit result
     exit_to_select_igate = await application.run_async()
+    update_task.remove_done_callback(show_new_version)
+
+    if profiler.profile is not None:
+        # Still profiling on exit; keep what was collected
+        profiler.stop()
+        print(profiler.message)
+
+    # After the application exits, we need to cancel the render, processing, metrics, mqtt and update_seen tasks
+    for task in (render_task, process_task, lag_task, metrics_task):
+        if task is None:
+            continue
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
 
-    # After the application exits, we need to cancel the mqtt_task and update_seen_task
     if update_seen_task_container['task'] is not None:
         update_seen_task_container['task'].cancel()
         try:
@@ -241,24 +914,22 @@ async def run_application(selected_igate, current_igate):
         except asyncio.CancelledError:
             pass
 
+    if recorder is not None:
+        recorder.close()
+
     return exit_to_select_igate
 
 
 async def handle_reset_and_reconnect(
-    selected_igate,       # Current iGate
-    unique_direct_dict,
-    unique_digipeated_dict,
-    unique_direct_area,
-    unique_digipeated_area,
-    beacons_dict,
-    decoded_stations_dict,
+    start_source,         # Returns the MQTT feed (or replay) coroutine
+    states,
+    retention,
     mqtt_task_container,
     connection_status,
-    mqtt_status_indicator,
-    application,
-    logs_area,
-    beacons_area,
-    decoded_stations_area,
+    show_status,
+    ingest,
+    scheduler,
+    unique_tables,
     reset_in_progress,
     update_seen_task_container  # Pass the update_seen_task container
 ):
@@ -271,23 +942,18 @@ async def handle_reset_and_reconnect(
             except asyncio.CancelledError:
                 pass
 
-        # Clear data structures
-        unique_direct_dict.clear()
-        unique_digipeated_dict.clear()
-        beacons_dict.clear()
-        decoded_stations_dict.clear()
+        # Drop queued messages and clear data structures
+        ingest.clear()
+        for state in states:
+            state.clear()
 
         # Clear UI tables
-        unique_direct_area.text = ""
-        unique_digipeated_area.text = ""
-        beacons_area.text = ""
-        decoded_stations_area.text = ""
-        logs_area.text = ""
+        scheduler.mark_dirty('logs', 'beacons', 'decoded', 'unique_direct', 'unique_digipeated')
 
         # Update status to Disconnected
         connection_status['status'] = False
-        mqtt_status_indicator.text = generate_status_text(connection_status['status'])
-        application.invalidate()
+        connection_status['connected_since'] = None
+        show_status()
 
         # Cancel existing MQTT task
         if mqtt_task_container['task'] is not None:
@@ -297,352 +963,213 @@ async def handle_reset_and_reconnect(
             except asyncio.CancelledError:
                 pass
 
-        # Start a new MQTT handler
-        mqtt_task_container['task'] = asyncio.create_task(mqtt_handler(
-            selected_igate,
-            logs_area,
-            beacons_area,
-            decoded_stations_area,
-            unique_direct_area,
-            unique_digipeated_area,
-            unique_direct_dict,
-            unique_digipeated_dict,
-            beacons_dict,
-            decoded_stations_dict,
-            application,
-            connection_status,
-            mqtt_status_indicator
-        ))
+        # Open a fresh connection, or restart the replay
+        mqtt_task_container['task'] = asyncio.create_task(start_source(reconnect=True))
 
         # Restart the update_seen_task
         update_seen_task_container['task'] = asyncio.create_task(update_seen_times(
-            unique_direct_dict,
-            unique_digipeated_dict,
-            beacons_dict,
-            decoded_stations_dict,
-            unique_direct_area,
-            unique_digipeated_area,
-            beacons_area,
-            decoded_stations_area,
-            application
+            states,
+            retention,
+            scheduler,
+            unique_tables,
+            connection_status
         ))
     finally:
         # Reset the reset_in_progress flag
         reset_in_progress['value'] = False
 
 
-def generate_status_text(is_connected):
-    if is_connected:
+def generate_status_text(connection_status):
+    if connection_status['status']:
+        text = 'Connected'
+        if connection_status['reconnects']:
+            recovered_in = format_seen(connection_status['last_outage'])[0]
+            text += f" (reconnects: {connection_status['reconnects']}, last recovery: {recovered_in})"
+        if connection_status['discarded']:
+            text += f" (discarded by client: {connection_status['discarded']})"
         return [
             ('class:status_connected_dot', '● '),
-            ('class:status_connected_text', 'Connected')
+            ('class:status_connected_text', text)
         ]
     else:
+        text = 'Disconnected'
+        if connection_status['down_since'] is not None:
+            current_time = time.monotonic()
+            down_for = format_seen(current_time - connection_status['down_since'])[0]
+            retry_in = max(0.0, connection_status['retry_at'] - current_time)
+            text += (f" (attempt {connection_status['attempts']}, retry in {retry_in:.0f}s, "
+                     f"down {down_for}: {connection_status['error']})")
         return [
             ('class:status_disconnected_dot', '● '),
-            ('class:status_disconnected_text', 'Disconnected')
+            ('class:status_disconnected_text', text)
         ]
 
 
-async def mqtt_handler(
-    selected_igate,
-    logs_area,
-    beacons_area,
-    decoded_stations_area,
-    unique_direct_area,
-    unique_digipeated_area,
-    unique_direct_dict,
-    unique_digipeated_dict,
-    beacons_dict,
-    decoded_stations_dict,
-    application,
-    connection_status,
-    mqtt_status_indicator
+async def process_messages(
+    ingest,
+    routes,
+    retention,
+    scheduler,
+    history=None,
+    metrics=None
 ):
-    topic = f'lora_aprs/{selected_igate}/#'
-
-    tls_context = ssl.create_default_context()
-
     try:
-        async with Client(
-            hostname='hydros.link9.net',
-            port=8183,
-            transport='websockets',
-            tls_context=tls_context,
-        ) as client:
-            # Update connection status to Connected
-            connection_status['status'] = True
-            mqtt_status_indicator.text = generate_status_text(connection_status['status'])
-            application.invalidate()
-
-            # Subscribe to the topic
-            await client.subscribe(topic)
-
-            # Iterate over the messages
-            async for message in client.messages:
-                await handle_message(
-                    str(message.topic),
-                    message.payload.decode(),
-                    selected_igate,
-                    logs_area,
-                    beacons_area,
-                    decoded_stations_area,
-                    unique_direct_area,
-                    unique_digipeated_area,
-                    unique_direct_dict,
-                    unique_digipeated_dict,
-                    beacons_dict,
-                    decoded_stations_dict,
-                    application
-                )
-    except Exception as e:
-        # Update connection status to Disconnected on error
-        connection_status['status'] = False
-        mqtt_status_indicator.text = generate_status_text(connection_status['status'])
-        application.invalidate()
-        print(f"Error in MQTT handler: {e}")  # Retain this for error debugging
+        while True:
+            for topic, payload, received_at in await ingest.get_batch():
+                start = time.perf_counter()
+                try:
+                    # Payloads are decoded as bytes; malformed ones are counted, not shown
+                    if await handle_message(topic, payload, routes, retention, scheduler, history, metrics) is False:
+                        ingest.rejected += 1
+                except Exception as e:
+                    if metrics is not None:
+                        metrics.record_error('handle', f"{topic}: {e}")
+                if metrics is not None:
+                    metrics.handle_seconds += time.perf_counter() - start
+                    metrics.handled += 1
+                ingest.record_processed(received_at)
+            # Let the MQTT reader and the UI run between batches
+            await asyncio.sleep(0)
+    except asyncio.CancelledError:
+        # Task was cancelled
+        pass
 
 
 async def handle_message(
     topic,
     message,
-    selected_igate,
-    logs_area,
-    beacons_area,
-    decoded_stations_area,
-    unique_direct_area,
-    unique_digipeated_area,
-    unique_direct_dict,
-    unique_digipeated_dict,
-    beacons_dict,
-    decoded_stations_dict,
-    application
+    routes,
+    retention,
+    scheduler,
+    history=None,
+    metrics=None
 ):
-    # Parse the topic
-    parts = topic.split('/')
-    if len(parts) == 3:
-        # Handle logs messages
-        igate = parts[1]
-        message_type = parts[2]
-        if message_type.lower() == 'logs':
-            await append_log_message(message, logs_area, application)
-        else:
-            # Unknown message type with three parts
-            return
-    elif len(parts) >= 4:
-        igate = parts[1]
-        subtopic = parts[2]
-        message_type = parts[3]
-
-        if message_type.lower() == 'logs':
-            # Handle logs messages (in case they come with four parts)
-            await append_log_message(message, logs_area, application)
-        elif message_type.lower() == 'json_message':
-            if subtopic.upper() == igate.upper():
-                # Beacon message
-                await append_beacon_message(message, beacons_area, application, beacons_dict)
-            else:
-                # Decoded station message
-                callsign = subtopic  # Assuming the callsign is the subtopic
-                await append_decoded_station_message(
-                    message,
-                    callsign,
-                    decoded_stations_area,
-                    unique_direct_area,
-                    unique_digipeated_area,
-                    unique_direct_dict,
-                    unique_digipeated_dict,
-                    decoded_stations_dict,    # Pass decoded_stations_dict
-                    application
-                )
-        else:
-            # Unknown message type
-            return
-    else:
-        # Unknown message format
+    """Route one message to its handler. Returns False if the payload was malformed."""
+    # Parse the topic (memoized per topic)
+    route = route_topic(topic)
+    if route is None:
+        # Unknown message format or type
+        if metrics is not None:
+            metrics.messages['unrouted'] += 1
+        return
+    kind, igate, callsign = route
+
+    # Route by iGate; every state fed by this iGate gets the message
+    states = routes.get(igate)
+    if states is None:
+        # Not one of the monitored iGates
+        if metrics is not None:
+            metrics.messages['ignored'] += 1
         return
 
+    result = await MESSAGE_HANDLERS[kind](message, callsign, igate, states, retention, scheduler, history)
+    if metrics is not None:
+        metrics.messages[kind] += 1
+        if result is False:
+            metrics.rejected[kind] += 1
+    return result
 
-async def append_log_message(message, logs_area, application):
-    try:
-        log = json.loads(message)
-        timestamp = log.get('timestamp', 'Invalid Timestamp')
-        try:
-            timestamp_dt = datetime.fromisoformat(timestamp)
-            local_timestamp = timestamp_dt.astimezone()
-            # Remove timezone from timestamp
-            timestamp_str = local_timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        except Exception:
-            timestamp_str = 'Invalid Timestamp'
 
-        raw_message = log.get('raw_message', 'No Message') or 'No Message'
-        formatted_message = f"{timestamp_str} {raw_message}\n"
-    except Exception:
-        formatted_message = f"Invalid log message: {message}\n"
+async def append_log_message(message, callsign, igate, states, retention, scheduler, history=None):
+    log = parse_log_message(message)
+    if log is None:
+        return False
+    formatted_message = f"{log[0]} {log[1]}"
 
-    logs_area.text = formatted_message + logs_area.text
-    # Limit number of lines
-    lines = logs_area.text.split('\n')
-    if len(lines) > 1000:
-        logs_area.text = '\n'.join(lines[:1000])
-    application.invalidate()
+    # O(1) append; the oldest line is evicted once the buffer is full
+    for state in states:
+        state.append_log(igate, formatted_message)
+    scheduler.mark_dirty('logs')
 
 
-def truncate_text(text, max_length=20):
-    if len(text) > max_length:
-        return text[:max_length-3] + '...'
-    return text
+async def append_beacon_message(message, callsign, igate, states, retention, scheduler, history=None):
+    # Increase max_length to 40 for Beacons section
+    record = parse_beacon_message(message, comment_length=40)
+    if record is None:
+        return False
 
+    # Create a unique identifier for the beacon, e.g., iGate + timestamp + destination
+    beacon_id = f"{igate}_{record.time}_{record.destination}"
 
-async def append_beacon_message(message, beacons_area, application, beacons_dict):
-    try:
-        beacon = json.loads(message)
-        timestamp = beacon.get('timestamp', 'Invalid Timestamp')
-        try:
-            timestamp_dt = datetime.fromisoformat(timestamp)
-            local_timestamp = timestamp_dt.astimezone()
-            # Remove timezone from timestamp
-            timestamp_str = local_timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        except Exception:
-            timestamp_str = 'Invalid Timestamp'
-
-        destination = beacon.get('destination', 'N/A') or 'N/A'
-        path = beacon.get('path', 'N/A') or 'N/A'
-        path = str(path)  # Ensure path is a string
-
-        latitude = beacon.get('latitude', 'N/A') or 'N/A'
-        longitude = beacon.get('longitude', 'N/A') or 'N/A'
-        elevation = beacon.get('elevation', 'N/A') or 'N/A'
-        battery = beacon.get('battery', 'N/A') or 'N/A'
-        # Increase max_length to 40 for Beacons section
-        comment = truncate_text(beacon.get('comment', 'N/A') or 'N/A', max_length=40)
-        digipeated_via = beacon.get('digipeated_via', 'N/A') or 'N/A'
-        digipeated_via = str(digipeated_via)  # Ensure digipeated_via is a string
-        country_code = beacon.get('country_code', 'N/A') or 'N/A'  # Assuming country_code is part of beacon
-
-        # Create a unique identifier for the beacon, e.g., timestamp + destination
-        beacon_id = f"{timestamp_str}_{destination}"
-
-        # Update the beacons_dict
-        beacons_dict[beacon_id] = {
-            'Time': timestamp_str,
-            'Destination': destination,
-            'Path': path,
-            'Latitude': latitude,
-            'Longitude': longitude,
-            'Elevation': elevation,
-            'Battery': battery,
-            'Comment': comment,
-            'Digipeated_Via': digipeated_via,
-            'Country': country_code,
-            'last_seen': datetime.now()
-        }
-
-        # Refresh the beacons area
-        refresh_beacons_area(beacons_dict, beacons_area)
+    # Update the beacons_dict of every state; the record itself is shared
+    # Beacons are the iGate's own, so they tell where it is
+    has_position = valid_position(record.latitude, record.longitude)
 
-    except Exception as e:
-        error_message = f"Invalid beacon message: {message}\nError: {e}\n"
-        beacons_area.text = error_message + beacons_area.text
-        # Optionally limit the number of displayed beacons
-        lines = beacons_area.text.split('\n')
-        if len(lines) > 1000:
-            beacons_area.text = '\n'.join(lines[:1000])
+    for state in states:
+        if has_position:
+            state.set_igate_position(igate, record.latitude, record.longitude)
+        state.beacons_dict[beacon_id] = record
+        # Keep the dict ordered oldest-first so retention can evict from the front
+        state.beacons_dict.move_to_end(beacon_id)
+        index = state.indexes['beacons']
+        index.update(beacon_id)
+        enforce_retention(state.beacons_dict, retention, index=index)
 
-    application.invalidate()
+    # Refresh the beacons area on the next frame
+    scheduler.mark_dirty('beacons')
 
 
 async def append_decoded_station_message(
     message,
     callsign,
-    decoded_stations_area,
-    unique_direct_area,
-    unique_digipeated_area,
-    unique_direct_dict,
-    unique_digipeated_dict,
-    decoded_stations_dict,
-    application
+    igate,
+    states,
+    retention,
+    scheduler,
+    history=None
 ):
-    try:
-        decoded = json.loads(message)
-        timestamp = decoded.get('timestamp', 'Invalid Timestamp')
-        try:
-            timestamp_dt = datetime.fromisoformat(timestamp)
-            local_timestamp = timestamp_dt.astimezone()
-            # Remove timezone from timestamp
-            timestamp_str = local_timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        except Exception:
-            timestamp_str = 'Invalid Timestamp'
-
-        destination = decoded.get('destination', 'N/A') or 'N/A'
-        path = decoded.get('path', 'N/A') or 'N/A'
-        path = str(path)  # Ensure path is a string
-
-        snr = decoded.get('signal_quality', 'N/A') or 'N/A'
-        rssi = decoded.get('signal_strength', 'N/A') or 'N/A'
-        latitude = decoded.get('latitude', 'N/A') or 'N/A'
-        longitude = decoded.get('longitude', 'N/A') or 'N/A'
-        elevation = decoded.get('elevation', 'N/A') or 'N/A'
-        distance = decoded.get('distance', 'N/A') or 'N/A'        # New
-        battery = decoded.get('battery', 'N/A') or 'N/A'          # New
-        comment = truncate_text(decoded.get('comment', 'N/A') or 'N/A')  # Truncate comment to default length
-        country_code = decoded.get('country_code', 'N/A') or 'N/A'
-        digipeated_via = decoded.get('digipeated_via', 'N/A') or 'N/A'
-        digipeated_via = str(digipeated_via)  # Ensure digipeated_via is a string
-
-        # Create a unique identifier for the decoded station, e.g., timestamp + callsign
-        station_id = f"{timestamp_str}_{callsign}"
-
-        # Update the decoded_stations_dict
-        decoded_stations_dict[station_id] = {
-            'Time': timestamp_str,
-            'Callsign': callsign,
-            'Destination': destination,
-            'Path': path,
-            'SNR': snr,
-            'RSSI': rssi,
-            'Latitude': latitude,
-            'Longitude': longitude,
-            'Elevation': elevation,
-            'Distance': distance,
-            'Battery': battery,
-            'Comment': comment,
-            'Country': country_code,
-            'Digipeated_Via': digipeated_via,
-            'last_seen': datetime.now(),
-            'Count': 1                    
-        }
+    # The comment is kept whole for the history and truncated when the row is drawn
+    packet = parse_decoded_message(message, callsign)
+    if packet is None:
+        return False
+    fill_distance(packet, states[0].igate_positions.get(igate))
+
+    if history is not None:
+        # Queued only; the write happens on the history thread
+        history.add_packet(igate, packet)
+
+    # Create a unique identifier for the decoded station, e.g., iGate + timestamp + callsign
+    station_id = f"{igate}_{packet.time}_{callsign}"
+
+    for state in states:
+        # Update the decoded_stations_dict; the packet itself is shared
+        state.decoded_stations_dict[station_id] = packet
+        # Keep the dict ordered oldest-first so retention can evict from the front
+        state.decoded_stations_dict.move_to_end(station_id)
+        index = state.indexes['decoded']
+        index.update(station_id)
+        enforce_retention(state.decoded_stations_dict, retention, index=index)
 
         # Process Unique Callsigns
         process_unique_callsigns(
             callsign,
-            digipeated_via,
-            snr,
-            rssi,
-            country_code,
-            distance,
-            elevation,
-            battery,
-            decoded_stations_dict,
-            unique_direct_dict,
-            unique_digipeated_dict,
-            unique_direct_area,
-            unique_digipeated_area,
-            application
+            packet.digipeated_via,
+            packet.snr,
+            packet.rssi,
+            packet.country,
+            packet.distance,
+            packet.elevation,
+            packet.battery,
+            packet.latitude,
+            packet.longitude,
+            state.decoded_stations_dict,
+            state.unique_direct_dict,
+            state.unique_digipeated_dict,
+            scheduler,
+            state.indexes['unique_direct'],
+            state.indexes['unique_digipeated']
         )
 
-        # Refresh the decoded stations area
-        refresh_decoded_stations_area(decoded_stations_dict, decoded_stations_area)
+    # Refresh the decoded stations area on the next frame
+    scheduler.mark_dirty('decoded')
 
-    except Exception as e:
-        error_message = f"Invalid decoded station message: {message}\nError: {e}\n"
-        decoded_stations_area.text = error_message + decoded_stations_area.text
-        # Optionally limit the number of displayed stations
-        lines = decoded_stations_area.text.split('\n')
-        if len(lines) > 1000:
-            decoded_stations_area.text = '\n'.join(lines[:1000])
 
-    application.invalidate()
+# Message kind (see route_topic) -> handler, all called as handler(message, callsign, igate, states, retention, scheduler, history)
+MESSAGE_HANDLERS = {
+    'log': append_log_message,
+    'beacon': append_beacon_message,
+    'decoded': append_decoded_station_message,
+}
 
 
 def process_unique_callsigns(
@@ -654,312 +1181,302 @@ def process_unique_callsigns(
     distance,
     elevation,
     battery,
+    latitude,
+    longitude,
     decoded_stations_dict,
     unique_direct_dict,
     unique_digipeated_dict,
-    unique_direct_area,
-    unique_digipeated_area,
-    application
+    scheduler,
+    unique_direct_index=None,      # TableIndex objects kept current for the filter
+    unique_digipeated_index=None
 ):
     callsign = callsign.upper()
-    current_time = datetime.now()
+    current_time = time.monotonic()
 
-    if not digipeated_via or digipeated_via.strip() == '' or digipeated_via.upper() == 'N/A':
+    if not is_digipeated(digipeated_via):
         # Direct call
-        if callsign in unique_direct_dict:
+        # 'Battery' is only taken from direct messages if not set by the digipeated section
+        digipeated_station = unique_digipeated_dict.get(callsign)
+        battery_from_digipeated = digipeated_station is not None and digipeated_station.battery is not MISSING
+
+        station = unique_direct_dict.get(callsign)
+        if station is not None:
             # Increment the count
-            unique_direct_dict[callsign]['Count'] += 1
+            station.count += 1
             # Update other fields
-            unique_direct_dict[callsign]['SNR'] = snr
-            unique_direct_dict[callsign]['RSSI'] = rssi
-            unique_direct_dict[callsign]['Country'] = country_code
-            unique_direct_dict[callsign]['Distance'] = distance if distance != 'N/A' else 'N/A'
-            unique_direct_dict[callsign]['Elevation'] = elevation if elevation != 'N/A' else 'N/A'
-
-            # Set 'Battery' only if not set by digipeated section
-            if not (callsign in unique_digipeated_dict and
-                    unique_digipeated_dict[callsign].get('Battery') and
-                    unique_digipeated_dict[callsign]['Battery'] != 'N/A'):
-                unique_direct_dict[callsign]['Battery'] = battery if battery != 'N/A' else unique_direct_dict[callsign].get('Battery', 'N/A')
-
-            unique_direct_dict[callsign]['last_seen'] = current_time
+            station.snr = snr
+            station.rssi = rssi
+            station.country = country_code
+            station.distance = distance
+            station.elevation = elevation
+            if not battery_from_digipeated and battery is not MISSING:
+                station.battery = battery
+            station.latitude = latitude
+            station.longitude = longitude
+            station.last_seen = current_time
+            station.row_prefix = None  # Row text must be rebuilt
+            unique_direct_dict.move_to_end(callsign)  # Keep the dict in recency order
         else:
-            # Init 'Battery' only if not set by digipeated section
-            if callsign in unique_digipeated_dict and \
-               unique_digipeated_dict[callsign].get('Battery') and \
-               unique_digipeated_dict[callsign]['Battery'] != 'N/A':
-                battery_value = 'N/A'  # Do not set battery from direct message
-            else:
-                battery_value = battery if battery != 'N/A' else 'N/A'
-
-            unique_direct_dict[callsign] = {
-                'SNR': snr,
-                'RSSI': rssi,
-                'Country': country_code,
-                'Distance': distance if distance != 'N/A' else 'N/A',
-                'Elevation': elevation if elevation != 'N/A' else 'N/A',
-                'Battery': battery_value,
-                'last_seen': current_time,
-                'Count': 1
-            }
+            station = unique_direct_dict[callsign] = Station(
+                last_seen=current_time,
+                snr=snr,
+                rssi=rssi,
+                country=country_code,
+                distance=distance,
+                elevation=elevation,
+                battery=MISSING if battery_from_digipeated else battery,
+                latitude=latitude,
+                longitude=longitude
+            )
+        record_heard(station, current_time, snr, rssi)
+        if unique_direct_index is not None:
+            unique_direct_index.update(callsign)
     else:
         # Digipeated call
-        if callsign in unique_digipeated_dict:
+        station = unique_digipeated_dict.get(callsign)
+        if station is not None:
             # Increment the count
-            unique_digipeated_dict[callsign]['Count'] += 1
+            station.count += 1
             # Update other fields
-            unique_digipeated_dict[callsign]['Digipeated_Via'] = digipeated_via
-            unique_digipeated_dict[callsign]['Country'] = country_code
-            unique_digipeated_dict[callsign]['Distance'] = distance if distance != 'N/A' else 'N/A'
-            unique_digipeated_dict[callsign]['Elevation'] = elevation if elevation != 'N/A' else 'N/A'
-            unique_digipeated_dict[callsign]['Battery'] = battery if battery != 'N/A' else unique_digipeated_dict[callsign].get('Battery', 'N/A')
-            unique_digipeated_dict[callsign]['last_seen'] = current_time
+            station.digipeated_via = digipeated_via
+            station.country = country_code
+            station.distance = distance
+            station.elevation = elevation
+            if battery is not MISSING:
+                station.battery = battery
+            station.latitude = latitude
+            station.longitude = longitude
+            station.last_seen = current_time
+            station.row_prefix = None  # Row text must be rebuilt
+            unique_digipeated_dict.move_to_end(callsign)  # Keep the dict in recency order
         else:
-            unique_digipeated_dict[callsign] = {
-                'Digipeated_Via': digipeated_via,
-                'Country': country_code,
-                'Distance': distance if distance != 'N/A' else 'N/A',
-                'Elevation': elevation if elevation != 'N/A' else 'N/A',
-                'Battery': battery if battery != 'N/A' else 'N/A',
-                'last_seen': current_time,
-                'Count': 1
-            }
+            station = unique_digipeated_dict[callsign] = Station(
+                last_seen=current_time,
+                digipeated_via=digipeated_via,
+                country=country_code,
+                distance=distance,
+                elevation=elevation,
+                battery=battery,
+                latitude=latitude,
+                longitude=longitude
+            )
+        # The signal belongs to the last hop, so it only counts towards the digipeater below
+        record_heard(station, current_time)
+        if unique_digipeated_index is not None:
+            unique_digipeated_index.update(callsign)
 
         # Add 'digipeated_via' to direct callsigns without setting 'Battery'
         digipeated_via_callsign = digipeated_via.upper()
-        if digipeated_via_callsign != 'N/A' and digipeated_via_callsign.strip() != '':
-            if digipeated_via_callsign in unique_direct_dict:
-                unique_direct_dict[digipeated_via_callsign]['Count'] += 1
-                unique_direct_dict[digipeated_via_callsign]['SNR'] = snr
-                unique_direct_dict[digipeated_via_callsign]['RSSI'] = rssi
-                # Do NOT set 'Battery' for digipeated_via_callsign
-                unique_direct_dict[digipeated_via_callsign]['Battery'] = unique_direct_dict[digipeated_via_callsign].get('Battery', 'N/A')
-                unique_direct_dict[digipeated_via_callsign]['last_seen'] = current_time
-            else:
-                unique_direct_dict[digipeated_via_callsign] = {
-                    'SNR': snr,
-                    'RSSI': rssi,
-                    'Country': 'N/A',
-                    'Distance': 'N/A',
-                    'Elevation': 'N/A',
-                    'Battery': 'N/A',  # Set 'Battery' to 'N/A'
-                    'last_seen': current_time,
-                    'Count': 1
-                }
-
-    # Refresh the displays
-    refresh_unique_direct_area(unique_direct_dict, unique_direct_area)
-    refresh_unique_digipeated_area(unique_digipeated_dict, unique_digipeated_area, unique_direct_dict)
-    application.invalidate()
-
-
-def refresh_unique_direct_area(unique_direct_dict, unique_direct_area):
-    # Define column headers with specified widths, including 'Battery' before 'Count' and 'Count' before 'Seen'
-    headers = f"{'Callsign':<10} {'SNR':<6} {'RSSI':<6} {'Country':<7} {'Distance':<8} {'Elevation':<9} {'Battery':<7} {'Count':<5} {'Seen':<12}\n"
-    separator = f"{'-'*10} {'-'*6} {'-'*6} {'-'*7} {'-'*8} {'-'*9} {'-'*7} {'-'*5} {'-'*12}\n"
-    content = headers + separator
-    current_time = datetime.now()
-
-    # Sort the unique_direct_dict based on 'last_seen' in descending order
-    sorted_direct = sorted(unique_direct_dict.items(), key=lambda item: item[1]['last_seen'], reverse=True)
-
-    for callsign, data in sorted_direct:
-        # Calculate the time difference
-        time_diff = current_time - data['last_seen']
-        seen_str = format_timedelta(time_diff)
-        # Safely get each field with defaults
-        snr = data.get('SNR') or 'N/A'
-        rssi = data.get('RSSI') or 'N/A'
-        country = data.get('Country') or 'N/A'
-        distance = data.get('Distance') or 'N/A'
-        elevation = data.get('Elevation') or 'N/A'
-        battery = data.get('Battery') or 'N/A'  # New field
-        count = data.get('Count') or 0
-        content += f"{callsign:<10} {snr:<6} {rssi:<6} {country:<7} {distance:<8} {elevation:<9} {battery:<7} {count:<5} {seen_str:<12}\n"
-
-    unique_direct_area.text = content
-    # Optionally limit the number of displayed callsigns
-    lines = unique_direct_area.text.split('\n')
-    if len(lines) > 1001:  # 1000 data lines + headers
-        unique_direct_area.text = '\n'.join(lines[:1001])
-
-
-def refresh_unique_digipeated_area(unique_digipeated_dict, unique_digipeated_area, unique_direct_dict):
-    # Define column headers with specified widths, including 'Battery' before 'Count' and 'Count' before 'Seen'
-    headers = f"{'Callsign':<10} {'Digipeated Via':<14} {'Country':<7} {'Distance':<8} {'Elevation':<9} {'Battery':<7} {'Count':<5} {'Seen':<12}\n"
-    separator = f"{'-'*10} {'-'*14} {'-'*7} {'-'*8} {'-'*9} {'-'*7} {'-'*5} {'-'*12}\n"
-    content = headers + separator
-    current_time = datetime.now()
-
-    # Sort the unique_digipeated_dict based on 'last_seen' in descending order
-    sorted_digipeated = sorted(unique_digipeated_dict.items(), key=lambda item: item[1]['last_seen'], reverse=True)
-
-    for callsign, data in sorted_digipeated:
-        # Calculate the time difference
-        time_diff = current_time - data['last_seen']
-        seen_str = format_timedelta(time_diff)
-        digipeated_via = data.get('Digipeated_Via') or 'N/A'
-        country = data.get('Country') or 'N/A'
-        distance = data.get('Distance') or 'N/A'
-        elevation = data.get('Elevation') or 'N/A'
-        battery = data.get('Battery') or 'N/A'  # New field
-        count = data.get('Count') or 0
-
-        content += f"{callsign:<10} {digipeated_via:<14} {country:<7} {distance:<8} {elevation:<9} {battery:<7} {count:<5} {seen_str:<12}\n"
-
-    unique_digipeated_area.text = content
-    # Optionally limit the number of displayed callsigns
-    lines = unique_digipeated_area.text.split('\n')
-    if len(lines) > 1001:  # 1000 data lines + headers
-        unique_digipeated_area.text = '\n'.join(lines[:1001])
-
-
-def refresh_beacons_area(beacons_dict, beacons_area):
-    # Define column headers with specified widths
-    headers = (
-        f"{'Time':<20} "
-        f"{'Destination':<20} "
-        f"{'Path':<15} "
-        f"{'Latitude':<10} "
-        f"{'Longitude':<10} "
-        f"{'Elevation':<10} "
-        f"{'Battery':<7} "
-        f"{'Comment':<40} "   # Increased width to 40
-        f"{'Digipeated Via':<14} "
-        f"{'Country':<7}\n"
-    )
-    separator = (
-        f"{'-'*20} "
-        f"{'-'*20} "
-        f"{'-'*15} "
-        f"{'-'*10} "
-        f"{'-'*10} "
-        f"{'-'*10} "
-        f"{'-'*7} "
-        f"{'-'*40} "        # Adjusted separator to match new width
-        f"{'-'*14} "
-        f"{'-'*7}\n"
-    )
-    content = headers + separator
-    current_time = datetime.now()
-
-    for beacon_id, data in reversed(beacons_dict.items()):
-        try:
-            time_diff = current_time - data['last_seen']
-            seen_str = format_timedelta(time_diff)
-            # Safely get each field with defaults
-            time_field = data.get('Time') or 'N/A'
-            destination = data.get('Destination') or 'N/A'
-            path = data.get('Path') or 'N/A'
-            path = str(path)  # Ensure path is a string
-            latitude = data.get('Latitude') or 'N/A'
-            longitude = data.get('Longitude') or 'N/A'
-            elevation = data.get('Elevation') or 'N/A'
-            battery = data.get('Battery') or 'N/A'
-            comment = data.get('Comment') or 'N/A'
-            digipeated_via = data.get('Digipeated_Via') or 'N/A'
-            digipeated_via = str(digipeated_via)  # Ensure digipeated_via is a string
-            country = data.get('Country') or 'N/A'
-
-            content += (
-                f"{time_field:<20} "
-                f"{destination:<20} "
-                f"{path:<15} "
-                f"{latitude:<10} "
-                f"{longitude:<10} "
-                f"{elevation:<10} "
-                f"{battery:<7} "
-                f"{comment:<40} "   # Adjusted width to 40
-                f"{digipeated_via:<14} "
-                f"{country:<7}\n"
-            )
-        except Exception as e:
-            print(f"Error processing beacon {beacon_id}: {e}")
-            continue
-
-    beacons_area.text = content
-    # Optionally limit the number of displayed beacons
-    lines = beacons_area.text.split('\n')
-    if len(lines) > 1001:
-        beacons_area.text = '\n'.join(lines[:1001])
-
-
-def refresh_decoded_stations_area(decoded_stations_dict, decoded_stations_area):
-    # Define column headers with specified widths
-    headers = f"{'Time':<20} {'Callsign':<10} {'Destination':<20} {'Path':<15} {'SNR':<6} {'RSSI':<6} {'Latitude':<10} {'Longitude':<10} {'Elevation':<10} {'Distance':<8} {'Battery':<7} {'Comment':<20} {'Country':<7} {'Digipeated Via':<14}\n"
-    separator = f"{'-'*20} {'-'*10} {'-'*20} {'-'*15} {'-'*6} {'-'*6} {'-'*10} {'-'*10} {'-'*10} {'-'*8} {'-'*7} {'-'*20} {'-'*7} {'-'*14}\n"
-    content = headers + separator
-    current_time = datetime.now()
-
-    for station_id, data in reversed(decoded_stations_dict.items()):
-        try:
-            time_diff = current_time - data['last_seen']
-            seen_str = format_timedelta(time_diff)
-            # Safely get each field with defaults
-            time_field = data.get('Time') or 'N/A'
-            callsign = data.get('Callsign') or 'N/A'
-            destination = data.get('Destination') or 'N/A'
-            path = data.get('Path') or 'N/A'
-            path = str(path)  # Ensure path is a string
-            snr = data.get('SNR') or 'N/A'
-            rssi = data.get('RSSI') or 'N/A'
-            latitude = data.get('Latitude') or 'N/A'
-            longitude = data.get('Longitude') or 'N/A'
-            elevation = data.get('Elevation') or 'N/A'
-            distance = data.get('Distance') or 'N/A'
-            battery = data.get('Battery') or 'N/A'
-            comment = data.get('Comment') or 'N/A'
-            country = data.get('Country') or 'N/A'
-            digipeated_via = data.get('Digipeated_Via') or 'N/A'
-            digipeated_via = str(digipeated_via)  # Ensure digipeated_via is a string
-
-            content += (
-                f"{time_field:<20} "
-                f"{callsign:<10} "
-                f"{destination:<20} "
-                f"{path:<15} "
-                f"{snr:<6} "
-                f"{rssi:<6} "
-                f"{latitude:<10} "
-                f"{longitude:<10} "
-                f"{elevation:<10} "
-                f"{distance:<8} "
-                f"{battery:<7} "
-                f"{comment:<20} "
-                f"{country:<7} "
-                f"{digipeated_via:<14}\n"
+        via_station = unique_direct_dict.get(digipeated_via_callsign)
+        if via_station is not None:
+            via_station.count += 1
+            via_station.snr = snr
+            via_station.rssi = rssi
+            via_station.last_seen = current_time
+            via_station.row_prefix = None  # Row text must be rebuilt
+            unique_direct_dict.move_to_end(digipeated_via_callsign)  # Keep the dict in recency order
+        else:
+            via_station = unique_direct_dict[digipeated_via_callsign] = Station(
+                last_seen=current_time,
+                snr=snr,
+                rssi=rssi
             )
-        except Exception as e:
-            print(f"Error processing decoded station {station_id}: {e}")
-            continue
-
-    decoded_stations_area.text = content
-    # Optionally limit the number of displayed stations
-    lines = decoded_stations_area.text.split('\n')
-    if len(lines) > 1001:
-        decoded_stations_area.text = '\n'.join(lines[:1001])
-
+        record_heard(via_station, current_time, snr, rssi)
+        if unique_direct_index is not None:
+            unique_direct_index.update(digipeated_via_callsign)
+
+    # Refresh the displays on the next frame
+    scheduler.mark_dirty('unique_direct', 'unique_digipeated')
+
+
+def read_history(history, igates, limit, since):
+    history.flush()  # Include rows still queued from the previous run_application
+    return history.recent_packets(igates, limit), history.stations(igates, since)
+
+
+async def restore_history(history, routes, retention):
+    """Fill the decoded and unique-callsign tables of every state from the history database."""
+    igates = list(routes)
+    # Waiting for the writer and querying happen on a thread, so the shared MQTT session keeps running
+    packets, stations = await asyncio.to_thread(
+        read_history, history, igates, retention['max_rows'] * len(igates), time.time() - HISTORY_RESTORE_AGE)
+    now = time.time()
+    current_time = time.monotonic()
+
+    for row in packets:
+        igate, received, packet = packet_from_row(row, now)
+        station_id = f"{igate}_{packet.time}_{packet.callsign}"
+        for state in routes[igate]:
+            state.decoded_stations_dict[station_id] = packet
+            state.decoded_stations_dict.move_to_end(station_id)
+
+    # Rows come oldest first, so the dicts end up in recency order like live updates leave them
+    for igate, kind, *fields in stations:
+        callsign, last_heard, count, snr, rssi, country, distance, elevation, battery, digipeated_via = fields
+        for state in routes[igate]:
+            stations = state.unique_direct_dict if kind == 'direct' else state.unique_digipeated_dict
+            station = stations.get(callsign)
+            if station is None:
+                station = stations[callsign] = Station(last_seen=0.0, count=0)
+            else:
+                # The merged view adds up the same callsign heard by several iGates
+                stations.move_to_end(callsign)
+            station.count += count
+            station.last_seen = current_time - (now - last_heard)
+            if kind == 'direct':
+                station.snr = record_value(snr)
+                station.rssi = record_value(rssi)
+            else:
+                station.digipeated_via = record_value(digipeated_via)
+            for name, value in (('country', country), ('distance', distance), ('elevation', elevation),
+                                ('battery', battery)):
+                if value is not None:
+                    setattr(station, name, value)
 
-def format_timedelta(td):
-    total_seconds = int(td.total_seconds())
-    hours, remainder = divmod(total_seconds, 3600)
-    minutes, seconds = divmod(remainder, 60)
-    parts = []
-    if hours > 0:
-        parts.append(f"{hours}h")
-    if minutes > 0 or hours > 0:
-        parts.append(f"{minutes}m")
-    parts.append(f"{seconds}s")
-    return ' '.join(parts)
+    for targets in routes.values():
+        for state in targets:
+            enforce_retention(state.decoded_stations_dict, retention, current_time)
+            for index in state.indexes.values():
+                if index.indexed:
+                    index.rebuild()
 
 
-async def update_seen_times(unique_direct_dict, unique_digipeated_dict, beacons_dict, decoded_stations_dict, unique_direct_area, unique_digipeated_area, beacons_area, decoded_stations_area, application):
+def unique_row(callsign, station, current_time, build_prefix, show_rate=False):
+    """
+    Return the cached table row for a unique-callsign entry.
+    The static part of the row is only rebuilt after the entry changed, and the
+    "Seen" suffix (and the decaying rate with show_rate) only once its displayed
+    value has actually changed.
+    """
+    if station.row_prefix is None:
+        station.row_prefix = build_prefix(callsign, station)
+        station.seen_due = current_time  # Force the suffix to be rebuilt
+    if current_time >= station.seen_due:
+        seen_str, next_change = format_seen(current_time - station.last_seen)
+        station.seen_due = station.last_seen + next_change
+        if show_rate:
+            rate = rate_at(station, current_time)
+            station.seen_due = min(station.seen_due, rate_due(rate, current_time))
+            rate_str = format_cells((format_stat(rate),), [RATE_COLUMN]) + ' '
+            station.row = f"{station.row_prefix}{rate_str}{seen_str:<12}"
+        else:
+            station.row = f"{station.row_prefix}{seen_str:<12}"
+    return station.row
+
+
+def unique_direct_row_prefix(callsign, station):
+    # Every column except "Seen", which unique_row() appends
+    return format_cells((
+        callsign,
+        fmt(station.snr),
+        fmt(station.rssi),
+        fmt(station.country),
+        fmt(station.distance),
+        fmt(station.elevation),
+        fmt(station.battery),
+        station.count,
+    ), UNIQUE_DIRECT_COLUMNS) + ' '
+
+
+def unique_digipeated_row_prefix(callsign, station):
+    # Every column except "Seen", which unique_row() appends
+    return format_cells((
+        callsign,
+        fmt(station.digipeated_via),
+        fmt(station.country),
+        fmt(station.distance),
+        fmt(station.elevation),
+        fmt(station.battery),
+        station.count,
+    ), UNIQUE_DIGIPEATED_COLUMNS) + ' '
+
+
+def with_stats_columns(columns, stats_columns):
+    # Statistics go between "Count" and "Seen"
+    return columns[:-1] + stats_columns + columns[-1:]
+
+
+def format_stat(value):
+    # Statistics are long floats; one decimal is plenty for SNR and RSSI
+    if value is MISSING:
+        return 'N/A'
+    return f"{value:.1f}"
+
+
+def unique_direct_stats_row_prefix(callsign, station):
+    snr = station.snr_stats
+    rssi = station.rssi_stats
+    return unique_direct_row_prefix(callsign, station) + format_cells((
+        format_stat(MISSING if snr is None else snr.minimum),
+        format_stat(MISSING if snr is None else snr.mean),
+        format_stat(MISSING if snr is None else snr.maximum),
+        format_stat(MISSING if snr is None else snr.deviation()),
+        format_stat(MISSING if snr is None else snr.ewma),
+        format_stat(MISSING if rssi is None else rssi.mean),
+        format_stat(MISSING if rssi is None else rssi.deviation()),
+    ), DIRECT_STATS_COLUMNS[:-1]) + ' '  # The rate is drawn by unique_row()
+
+
+def format_beacon_row(beacon):
+    return format_cells((
+        beacon.time,
+        fmt(beacon.destination),
+        fmt(beacon.path),
+        fmt(beacon.latitude),
+        fmt(beacon.longitude),
+        fmt(beacon.elevation),
+        fmt(beacon.battery),
+        fmt(beacon.comment),
+        fmt(beacon.digipeated_via),
+        fmt(beacon.country),
+    ), BEACON_COLUMNS)
+
+
+def record_distance(record):
+    # Sort key for the distance sort; rows without a distance go last
+    return float('inf') if record.distance is MISSING else record.distance
+
+
+def station_distance(item):
+    return record_distance(item[1])  # Unique-callsign rows are (callsign, station)
+
+
+def format_decoded_row(packet):
+    return format_cells((
+        packet.time,
+        packet.callsign,
+        fmt(packet.destination),
+        fmt(packet.path),
+        fmt(packet.snr),
+        fmt(packet.rssi),
+        fmt(packet.latitude),
+        fmt(packet.longitude),
+        fmt(packet.elevation),
+        fmt(packet.distance),
+        fmt(packet.battery),
+        fmt(truncate_text(packet.comment, 20)),
+        fmt(packet.country),
+        fmt(packet.digipeated_via),
+    ), DECODED_COLUMNS)
+
+
+async def update_seen_times(states, retention, scheduler, unique_tables, connection_status=None):
     try:
         while True:
-            refresh_unique_direct_area(unique_direct_dict, unique_direct_area)
-            refresh_unique_digipeated_area(unique_digipeated_dict, unique_digipeated_area, unique_direct_dict)
-            refresh_beacons_area(beacons_dict, beacons_area)
-            refresh_decoded_stations_area(decoded_stations_dict, decoded_stations_area)
+            # Expire aged-out rows even when no new messages arrive
+            current_time = time.monotonic()
+            for state in states:
+                if enforce_retention(state.beacons_dict, retention, current_time, state.indexes['beacons']):
+                    scheduler.mark_dirty('beacons')
+                if enforce_retention(state.decoded_stations_dict, retention, current_time, state.indexes['decoded']):
+                    scheduler.mark_dirty('decoded')
+            # Only the unique tables show a "Seen" column, and only re-render once a displayed value changed
+            due_panes = [pane for pane, table in unique_tables.items() if table.seen_due <= current_time]
+            if due_panes:
+                scheduler.mark_dirty(*due_panes)
+            # The status line counts down while disconnected, which only needs a redraw
+            if connection_status is not None and connection_status['down_since'] is not None:
+                scheduler.mark_dirty()
             await asyncio.sleep(1)  # Update every second
     except asyncio.CancelledError:
         # Task was cancelled
@@ -968,100 +1485,116 @@ async def update_seen_times(unique_direct_dict, unique_digipeated_dict, beacons_
         print(f"Error in update_seen_times: {e}")
 
 
-async def fetch_igates():
-    igates_set = set()
-    tls_context = ssl.create_default_context()
-    try:
-        async with Client(
-            hostname='hydros.link9.net',
-            port=8183,
-            transport='websockets',
-            tls_context=tls_context,
-        ) as client:
-            await client.subscribe('lora_aprs/#')
-
-            messages = client.messages
-
-            # Collect messages until no more messages come in for a certain time
-            timeout = 1.0  # seconds
-            while True:
-                try:
-                    message = await asyncio.wait_for(messages.__anext__(), timeout=timeout)
-                    topic_parts = str(message.topic).split('/')  # Convert Topic to string
-                    if len(topic_parts) >= 2:
-                        igate = topic_parts[1]
-                        if validate_callsign(igate):
-                            igates_set.add(igate)
-                except asyncio.TimeoutError:
-                    # No more messages
-                    break
-    except Exception as e:
-        print(f"Error fetching iGates via MQTT: {e}")
-        return []
-    else:
-        igates = list(igates_set)
-        igates.sort()  # Sort the iGates alphanumerically
-        return igates
+def igate_dialog(title, text, igate_list):
+    # Like checkboxlist_dialog, but keeps hold of the list so discovered iGates can be added to it
+    def ok_handler():
+        get_app().exit(result=igate_list.current_values)
 
+    dialog = Dialog(
+        title=title,
+        body=HSplit([Label(text=text, dont_extend_height=True), igate_list], padding=1),
+        buttons=[
+            Button(text="Ok", handler=ok_handler),
+            Button(text="Cancel", handler=lambda: get_app().exit()),
+        ],
+        with_background=True,
+    )
 
-async def select_igate(igates, default=None):
+    kb = KeyBindings()
+    kb.add('tab')(focus_next)
+    kb.add('s-tab')(focus_previous)
+
+    return Application(
+        layout=Layout(dialog),
+        key_bindings=merge_key_bindings([load_key_bindings(), kb]),
+        mouse_support=True,
+        full_screen=True,
+    )
+
+
+def igate_label(igate, heard):
+    if heard is None:
+        return igate
+    return f"{igate:<10} heard {format_seen(max(0.0, time.time() - heard))[0]} ago"
+
+
+async def select_igates(cache, session=None, default=None, discover=False):
     # Place "Enter Manually" at the top without a separator
     manual_entry_value = "__manual_entry__"
+    last_heard = cache['igates']
 
     igate_tuples = [
         (manual_entry_value, "Enter Manually")
-    ] + [(igate, igate) for igate in igates]
+    ] + [(igate, igate_label(igate, last_heard[igate])) for igate in sorted(last_heard)]
+
+    # Pre-select the previous selection if provided
+    default_values = [igate for igate in (default or []) if igate in last_heard]
+    if not default_values:
+        default_values = [manual_entry_value]  # Set "Enter Manually" as default if no previous selection
+
+    igate_list = CheckboxList(values=igate_tuples, default_values=default_values)
+    search = {'text': " (searching for more...)" if discover else ""}  # Replaced once discovery ends
+    application = igate_dialog(
+        "Select iGates",
+        lambda: "Please select one or more iGates, or choose to enter manually:" + search['text'],
+        igate_list
+    )
 
-    # Set default value if provided
-    if default and default in igates:
-        default_value = default
-    else:
-        default_value = manual_entry_value  # Set "Enter Manually" as default if no previous selection
-
-    # Display the radiolist dialog
-    igate = await radiolist_dialog(
-        title="Select iGate",
-        text="Please select an iGate or choose to enter manually:",
-        values=igate_tuples,
-        default=default_value  # Set default selection
-    ).run_async()
-
-    if igate == manual_entry_value:
-        # Prompt user to enter a callsign manually
+    def add_igate(igate):
+        # Appended rather than sorted in, so the cursor stays on the same entry
+        igate_list.values.append((igate, igate_label(igate, last_heard[igate])))
+        application.invalidate()
+
+    def discovery_done(task):
+        # Errors are shown in the dialog, since anything printed would write over it
+        if task.cancelled():
+            return
+        error = task.exception() or task.result()
+        search['text'] = f" ({error})" if error else ""
+        application.invalidate()
+
+    # Refresh the cache in the background while the dialog is already usable
+    discovery = asyncio.create_task(refresh_igate_cache(session, cache, add_igate)) if discover else None
+    if discovery is not None:
+        discovery.add_done_callback(discovery_done)
+    try:
+        # Display the checkbox dialog
+        selected = await application.run_async()
+    finally:
+        if discovery is not None:
+            discovery.cancel()
+            try:
+                await discovery
+            except asyncio.CancelledError:
+                pass
+
+    if not selected:
+        return None
+
+    selected_igates = [igate for igate in selected if igate != manual_entry_value]
+    if manual_entry_value in selected:
+        # Prompt user to enter callsigns manually
         while True:
             user_input = await input_dialog(
                 title="Manual iGate Entry",
-                text="Please enter the iGate callsign:"
+                text="Please enter one or more iGate callsigns (separated by spaces or commas):"
             ).run_async()
 
             if user_input is None:
                 # User cancelled the input dialog
                 return None
 
-            user_input = user_input.strip().upper()
-            if validate_callsign(user_input):
-                return user_input
+            entered = user_input.replace(',', ' ').upper().split()
+            if entered and all(validate_callsign(callsign) for callsign in entered):
+                selected_igates.extend(callsign for callsign in entered if callsign not in selected_igates)
+                break
             else:
                 # Show an error message and prompt again
                 await input_dialog(
                     title="Invalid Callsign",
-                    text="The entered callsign is invalid. Please enter a valid callsign."
+                    text="An entered callsign is invalid. Please enter valid callsigns."
                 ).run_async()
-    else:
-        return igate
-
-
-def validate_callsign(callsign):
-    """
-    Validate the callsign format using the provided regex.
-    This regex ensures:
-    - At least two letters.
-    - At least one digit.
-    - 1 to 7 alphanumeric characters, optionally followed by a hyphen and 1 to 2 alphanumeric characters.
-    """
-    callsign_pattern_with_ssid = r"^(?=[^-]*\d)(?=(?:[^-]*[A-Za-z]){2,})[A-Za-z0-9]{1,7}(?:-[A-Za-z0-9]{1,2})?$"
-    pattern = re.compile(callsign_pattern_with_ssid)
-    return bool(pattern.match(callsign))
+    return selected_igates
 
 
 def get_style():
@@ -1078,25 +1611,70 @@ def get_style():
         'status_disconnected_dot': 'fg:red bold',      # Red dot for disconnected
         'status_disconnected_text': 'fg:red bold',     # Red text for disconnected
         'new_version': 'fg:red bold',                  # Red bold text for new version message
+        'view_active': 'reverse bold',                 # iGate view currently shown
+        'view_inactive': '',                           # Other iGate views
+        'queue_stats': 'fg:gray',                      # Ingestion queue counters
+        'profiling': 'fg:yellow bold',                 # Profiler state
+        'filter': 'reverse',                           # Filter input
+        'filter_error': 'fg:red bold',                 # Invalid filter term
         # Optional: Style for "Enter Manually" to make it stand out
         'enter_manually': 'fg:cyan bold',              # Cyan bold text
     })
 
 
-async def check_for_updates(current_version):
-    url = 'https://raw.githubusercontent.com/madpsy/lora-aprs-python-client/refs/heads/main/VERSION'
+# Background update check, shared by every run_application in this process
+update_check = {'task': None}
+
+
+def start_update_check():
+    if update_check['task'] is None:
+        update_check['task'] = asyncio.create_task(check_for_updates(version))
+    return update_check['task']
+
+
+def load_update_cache(path=UPDATE_CACHE_PATH):
+    """Return the cached {'checked': time, 'latest': version or None}."""
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as resp:
-                if resp.status == 200:
-                    latest_version = (await resp.text()).strip()
-                    return latest_version != current_version
-                else:
-                    print(f"Failed to fetch latest version. Status code: {resp.status}")
-                    return False
-    except Exception as e:
-        print(f"Error checking for updates: {e}")
-        return False
+        with open(path) as cache_file:
+            cached = json.load(cache_file)
+        latest = cached.get('latest')
+        return {'checked': float(cached.get('checked', 0)), 'latest': latest if isinstance(latest, str) else None}
+    except (OSError, ValueError, TypeError, AttributeError):
+        # Missing or unreadable cache; check again
+        return {'checked': 0.0, 'latest': None}
+
+
+async def fetch_latest_version(timeout=UPDATE_CHECK_TIMEOUT):
+    # aiohttp is only needed here, so it stays off the startup path
+    import aiohttp
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as session:
+        async with session.get(UPDATE_URL) as resp:
+            if resp.status != 200:
+                return None
+            return (await resp.text()).strip()
+
+
+async def check_for_updates(current_version, path=UPDATE_CACHE_PATH):
+    """
+    Return True if a different version has been published.
+    A cached answer younger than UPDATE_CHECK_TTL is used as is. Failures are silent,
+    since the UI is already up by the time they happen, and are retried on the next start;
+    meanwhile the expired answer still counts, so going offline doesn't hide a known update.
+    """
+    cache = load_update_cache(path)
+    if cache['latest'] is None or time.time() - cache['checked'] > UPDATE_CHECK_TTL:
+        try:
+            latest_version = await fetch_latest_version()
+        except Exception:
+            latest_version = None
+        if latest_version is None:
+            return cache['latest'] is not None and cache['latest'] != current_version
+        cache = {'checked': time.time(), 'latest': latest_version}
+        try:
+            save_json(cache, path)
+        except OSError:
+            pass  # Checked again next time
+    return cache['latest'] != current_version
 
 
 if __name__ == '__main__':
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from lora_aprs_core import CAPTURE_MAGIC, CaptureWriter, capture_igates, read_capture
+
+RECORDS = [
+    (1.5, 'lora_aprs/N0CALL/logs', b'{"raw_message": "log"}'),
+    (2.25, 'lora_aprs/N0CALL/M0ABC/json_message', b'{"latitude": 55.9}'),
+    (3.0, 'lora_aprs/AB1CD/AB1CD/json_message', b''),
+]
+
+
+def write_capture(path, records):
+    writer = CaptureWriter(path)
+    for record in records:
+        writer.write(*record)
+    writer.close()
+    return writer
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'traffic.cap')
+    writer = write_capture(path, RECORDS)
+    assert writer.recorded == len(RECORDS)
+    assert list(read_capture(path)) == RECORDS
+    assert capture_igates(path) == ['AB1CD', 'N0CALL']
+
+
+def test_appends_to_an_existing_capture(tmp_path):
+    path = str(tmp_path / 'traffic.cap')
+    write_capture(path, RECORDS[:1])
+    write_capture(path, RECORDS[1:])
+    assert list(read_capture(path)) == RECORDS
+
+
+@pytest.mark.parametrize('cut', [1, 20, 60, 66])  # Into the payload, the topic and the header
+def test_cut_short_record_is_ignored(tmp_path, cut):
+    path = str(tmp_path / 'traffic.cap')
+    write_capture(path, RECORDS[:2])
+    os.truncate(path, os.path.getsize(path) - cut)
+    assert list(read_capture(path)) == RECORDS[:1]
+
+
+@pytest.mark.parametrize('cut', [1, 20, 60, 66])  # Into the payload, the topic and the header
+def test_appending_after_a_cut_short_record(tmp_path, cut):
+    path = str(tmp_path / 'traffic.cap')
+    write_capture(path, RECORDS[:2])
+    os.truncate(path, os.path.getsize(path) - cut)
+    write_capture(path, RECORDS[1:])
+    assert list(read_capture(path)) == RECORDS
+
+
+@pytest.mark.parametrize('content', [b'', b'LORA'])
+def test_empty_or_cut_short_header_is_started_over(tmp_path, content):
+    path = tmp_path / 'traffic.cap'
+    path.write_bytes(content)
+    write_capture(str(path), RECORDS)
+    assert path.read_bytes().startswith(CAPTURE_MAGIC)
+    assert list(read_capture(str(path))) == RECORDS
+
+
+def test_other_files_are_refused(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_bytes(b'not a capture')
+    with pytest.raises(ValueError):
+        list(read_capture(str(path)))
+    with pytest.raises(ValueError):
+        CaptureWriter(str(path))
+    assert path.read_bytes() == b'not a capture'
@@ -0,0 +1,96 @@
+import pytest
+
+from lora_aprs_core import (
+    MISSING, Station, StationFilter, parse_filter, parse_decoded_message, to_float,
+    valid_position, fill_distance,
+)
+
+
+def test_empty_filter_is_none():
+    assert parse_filter('') is None
+    assert parse_filter('   ') is None
+
+
+def test_parse_terms():
+    station_filter = parse_filter('m0 country:gb,fr min:5 max:50.5 battery radius:10@55.9,-3.2 box:50,-10,60,2')
+    assert station_filter.text == 'm0 country:gb,fr min:5 max:50.5 battery radius:10@55.9,-3.2 box:50,-10,60,2'
+    assert station_filter.prefix == 'M0'
+    assert station_filter.countries == frozenset({'GB', 'FR'})
+    assert station_filter.min_distance == 5.0
+    assert station_filter.max_distance == 50.5
+    assert station_filter.battery
+    assert station_filter.radius == 10.0
+    assert station_filter.center == (55.9, -3.2)
+    assert station_filter.box == (50.0, -10.0, 60.0, 2.0)
+
+
+def test_parse_substring_and_igate_radius():
+    station_filter = parse_filter('*abc radius:25')
+    assert station_filter.substring == 'ABC'
+    assert station_filter.prefix == ''
+    assert station_filter.center is None
+
+
+@pytest.mark.parametrize('text', [
+    'country:', 'min:x', 'max:', 'radius:-1', 'radius:5@55', 'radius:5@95,0', 'box:1,2,3',
+    'box:10,0,5,1', 'box:0,0,1,181', 'colour:red', 'M0 G4',
+])
+def test_bad_terms(text):
+    with pytest.raises(ValueError):
+        parse_filter(text)
+
+
+@pytest.mark.parametrize('text', [
+    'radius:nan', 'radius:inf', 'radius:-inf', 'min:nan', 'min:inf', 'max:nan', 'max:-inf',
+    'radius:5@nan,0', 'radius:5@0,inf', 'box:nan,0,1,1', 'box:0,0,1,inf',
+])
+def test_non_finite_values_are_rejected(text):
+    with pytest.raises(ValueError):
+        parse_filter(text)
+
+
+@pytest.mark.parametrize('value', ['nan', 'inf', '-inf', float('nan'), float('inf'), 1e400, 'x', None])
+def test_to_float_rejects_non_finite(value):
+    assert to_float(value) is MISSING
+
+
+@pytest.mark.parametrize('latitude, longitude, valid', [
+    (0.0, 0.0, True), (90.0, 180.0, True), (-90.0, -180.0, True),
+    (90.5, 0.0, False), (0.0, -180.5, False), (MISSING, 0.0, False), (0.0, MISSING, False),
+])
+def test_valid_position(latitude, longitude, valid):
+    assert valid_position(latitude, longitude) is valid
+
+
+def test_non_finite_payload_positions_are_missing():
+    packet = parse_decoded_message(b'{"latitude": "nan", "longitude": "inf", "distance": "-inf"}', 'M0ABC')
+    assert packet.latitude is MISSING
+    assert packet.longitude is MISSING
+    assert packet.distance is MISSING
+
+
+@pytest.mark.parametrize('latitude, longitude', [(MISSING, 0.0), (95.0, 0.0), (0.0, 200.0)])
+def test_fill_distance_skips_unusable_positions(latitude, longitude):
+    packet = Station(last_seen=0.0, latitude=latitude, longitude=longitude)
+    fill_distance(packet, (55.0, -3.0))
+    assert packet.distance is MISSING
+
+
+def test_fill_distance():
+    packet = Station(last_seen=0.0, latitude=55.0, longitude=-3.0)
+    fill_distance(packet, (56.0, -3.0))
+    assert packet.distance == pytest.approx(111.2, abs=0.1)
+
+
+def test_matches_ignores_unusable_positions():
+    station_filter = StationFilter(radius=1000.0, center=(0.0, 0.0))
+    assert not station_filter.matches('M0ABC', Station(last_seen=0.0, latitude=95.0, longitude=0.0))
+    assert not station_filter.matches('M0ABC', Station(last_seen=0.0))
+    assert station_filter.matches('M0ABC', Station(last_seen=0.0, latitude=1.0, longitude=1.0))
+
+
+def test_distance_terms_skip_tables_without_distance():
+    station_filter = parse_filter('min:5')
+    record = Station(last_seen=0.0)
+    assert not station_filter.matches('M0ABC', record)
+    assert station_filter.matches('M0ABC', record, has_distance=False)
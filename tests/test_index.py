@@ -0,0 +1,161 @@
+import random
+from collections import OrderedDict
+
+import pytest
+
+from lora_aprs_core import (
+    MISSING, Station, SpatialGrid, TableIndex, enforce_retention, haversine, in_box, parse_filter,
+    station_callsign, valid_position,
+)
+
+# Positions that the grid has to cope with: around the poles and the antimeridian,
+# missing, out of range and not finite
+EDGE_POSITIONS = [
+    (90.0, 0.0), (-90.0, 180.0), (89.99, -179.99), (-89.9, 45.0), (0.0, 180.0), (0.0, -180.0),
+    (10.0, 179.8), (-10.0, -179.7), (MISSING, 0.0), (0.0, MISSING), (95.0, 10.0), (10.0, 200.0),
+    (float('nan'), 0.0), (0.0, float('inf')),
+]
+
+# iGate positions that radius terms without a centre are measured from
+CENTERS = ((55.9, -3.2), (-33.9, 151.2), (0.0, 179.9))
+
+FILTERS = [
+    'M', '*1', 'country:GB,FR', 'battery', 'min:10 max:200', 'M battery country:GB',
+    'radius:500', 'radius:300@0,180', 'radius:800@89.5,0', 'radius:1500@-89,-170',
+    'box:-20,170,20,-170', 'box:80,-180,90,180', 'box:-90,-10,-60,10', 'box:50,-10,60,2 G',
+    'radius:20000@0,0', 'radius:0@90,0',
+]
+
+
+def random_position(rng):
+    if rng.random() < 0.2:
+        return rng.choice(EDGE_POSITIONS)
+    if rng.random() < 0.2:
+        # Clustered, so several keys share a cell
+        return 55.0 + rng.uniform(-1, 1), -3.0 + rng.uniform(-1, 1)
+    return rng.uniform(-90, 90), rng.uniform(-180, 180)
+
+
+def random_station(rng, last_seen):
+    latitude, longitude = random_position(rng)
+    return Station(
+        last_seen=last_seen,
+        country=rng.choice([MISSING, 'GB', 'fr', 'DE']),
+        distance=rng.choice([MISSING, rng.uniform(0, 400)]),
+        battery=rng.choice([MISSING, '4.1']),
+        latitude=latitude,
+        longitude=longitude,
+    )
+
+
+def brute_force(records, station_filter, centers=CENTERS):
+    if station_filter is None:
+        return list(records)
+    return [key for key, record in records.items()
+            if station_filter.matches(station_callsign(key, record), record, True, centers)]
+
+
+def exact_in_box(points, box):
+    return {key for key, (latitude, longitude) in points.items()
+            if valid_position(latitude, longitude) and in_box(latitude, longitude, box)}
+
+
+def exact_in_radius(points, center, km):
+    return {key for key, (latitude, longitude) in points.items()
+            if valid_position(latitude, longitude) and haversine(latitude, longitude, *center) <= km}
+
+
+@pytest.fixture
+def grid_points():
+    rng = random.Random(1)
+    grid = SpatialGrid()
+    points = {}
+    for key in range(3000):
+        latitude, longitude = random_position(rng)
+        points[key] = (latitude, longitude)
+        if valid_position(latitude, longitude):
+            grid.add(key, latitude, longitude)
+    return grid, points
+
+
+@pytest.mark.parametrize('box', [
+    (-20.0, 170.0, 20.0, -170.0),  # Across the antimeridian
+    (80.0, -180.0, 90.0, 180.0),   # Polar cap
+    (-90.0, -180.0, 90.0, 180.0),  # Everything
+    (54.0, -4.0, 56.0, -2.0),
+    (0.0, 179.9, 0.0, 180.0),
+])
+def test_grid_box_is_a_superset(grid_points, box):
+    grid, points = grid_points
+    assert exact_in_box(points, box) <= grid.box(*box)
+
+
+@pytest.mark.parametrize('center, km', [
+    ((0.0, 180.0), 300.0), ((0.0, -179.9), 50.0), ((89.9, 0.0), 500.0), ((-90.0, 0.0), 1000.0),
+    ((55.0, -3.0), 10.0), ((55.0, -3.0), 0.0), ((10.0, 20.0), 20000.0), ((70.0, 179.0), 2500.0),
+])
+def test_grid_radius_is_a_superset(grid_points, center, km):
+    grid, points = grid_points
+    assert exact_in_radius(points, center, km) <= grid.radius(*center, km)
+
+
+def test_grid_moves_and_removes_keys():
+    grid = SpatialGrid()
+    grid.add('a', 10.0, 10.0)
+    grid.add('a', -10.0, -10.0)
+    assert grid.box(9.0, 9.0, 11.0, 11.0) == set()
+    assert grid.box(-11.0, -11.0, -9.0, -9.0) == {'a'}
+    grid.remove('a')
+    assert grid.cells == {} and grid.key_cells == {}
+
+
+@pytest.mark.parametrize('text', FILTERS)
+def test_index_matches_brute_force_under_updates_and_retention(text):
+    rng = random.Random(text)
+    station_filter = parse_filter(text)
+    records = OrderedDict()
+    index = TableIndex(records, station_callsign)
+    index.centers = CENTERS
+    retention = {'max_rows': 150, 'max_age': 400}
+    callsigns = [f"{rng.choice('MGFD')}{rng.randint(0, 9)}{rng.choice('ABC')}" for _ in range(250)]
+
+    for step in range(1500):
+        if step == 300:
+            index.set_filter(station_filter)
+        if step == 1000:
+            index.set_filter(None)
+        if step == 1200:
+            index.set_filter(station_filter)  # Reuses the index kept current while unfiltered
+
+        callsign = rng.choice(callsigns)
+        station = records.get(callsign)
+        if station is None:
+            records[callsign] = random_station(rng, float(step))
+        else:
+            changed = random_station(rng, float(step))
+            for name in ('last_seen', 'country', 'distance', 'battery', 'latitude', 'longitude'):
+                setattr(station, name, getattr(changed, name))
+            records.move_to_end(callsign)
+        index.update(callsign)
+        if step % 7 == 0:
+            enforce_retention(records, retention, float(step), index)
+
+        if step % 10 == 0 or step in (300, 1000, 1200):
+            assert list(index.visible()) == brute_force(records, index.filter)
+
+    assert list(index.visible()) == brute_force(records, station_filter)
+
+
+def test_index_follows_moving_centers():
+    records = OrderedDict()
+    index = TableIndex(records, station_callsign)
+    records['M0A'] = Station(last_seen=0.0, latitude=10.0, longitude=10.0)
+    records['M0B'] = Station(last_seen=1.0, latitude=-10.0, longitude=-10.0)
+    for key in records:
+        index.update(key)
+    index.centers = ((10.0, 10.1),)
+    index.set_filter(parse_filter('radius:50'))
+    assert list(index.visible()) == ['M0A']
+    index.centers = ((-10.0, -10.1),)
+    index.set_filter(index.filter)
+    assert list(index.visible()) == ['M0B']
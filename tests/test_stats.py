@@ -0,0 +1,60 @@
+import math
+import random
+import statistics
+
+import pytest
+
+from lora_aprs_core import (
+    MISSING, PACKET_RATE_WINDOW, SIGNAL_EWMA_ALPHA, SignalStats, Station, rate_at, record_heard,
+)
+
+
+def test_empty_and_single_value():
+    stats = SignalStats()
+    assert stats.deviation() is MISSING
+    stats.add(-7.5)
+    assert (stats.count, stats.mean, stats.minimum, stats.maximum, stats.ewma) == (1, -7.5, -7.5, -7.5, -7.5)
+    assert stats.deviation() is MISSING
+
+
+def test_matches_the_batch_statistics():
+    rng = random.Random(0)
+    values = [rng.gauss(-100.0, 15.0) for _ in range(5000)]
+    stats = SignalStats()
+    ewma = values[0]
+    for value in values:
+        stats.add(value)
+        ewma += SIGNAL_EWMA_ALPHA * (value - ewma)
+    assert stats.count == len(values)
+    assert stats.mean == pytest.approx(statistics.fmean(values))
+    assert stats.deviation() == pytest.approx(statistics.stdev(values))
+    assert stats.minimum == min(values)
+    assert stats.maximum == max(values)
+    assert stats.ewma == pytest.approx(ewma)
+
+
+def test_deviation_is_stable_for_large_offsets():
+    # Welford's update keeps the precision a naive sum of squares would lose
+    stats = SignalStats()
+    for value in (1e9 + 4, 1e9 + 7, 1e9 + 13, 1e9 + 16):
+        stats.add(value)
+    assert stats.deviation() == pytest.approx(statistics.stdev([4, 7, 13, 16]))
+
+
+def test_rate_decays_between_packets():
+    station = Station(last_seen=0.0)
+    for second in range(10):
+        record_heard(station, float(second))
+    expected = sum(math.exp(-(9 - second) / PACKET_RATE_WINDOW) for second in range(10))
+    assert station.rate == pytest.approx(expected)
+    assert rate_at(station, 9.0 + PACKET_RATE_WINDOW) == pytest.approx(expected / math.e)
+    assert rate_at(station, 1e9) == 0.0
+
+
+def test_record_heard_keeps_signal_statistics():
+    station = Station(last_seen=0.0)
+    record_heard(station, 0.0, snr=5.0)
+    record_heard(station, 1.0, rssi=-90.0)
+    record_heard(station, 2.0, snr=7.0, rssi=-100.0)
+    assert station.snr_stats.count == 2 and station.snr_stats.mean == 6.0
+    assert station.rssi_stats.count == 2 and station.rssi_stats.mean == -95.0